@@ -0,0 +1,522 @@
+"""sserver / dserver 端到端压测
+
+在本机启动 sserver（SQLite 元数据，或 --store mongo 连 MONGOURI）和 dserver，
+并发跑分块上传、整文件 / Range 下载、sserver 分页列表和 dserver 大目录列表，
+统计吞吐、p50/p99 延迟和每个 worker 的峰值 RSS，结果写成 JSON 方便在提交之间对比。
+
+    python -m benchmarks.load
+    python -m benchmarks.load --concurrency 32 --upload-size 256MiB --output new.json --compare old.json
+
+只依赖标准库，HTTP 客户端是一个最小的 keep-alive HTTP/1.1 实现；RSS 读 /proc，仅支持 Linux。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sserver import model
+from sserver.layout import setup_layout, shard_path
+from sserver.model import FileRecord, MsgRecord
+from sserver.store import SQLiteStore
+
+from benchmarks.pagination import seed
+
+READ_SIZE = 256 * 1024
+UNITS = {"k": 1024, "m": 1024**2, "g": 1024**3}
+
+
+def parse_size(value: str) -> int:
+    """64MiB / 8M / 4096 这样的大小"""
+    value = value.strip().lower().rstrip("ib")
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+class HTTPError(Exception):
+    pass
+
+
+class Client:
+    """单个 keep-alive 连接，响应体只计数不保存（除非 keep_body）"""
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes = b"",
+        headers: Optional[Dict[str, str]] = None,
+        keep_body: bool = False,
+    ) -> Tuple[int, Dict[str, str], int, bytes]:
+        """返回 (状态码, 响应头, 响应体字节数, 响应体)"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(body)}"]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        if body:
+            self.writer.write(body)
+        try:
+            await self.writer.drain()
+            return await self._response(method, keep_body)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _response(self, method: str, keep_body: bool):
+        head = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        status = int(head[0].split(" ", 2)[1])
+        headers = {}
+        for line in head[1:]:
+            if line:
+                key, _, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+
+        chunks: List[bytes] = []
+        size = 0
+        if method == "HEAD" or status in (204, 304):
+            pass
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            while n := int((await self.reader.readline()).split(b";", 1)[0], 16):
+                size += await self._read(n, chunks if keep_body else None)
+                await self.reader.readexactly(2)
+            await self.reader.readuntil(b"\r\n")
+        elif "content-length" in headers:
+            size = await self._read(int(headers["content-length"]), chunks if keep_body else None)
+        else:
+            data = await self.reader.read()
+            size = len(data)
+            chunks.append(data)
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, headers, size, b"".join(chunks)
+
+    async def _read(self, n: int, chunks: Optional[List[bytes]]) -> int:
+        left = n
+        while left:
+            data = await self.reader.read(min(left, READ_SIZE))
+            if not data:
+                raise HTTPError("connection closed in body")
+            left -= len(data)
+            if chunks is not None:
+                chunks.append(data)
+        return n
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+
+class Stats:
+    def __init__(self):
+        self.costs: List[float] = []
+        self.bytes = 0
+        self.errors = 0
+        self.start = self.end = 0.0
+
+    def add(self, cost: float, nbytes: int):
+        self.costs.append(cost)
+        self.bytes += nbytes
+
+    def summary(self) -> dict:
+        seconds = max(self.end - self.start, 1e-9)
+        costs = sorted(self.costs)
+        return {
+            "requests": len(costs),
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "rps": round(len(costs) / seconds, 1),
+            "mib_per_s": round(self.bytes / seconds / 1024**2, 1),
+            "p50_ms": round(statistics.median(costs) * 1000, 2) if costs else None,
+            "p99_ms": round(costs[min(len(costs) - 1, int(len(costs) * 0.99))] * 1000, 2) if costs else None,
+        }
+
+
+async def run_pool(host: str, port: int, jobs: list, concurrency: int, func: Callable) -> Stats:
+    """concurrency 个连接并发消费 jobs，func(client, job) 返回本次传输的字节数"""
+    stats = Stats()
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+
+    async def worker():
+        client = Client(host, port)
+        try:
+            while not queue.empty():
+                job = queue.get_nowait()
+                t = time.perf_counter()
+                try:
+                    nbytes = await func(client, job)
+                except (HTTPError, OSError, asyncio.IncompleteReadError, ValueError) as e:
+                    stats.errors += 1
+                    if stats.errors <= 3:
+                        print(f"    error: {e!r}", file=sys.stderr)
+                    continue
+                stats.add(time.perf_counter() - t, nbytes)
+        finally:
+            await client.close()
+
+    stats.start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(min(concurrency, len(jobs)) or 1)])
+    stats.end = time.perf_counter()
+    return stats
+
+
+def expect(status: int, *accepted: int):
+    if status not in accepted:
+        raise HTTPError(f"unexpected status {status}")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def children(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids = [int(it) for it in f.read().split()]
+    except OSError:
+        return []
+    return pids + [c for p in pids for c in children(p)]
+
+
+def proc_status(pid: int) -> Dict[str, str]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            return dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+
+
+def worker_name(pid: int) -> Optional[str]:
+    """sanic 通过环境变量 SANIC_WORKER_NAME 标记 worker 进程"""
+    try:
+        with open(f"/proc/{pid}/environ", "rb") as f:
+            for item in f.read().split(b"\0"):
+                if item.startswith(b"SANIC_WORKER_NAME="):
+                    return item.split(b"=", 1)[1].decode()
+    except OSError:
+        pass
+    return None
+
+
+class Server:
+    """子进程方式启动的服务，记录主进程和各 worker 的峰值 RSS"""
+
+    def __init__(self, name: str, args: List[str], env: Dict[str, str], log_path: str):
+        self.name = name
+        self.port = free_port()
+        self.args = args
+        self.env = {**os.environ, **env, "HOST": "127.0.0.1", "PORT": str(self.port), "DEBUG": "False"}
+        self.log_path = log_path
+        self.proc: Optional[subprocess.Popen] = None
+        self.peak_rss: Dict[int, Tuple[str, int]] = {}
+
+    async def start(self, timeout: float = 60):
+        self.log = open(self.log_path, "wb")
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", *self.args], env=self.env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+        deadline = time.monotonic() + timeout
+        client = Client("127.0.0.1", self.port)
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with {self.proc.returncode}, see {self.log_path}")
+            try:
+                status, *_ = await client.request("GET", "/")
+                if status == 200:
+                    return
+            except (OSError, asyncio.IncompleteReadError):
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError(f"{self.name} not ready in {timeout}s, see {self.log_path}")
+
+    def sample(self):
+        if self.proc is None:
+            return
+        for pid in [self.proc.pid] + children(self.proc.pid):
+            role = "main" if pid == self.proc.pid else worker_name(pid)
+            if role and (hwm := proc_status(pid).get("VmHWM")):
+                kib = int(hwm.split()[0])
+                self.peak_rss[pid] = (role, max(kib, self.peak_rss.get(pid, (role, 0))[1]))
+
+    def memory(self) -> List[dict]:
+        return [
+            {"pid": pid, "role": role, "peak_rss_mib": round(kib / 1024, 1)}
+            for pid, (role, kib) in sorted(self.peak_rss.items())
+        ]
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(30)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.log.close()
+
+
+async def sample_loop(servers: List[Server], interval: float = 0.2):
+    while True:
+        for server in servers:
+            server.sample()
+        await asyncio.sleep(interval)
+
+
+async def seed_records(sqlite_path: str, count: int):
+    """直接往 sserver 要用的 SQLite 库里写入 count 条文件记录"""
+    store = SQLiteStore(sqlite_path)
+    for cls in (FileRecord, MsgRecord):
+        store.register(cls.table, cls)
+    await store.connect()
+    old, model.db = model.db, store
+    try:
+        await seed(count)
+    finally:
+        model.db = old
+        await store.close()
+
+
+async def upload_files(server: Server, args, count: int, size: int, chunk_size: int) -> Tuple[Stats, List[str]]:
+    """创建会话 → 并发 PUT 所有分块 → finalize，延迟按分块统计"""
+    client = Client("127.0.0.1", server.port)
+    sessions = []
+    for n in range(count):
+        body = json.dumps({"filename": f"bench-{n}.bin", "size": size, "chunk_size": chunk_size}).encode()
+        status, _, _, data = await client.request(
+            "POST", "/upload/session", body, {"Content-Type": "application/json"}, keep_body=True
+        )
+        expect(status, 200)
+        sessions.append(json.loads(data)["data"])
+    payload = os.urandom(chunk_size)
+
+    async def put(c: Client, job):
+        sid, index = job
+        length = min(chunk_size, size - index * chunk_size)
+        status, *_ = await c.request("PUT", f"/upload/session/{sid}/{index}", payload[:length])
+        expect(status, 200)
+        return length
+
+    jobs = [(s["id"], i) for s in sessions for i in range(s["chunks"])]
+    random.shuffle(jobs)
+    stats = await run_pool("127.0.0.1", server.port, jobs, args.concurrency, put)
+
+    ids = []
+    for s in sessions:
+        status, _, _, data = await client.request("POST", f"/upload/session/{s['id']}/finalize", keep_body=True)
+        expect(status, 200)
+        ids.append(data.decode())
+    await client.close()
+    return stats, ids
+
+
+async def download(server: Server, args, paths: List[str], size: int, range_size: int = 0) -> Stats:
+    async def get(c: Client, path: str):
+        headers = {}
+        if range_size:
+            start = random.randrange(0, max(size - range_size, 1))
+            headers["Range"] = f"bytes={start}-{start + range_size - 1}"
+        status, _, nbytes, _ = await c.request("GET", path, headers=headers)
+        expect(status, 206 if range_size else 200)
+        return nbytes
+
+    jobs = [random.choice(paths) for _ in range(args.requests)]
+    return await run_pool("127.0.0.1", server.port, jobs, args.concurrency, get)
+
+
+async def list_sserver(server: Server, args) -> Stats:
+    """先顺序翻页收集游标，再并发随机请求各页"""
+
+    def path(cursor: Optional[str]) -> str:
+        return f"/files?size={args.page_size}" + (f"&cursor={cursor}" if cursor else "")
+
+    cursors: List[Optional[str]] = []
+    client = Client("127.0.0.1", server.port)
+    cursor = None
+    while len(cursors) < args.requests:
+        cursors.append(cursor)
+        status, _, _, data = await client.request("GET", path(cursor), keep_body=True)
+        expect(status, 200)
+        if not (cursor := json.loads(data)["data"]["next"]):
+            break
+    await client.close()
+
+    async def get(c: Client, cursor: Optional[str]):
+        status, _, nbytes, _ = await c.request("GET", path(cursor))
+        expect(status, 200)
+        return nbytes
+
+    jobs = [random.choice(cursors) for _ in range(args.requests)]
+    return await run_pool("127.0.0.1", server.port, jobs, args.concurrency, get)
+
+
+async def list_dserver(server: Server, args, pages: int) -> Stats:
+    async def get(c: Client, job):
+        sort, page = job
+        status, _, nbytes, _ = await c.request("GET", f"/big/?format=json&sort={sort}&size={args.page_size}&page={page}")
+        expect(status, 200)
+        return nbytes
+
+    jobs = [(random.choice(["name", "size", "mtime"]), random.randint(1, pages)) for _ in range(args.requests)]
+    return await run_pool("127.0.0.1", server.port, jobs, args.concurrency, get)
+
+
+def make_listing_dir(path: str, count: int):
+    os.makedirs(path)
+    for n in range(count):
+        with open(os.path.join(path, f"f{n:07d}.txt"), "wb") as f:
+            f.write(b"x" * (n % 4096))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: dict, new: dict):
+    print(f"\n{'scenario':<20} {'rps':>18} {'p50_ms':>18} {'p99_ms':>18}")
+    for name, result in new["results"].items():
+        if not (base := old.get("results", {}).get(name)):
+            continue
+        cells = []
+        for key in ("rps", "p50_ms", "p99_ms"):
+            a, b = base.get(key), result.get(key)
+            change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else "-"
+            cells.append(f"{b} ({change})")
+        print(f"{name:<20} {cells[0]:>18} {cells[1]:>18} {cells[2]:>18}")
+
+
+async def bench(args, tmp: str) -> dict:
+    upload_dir = os.path.join(tmp, "upload")
+    serve_dir = os.path.join(tmp, "serve")
+    sqlite_path = os.path.join(tmp, "meta.db")
+    os.makedirs(serve_dir)
+    print(f"preparing {args.listing_entries} files for dserver listing, {args.records} records for sserver")
+    make_listing_dir(os.path.join(serve_dir, "big"), args.listing_entries)
+    if args.store == "sqlite" and args.records:
+        await seed_records(sqlite_path, args.records)
+
+    sserver = Server(
+        "sserver",
+        ["sserver"],
+        {
+            "META_STORE": args.store,
+            "SQLITE_PATH": sqlite_path,
+            "UPLOAD_DIR": upload_dir,
+            "UPLOAD_SHARD_LEVELS": str(args.shard_levels),
+        },
+        os.path.join(tmp, "sserver.log"),
+    )
+    dserver = Server("dserver", ["dserver", "-P", serve_dir], {}, os.path.join(tmp, "dserver.log"))
+    results = {}
+    sampler = None
+    try:
+        await asyncio.gather(sserver.start(), dserver.start())
+        sampler = asyncio.ensure_future(sample_loop([sserver, dserver]))
+
+        def record(name: str, stats: Stats):
+            results[name] = stats.summary()
+            print(f"  {name:<18} " + " ".join(f"{k}={v}" for k, v in results[name].items()))
+
+        size, small = args.upload_size, args.small_size
+        stats, ids = await upload_files(sserver, args, args.upload_files, size, args.chunk_size)
+        record("upload_chunked", stats)
+        _, small_ids = await upload_files(sserver, args, args.upload_files, small, small)
+
+        paths = [f"/{it}" for it in ids]
+        record("download_full", await download(sserver, args, paths, size))
+        record("download_range", await download(sserver, args, paths, size, args.range_size))
+        record("download_small", await download(sserver, args, [f"/{it}" for it in small_ids], small))
+        record("sserver_list", await list_sserver(sserver, args))
+
+        # dserver 直接读 sserver 上传目录里的大文件
+        os.symlink(upload_dir, os.path.join(serve_dir, "files"))
+        setup_layout(args.shard_levels)
+        paths = [f"/files/{os.path.relpath(shard_path(upload_dir, it), upload_dir)}" for it in ids]
+        record("dserver_download", await download(dserver, args, paths, size))
+        pages = max(1, -(-args.listing_entries // args.page_size))
+        record("dserver_list", await list_dserver(dserver, args, pages))
+    finally:
+        if sampler is not None:
+            sampler.cancel()
+        for server in (sserver, dserver):
+            server.sample()
+            server.stop()
+
+    return {
+        "commit": git_commit(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results,
+        "memory": {"sserver": sserver.memory(), "dserver": dserver.memory()},
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", "-c", type=int, default=16, help="concurrent connections")
+    parser.add_argument("--requests", "-n", type=int, default=1000, help="requests per download / listing test")
+    parser.add_argument("--upload-files", type=int, default=8, help="files per upload test")
+    parser.add_argument("--upload-size", type=parse_size, default="64MiB", help="size of large files")
+    parser.add_argument("--chunk-size", type=parse_size, default="8MiB", help="upload chunk size")
+    parser.add_argument("--small-size", type=parse_size, default="64KiB", help="size of small (hot cache) files")
+    parser.add_argument("--range-size", type=parse_size, default="1MiB", help="bytes per range request")
+    parser.add_argument("--records", type=int, default=100000, help="file records seeded for sserver listing (sqlite only)")
+    parser.add_argument("--listing-entries", type=int, default=50000, help="entries in the dserver listing directory")
+    parser.add_argument("--page-size", type=int, default=100, help="listing page size")
+    parser.add_argument("--store", choices=["sqlite", "mongo"], default="sqlite", help="sserver metadata store")
+    parser.add_argument("--shard-levels", type=int, default=0, help="sserver UPLOAD_SHARD_LEVELS")
+    parser.add_argument("--workdir", help="keep data and server logs here instead of a temp dir")
+    parser.add_argument("--output", "-o", help="result json, default bench-<commit>-<time>.json")
+    parser.add_argument("--compare", help="previous result json to compare with")
+    args = parser.parse_args()
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        result = await bench(args, tempfile.mkdtemp(dir=args.workdir))
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            result = await bench(args, tmp)
+
+    for name, procs in result["memory"].items():
+        print(f"  {name} peak rss: " + ", ".join(f"{p['role']}[{p['pid']}]={p['peak_rss_mib']}MiB" for p in procs))
+    output = args.output or f"bench-{result['commit'] or 'unknown'}-{datetime.now():%Y%m%d%H%M%S}.json"
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"saved to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""MongoDB 与 SQLite 元数据后端的 get / list / save 延迟对比
+
+    MONGOURI=mongodb://localhost:27017/ python -m benchmarks.metastore --count 100000
+
+Mongo 连不上时只跑 SQLite。
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import ulid
+
+from sserver import model
+from sserver.model import FileRecord, MsgRecord
+from sserver.store import MongoStore, SQLiteStore
+
+
+@asynccontextmanager
+async def open_store(kind: str):
+    """打开一个独立的压测库，结束后删除"""
+    with tempfile.TemporaryDirectory() as tmp:
+        if kind == "sqlite":
+            store = SQLiteStore(os.path.join(tmp, "bench.db"))
+        else:
+            store = MongoStore(os.environ.get("MONGOURI", "mongodb://localhost:27017/"), "sserver_bench")
+        for cls in (FileRecord, MsgRecord):
+            store.register(cls.table, cls)
+        await store.connect()
+        old, model.db = model.db, store
+        try:
+            yield store
+        finally:
+            model.db = old
+            if kind == "mongo":
+                await store.client.drop_database("sserver_bench")
+            await store.close()
+
+
+def report(name: str, costs):
+    costs = sorted(costs)
+    p99 = costs[min(len(costs) - 1, int(len(costs) * 0.99))]
+    print(f"  {name:<8} n={len(costs):<6} p50={statistics.median(costs):.3f}ms p99={p99:.3f}ms")
+
+
+async def bench(count: int, ops: int):
+    start = datetime.now() - timedelta(seconds=count)
+    records = [FileRecord(f"file-{n}", str(ulid.new()), created_at=start + timedelta(seconds=n)) for n in range(count)]
+    for i in range(0, count, 10000):
+        await model.db.insert_many(FileRecord.table, [it.__dict__ for it in records[i : i + 10000]])
+
+    costs = []
+    for rec in random.sample(records, min(ops, count)):
+        t = time.perf_counter()
+        await FileRecord.get(rec.id)
+        costs.append((time.perf_counter() - t) * 1000)
+    report("get", costs)
+
+    costs, cursor = [], None
+    for _ in range(min(ops, count // 100)):
+        t = time.perf_counter()
+        page = await FileRecord.get_list(size=100, cursor=cursor)
+        costs.append((time.perf_counter() - t) * 1000)
+        cursor = page[-1].cursor
+    report("list", costs)
+
+    costs = []
+    for n in range(ops):
+        t = time.perf_counter()
+        await FileRecord(f"new-{n}").save()
+        costs.append((time.perf_counter() - t) * 1000)
+    report("save", costs)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=100000, help="records")
+    parser.add_argument("--ops", type=int, default=1000, help="operations per test")
+    parser.add_argument("--store", choices=["mongo", "sqlite"], action="append", help="stores to run")
+    args = parser.parse_args()
+
+    for kind in args.store or ["sqlite", "mongo"]:
+        print(kind)
+        try:
+            async with open_store(kind):
+                await bench(args.count, args.ops)
+        except Exception as e:
+            print(f"  skipped: {e!r}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""skip 分页与游标分页在不同深度下的延迟对比
+
+    MONGOURI=mongodb://localhost:27017/ python -m benchmarks.pagination --count 300000
+    python -m benchmarks.pagination --store sqlite
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import ulid
+
+from sserver import model
+from sserver.model import FileRecord
+
+from benchmarks.metastore import open_store
+
+
+async def seed(count: int, batch: int = 10000):
+    await model.db.clear(FileRecord.table)
+    start = datetime.now() - timedelta(seconds=count)
+    for i in range(0, count, batch):
+        docs = [
+            FileRecord(f"file-{n}", str(ulid.new()), created_at=start + timedelta(seconds=n), size=n).__dict__
+            for n in range(i, min(i + batch, count))
+        ]
+        await model.db.insert_many(FileRecord.table, docs)
+
+
+async def timeit(func, repeat: int):
+    costs = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        await func()
+        costs.append((time.perf_counter() - t) * 1000)
+    return statistics.median(costs)
+
+
+async def bench(count: int, size: int, repeat: int):
+    depths = [d for d in (0, 1000, 10000, 50000, 100000, 200000, 500000, 1000000) if d < count]
+    print(f"{'depth':>10} {'skip(ms)':>10} {'cursor(ms)':>11}")
+    for depth in depths:
+        page = depth // size + 1
+        skip_ms = await timeit(lambda: FileRecord.get_list(page=page, size=size), repeat)
+        # 游标取自上一页最后一条，准备过程不计时
+        prev = await FileRecord.get_list(page=page - 1, size=size) if page > 1 else []
+        cursor = prev[-1].cursor if prev else None
+        cursor_ms = await timeit(lambda: FileRecord.get_list(size=size, cursor=cursor), repeat)
+        print(f"{depth:>10} {skip_ms:>10.2f} {cursor_ms:>11.2f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=300000, help="records")
+    parser.add_argument("--size", type=int, default=100, help="page size")
+    parser.add_argument("--repeat", type=int, default=5, help="repeat per depth")
+    parser.add_argument("--store", choices=["mongo", "sqlite"], default="mongo", help="metadata store")
+    args = parser.parse_args()
+
+    async with open_store(args.store):
+        await seed(args.count)
+        await bench(args.count, args.size, args.repeat)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
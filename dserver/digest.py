@@ -0,0 +1,123 @@
+"""文件摘要
+
+大文件按块在独立线程池里计算，事件循环不阻塞，内存占用固定。
+结果以 (inode, size, mtime) 为键保存在文件的扩展属性里，不支持 xattr 的文件系统
+写到缓存目录下的 sidecar 文件；同一 worker 里对同一文件的并发请求共用一次计算。
+"""
+import asyncio
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from sserver.utils import run_sync
+
+BLOCK_SIZE = 1024 * 1024
+ALGORITHMS = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "blake2": hashlib.blake2b,
+    "blake2b": hashlib.blake2b,
+    "blake2s": hashlib.blake2s,
+}
+XATTR_PREFIX = "user.dserver."
+
+
+def hash_file(path: str, algorithm: str) -> str:
+    h = ALGORITHMS[algorithm]()
+    buffer = bytearray(BLOCK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buffer):
+            # hashlib 处理大块数据时会释放 GIL
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def file_key(st: os.stat_result) -> str:
+    return f"{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+class DigestCache:
+    """持久化的摘要缓存，优先写 xattr，失败时写 cache_dir 下按 (dev, inode) 命名的 json"""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def sidecar(self, st: os.stat_result) -> str:
+        return os.path.join(self.cache_dir, f"{st.st_dev:x}-{st.st_ino:x}.json")
+
+    def get(self, path: str, st: os.stat_result, algorithm: str) -> Optional[str]:
+        key = file_key(st)
+        try:
+            value = os.getxattr(path, XATTR_PREFIX + algorithm).decode()
+            stored, _, digest = value.rpartition(":")
+            if stored == key:
+                return digest
+        except (AttributeError, OSError):
+            pass
+        try:
+            with open(self.sidecar(st)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data.get("digests", {}).get(algorithm) if data.get("key") == key else None
+
+    def put(self, path: str, st: os.stat_result, algorithm: str, digest: str):
+        key = file_key(st)
+        try:
+            os.setxattr(path, XATTR_PREFIX + algorithm, f"{key}:{digest}".encode())
+            return
+        except (AttributeError, OSError):
+            pass
+        path = self.sidecar(st)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        if data.get("key") != key:
+            data = {"key": key, "digests": {}}
+        data["digests"][algorithm] = digest
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(path + f".{os.getpid()}.tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + f".{os.getpid()}.tmp", path)
+
+
+class DigestService:
+    def __init__(self, cache_dir: str, workers: int = 2):
+        self.cache = DigestCache(cache_dir)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="digest")
+        self.inflight: Dict[Tuple, asyncio.Future] = {}
+
+    def compute(self, path: str, st: os.stat_result, algorithm: str) -> str:
+        digest = hash_file(path, algorithm)
+        # 计算期间文件被修改时不缓存
+        if file_key(os.stat(path)) == file_key(st):
+            try:
+                self.cache.put(path, st, algorithm, digest)
+            except OSError:
+                pass
+        return digest
+
+    async def digest(self, path: str, algorithm: str = "md5") -> str:
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"unsupported algorithm: {algorithm}")
+        # stat 和查缓存走文件系统线程池，不排在大文件计算后面
+        st = await run_sync(os.stat, path)
+        if digest := await run_sync(self.cache.get, path, st, algorithm):
+            return digest
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, algorithm)
+        if (future := self.inflight.get(key)) is None:
+            loop = asyncio.get_running_loop()
+            future = asyncio.ensure_future(loop.run_in_executor(self.executor, self.compute, path, st, algorithm))
+            self.inflight[key] = future
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # shield：某个请求断开不影响其他等待同一结果的请求
+        return await asyncio.shield(future)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
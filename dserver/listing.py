@@ -0,0 +1,89 @@
+"""目录列表
+
+一次 os.scandir 取出 DirEntry 的类型、大小和修改时间，结果按目录缓存，
+目录 mtime 不变就直接复用，排序后的结果也缓存在同一份列表上。
+"""
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sserver.cache import LRUCache
+from sserver.utils import run_sync
+
+SORT_KEYS = ("name", "size", "mtime")
+
+
+class Entry(NamedTuple):
+    name: str
+    is_dir: bool
+    size: int
+    mtime: float
+
+    def json(self):
+        return {"name": self.name, "is_dir": self.is_dir, "size": self.size, "mtime": self.mtime}
+
+
+def scan(path: str) -> List[Entry]:
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                st = entry.stat()
+                is_dir = entry.is_dir()
+            except OSError:
+                # 悬空的符号链接等
+                continue
+            entries.append(Entry(entry.name, is_dir, 0 if is_dir else st.st_size, st.st_mtime))
+    return entries
+
+
+class Listing:
+    def __init__(self, path: str, mtime_ns: int, entries: List[Entry]):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.entries = entries
+        self.checked = time.monotonic()
+        self.views: Dict[Tuple[str, bool], List[Entry]] = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def sorted(self, key: str = "name", reverse: bool = False) -> List[Entry]:
+        if (view := self.views.get((key, reverse))) is None:
+            if key == "name":
+                view = sorted(self.entries, key=lambda x: x.name.lower(), reverse=reverse)
+            else:
+                # 先按名字排一遍，同大小 / 同时间的条目顺序稳定
+                view = sorted(self.sorted("name"), key=lambda x: getattr(x, key), reverse=reverse)
+            self.views[(key, reverse)] = view
+        return view
+
+    def page(self, key: str = "name", reverse: bool = False, page: int = 1, size: int = 0) -> List[Entry]:
+        entries = self.sorted(key, reverse)
+        if size <= 0:
+            return entries
+        return entries[(page - 1) * size : page * size]
+
+
+class ListingCache(LRUCache):
+    """按目录缓存的列表，容量按条目数计算
+
+    目录 mtime 只反映增删改名，文件原地写入不会改变它，因此超过 ttl 的列表也会重新扫描。
+    刚修改过的目录不缓存，避免 mtime 精度不足时漏掉同一时刻的后续变更。
+    """
+
+    def __init__(self, max_entries: int = 1_000_000, ttl: float = 60):
+        super().__init__(max_entries, max_entries)
+        self.ttl = ttl
+
+    async def listing(self, path: str) -> Listing:
+        st = await run_sync(os.stat, path)
+        cached: Optional[Listing] = self.get(path)
+        if cached is not None and cached.mtime_ns == st.st_mtime_ns and time.monotonic() - cached.checked < self.ttl:
+            return cached
+        listing = Listing(path, st.st_mtime_ns, await run_sync(scan, path))
+        if time.time() - st.st_mtime > 1:
+            self.put(path, listing, max(len(listing), 1))
+        else:
+            self.pop(path)
+        return listing
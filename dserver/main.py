@@ -1,68 +1,161 @@
 from functools import partial
-from glob import glob
-import hashlib
 from mimetypes import guess_type
 import os
+import stat
 import argparse
+from typing import Optional
 from sanic import Blueprint, Sanic, Request
-from sanic.response import html, text, file_stream
+from html import escape
+from sanic.response import html, json, text
+from sanic.log import logger
 from sanic.worker.loader import AppLoader
-from urllib.parse import unquote, quote
+from urllib.parse import unquote, quote, urlencode
 
 from dserver.utils import TimeStampToTime  # , file_stream
+from dserver.listing import SORT_KEYS, ListingCache
+from dserver.digest import ALGORITHMS, DigestService
+from dserver.upload import ChecksumError, parse_checksum, resolve_dir, save_upload
+from dserver.search import SEARCH_MODES, TreeIndex, index_path
+from sserver import fs
+from sserver.fs import setup_fs
+from sserver.compress import PrecompressedCache, add_vary, compress_response, compressible, request_encoding
+from sserver.archive import FORMATS, create_archive, walk
+from sserver.download import file_etag, send_archive, send_file
+from sserver.limits import add_arguments, admitted, apply_arguments, setup_limits
+from sserver.metrics import observe_upload, registry, setup_metrics
+from sserver.stream import MultipartError
+from sserver.utils import run_sync
+
+PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+
+async def stat_path(path: str) -> Optional[os.stat_result]:
+    """文件不存在时返回 None"""
+    try:
+        return await fs.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
 
 
 def create_bp(prefix: str = "/"):
     bp = Blueprint("app", prefix)
 
     @bp.get("/")
-    def index(request: Request, show_time: bool = False, dd=""):
-        index_html = get_file_list(
-            request.app.config.static_path,
-            request.app.config.static_path,
-            show_time,
-            dd,
-        )
-        return html(index_html)
+    async def index(request: Request):
+        return await list_dir(request, request.app.config.static_path)
 
     @bp.get("/robots.txt")
     def robots_txt(request: Request):
         return text("""User-Agent: *\nDisallow: /""")
 
-    @bp.route("/upload", methods=["POST", "GET"])
-    async def upload(request: Request):
-        if request.method == "GET":
-            return html(
-                html(
-                    """<form action="/upload" method="post" enctype="multipart/form-data">
-            <input type="file" name="file" id="file">
+    @bp.get("/upload")
+    async def upload_form(request: Request):
+        return html(
+            """<form action="upload" method="post" enctype="multipart/form-data">
+            <input type="file" name="uploaded_file" id="file">
             <input type="submit" value="上传">
         </form>"""
+        )
+
+    @bp.post("/upload", stream=True)
+    async def upload(request: Request):
+        """流式上传，可选 dir 指定子目录，checksum=算法:摘要 校验内容"""
+        try:
+            save_dir = resolve_dir(request.app.config.static_path, request.args.get("dir"))
+        except ValueError as e:
+            return text(str(e), status=400)
+        if not await fs.isdir(save_dir):
+            return text("directory not exists!", status=404)
+        async with admitted(request):
+            try:
+                path, created, digest, meter = await save_upload(
+                    request,
+                    ("uploaded_file", "file"),
+                    save_dir,
+                    request.app.config.REQUEST_MAX_SIZE,
+                    request.args.get("checksum"),
                 )
+            except (MultipartError, ChecksumError) as e:
+                return text(str(e), status=400)
+        if created and digest:
+            st = await run_sync(os.stat, path)
+            algorithm, _ = parse_checksum(request.args.get("checksum"))
+            await run_sync(request.app.ctx.digests.cache.put, path, st, algorithm, digest)
+        if created and (index := request.app.ctx.search) is not None:
+            await run_sync(index.refresh_path, path)
+        observe_upload("dserver", meter.bytes, meter.elapsed)
+        logger.info(f"upload {path}: {meter.bytes} bytes in {meter.elapsed:.3f}s")
+        return text(os.path.basename(path))
+
+    @bp.get("/search")
+    async def search(request: Request):
+        """按文件名搜索整棵目录树，mode 可选 prefix、substring（默认）、token，format=json 时返回 json"""
+        index = request.app.ctx.search
+        query = request.args.get("q", "").strip()
+        mode = request.args.get("mode", "substring")
+        try:
+            page = max(int(request.args.get("page", "1")), 1)
+            size = min(max(int(request.args.get("size", str(PAGE_SIZE))), 0), MAX_PAGE_SIZE) or MAX_PAGE_SIZE
+        except ValueError as e:
+            return text(str(e), status=400)
+        if index is None:
+            return text("search is disabled", status=404)
+        if not query:
+            return text("q is required", status=400)
+        if mode not in SEARCH_MODES:
+            return text(f"unsupported mode: {mode}", status=400)
+        if not index.ready:
+            return text("search index is building, try again later", status=503, headers={"Retry-After": "5"})
+        found, has_next = await run_sync(index.search, query, mode, (page - 1) * size, size)
+        if request.args.get("format") == "json":
+            return json(
+                {
+                    "code": 0,
+                    "msg": "success",
+                    "data": {
+                        "page": page,
+                        "size": size,
+                        "next": page + 1 if has_next else None,
+                        "entries": [{"path": f"/{path}", "is_dir": is_dir} for path, is_dir in found],
+                    },
+                }
             )
+        items = [
+            f"<li><a href='{prefix}{quote(path)}{'/' if is_dir else ''}'>{escape(path)}{'/' if is_dir else ''}</a></li>"
+            for path, is_dir in found
+        ]
+        args = {"q": query, "mode": mode, "size": size if size != PAGE_SIZE else ""}
+        pages = []
+        if page > 1:
+            pages.append(f'<a href="?{urlencode({**args, "page": page - 1})}">&laquo; {page - 1}</a>')
+        if has_next:
+            pages.append(f'<a href="?{urlencode({**args, "page": page + 1})}">{page + 1} &raquo;</a>')
+        return html(
+            """<html><body><form action="{0}search"><input name="q" value="{1}"> <select name="mode">{2}</select>
+            <input type="submit" value="搜索"></form><ul>{3}</ul><p>{4}</p></body></html>""".format(
+                prefix,
+                escape(query),
+                "".join(f"<option{' selected' if it == mode else ''}>{it}</option>" for it in SEARCH_MODES),
+                "\n".join(items),
+                " ".join(pages),
+            )
+        )
 
-        else:
-            file = request.files.get("uploaded_file")
-            file_name = file.filename
-            save_path = os.path.join(request.app.config.static_path, file_name)
-            if not os.path.exists(save_path):
-                with open(save_path, "wb") as f:
-                    f.write(file.body)
-            return text(file_name)
-
-    @bp.get("/md5/{filename:path}")
-    async def md5(request: Request):
-        filename = request.args.get("filename")
+    @bp.get("/md5/<filename:path>")
+    async def md5(request: Request, filename: str):
+        """文件摘要，algo 可选 md5（默认）、sha1、sha256、blake2b、blake2s"""
+        filename = request.args.get("filename") or unquote(filename)
+        algorithm = request.args.get("algo", "md5").lower()
         path = os.path.join(request.app.config.static_path, filename)
-        if not os.path.exists(path):
+        if not (st := await stat_path(path)):
             return text("file not exists!", status=404)
-        elif os.path.isdir(path):
+        elif stat.S_ISDIR(st.st_mode):
             return text("is a directory")
+        if algorithm not in ALGORITHMS:
+            return text(f"unsupported algorithm: {algorithm}", status=400)
 
-        with open(path, "rb") as f:
-            data = f.read()
-        file_md5 = hashlib.md5(data).hexdigest()
-        return text(file_md5)
+        return text(await request.app.ctx.digests.digest(path, algorithm))
 
     @bp.get("/<filename:path>")
     async def get_file(request: Request, filename: str):
@@ -72,10 +165,10 @@ def create_bp(prefix: str = "/"):
         encoding = request.args.get("encoding")
 
         path = os.path.join(request.app.config.static_path, unquote(filename))
-        if not os.path.exists(path):
+        if not (st := await stat_path(path)):
             return text("file not exists!", status=404)
-        elif os.path.isdir(path):
-            return html(get_file_list(request.app.config.static_path, path, show_time, direct_download, encoding))
+        elif stat.S_ISDIR(st.st_mode):
+            return await list_dir(request, path)
 
         content_type, e = guess_type(path)
         if direct_download:
@@ -84,45 +177,120 @@ def create_bp(prefix: str = "/"):
             content_type = "text/plain"
         content_type += f"; charset={(e or (encoding or 'utf-8').upper())}"
 
-        headers = {"Content-Length": str(os.stat(path).st_size), "Content-Type": content_type}
-
-        return await file_stream(path, chunk_size=4096, headers=headers)
-
-    def get_file_list(static_path, path, st: bool = False, dd: bool = False, encoding: str = "utf-8"):
-        sub_path = [it for it in path.replace(static_path, "").rsplit("/") if it]
-        query_args = "&".join(
-            [
-                _
-                for _ in [
-                    f"dd={int(dd)}" if dd else "",
-                    f"st={int(st)}" if st else "",
-                    f"encoding={encoding}" if encoding else "",
-                ]
-                if _
-            ]
+        headers, compression = {}, None
+        if compressible(content_type) and not e:
+            add_vary(headers)
+            if (compression := request_encoding(request, content_type)) and (
+                variant := await request.app.ctx.precompressed.variant(path, st, compression)
+            ):
+                path = variant
+                headers["Content-Encoding"] = compression
+            else:
+                compression = None
+
+        # 和 sserver 共用发送逻辑：sendfile 零拷贝、Range 和条件请求，
+        # 处理函数在最后一个字节发出后才返回，请求耗时能被完整记录
+        async with admitted(request):
+            return await send_file(
+                request,
+                path,
+                content_type,
+                headers=headers,
+                etag=file_etag(f"{st.st_ino:x}", st, compression),
+                mtime=st.st_mtime,
+            )
+
+    async def list_dir(request: Request, path: str):
+        """目录列表，支持 sort=name|size|mtime、order=desc、page/size 分页和 format=json
+
+        archive=zip|tar 时把整个目录打包下载，deflate=1 时 zip 压缩存储
+        """
+        if fmt := request.args.get("archive"):
+            if fmt not in FORMATS:
+                return text(f"unsupported archive format: {fmt}", status=400)
+            deflate = bool(int(request.args.get("deflate", "0")))
+            name = os.path.basename(os.path.abspath(path)) or "root"
+            members = await run_sync(walk, path, name)
+            async with admitted(request):
+                return await send_archive(request, create_archive(members, fmt, deflate), f"{name}.{fmt}")
+
+        show_time = bool(int(request.args.get("st", "0")))
+        direct_download = bool(int(request.args.get("dd", "0")))
+        encoding = request.args.get("encoding")
+        sort = request.args.get("sort", "name")
+        if sort not in SORT_KEYS:
+            sort = "name"
+        reverse = request.args.get("order", "asc") == "desc"
+        try:
+            page = max(int(request.args.get("page", "1")), 1)
+            size = min(max(int(request.args.get("size", str(PAGE_SIZE))), 0), MAX_PAGE_SIZE) or MAX_PAGE_SIZE
+        except ValueError as e:
+            return text(str(e), status=400)
+
+        rel_path = os.path.relpath(path, request.app.config.static_path)
+        listing = await request.app.ctx.listings.listing(path)
+        entries = listing.page(sort, reverse, page, size)
+        if request.args.get("format") == "json":
+            return json(
+                {
+                    "code": 0,
+                    "msg": "success",
+                    "data": {
+                        "path": "/" if rel_path == "." else f"/{rel_path}",
+                        "total": len(listing),
+                        "page": page,
+                        "size": size,
+                        "entries": [it.json() for it in entries],
+                    },
+                }
+            )
+        query = {"dd": int(direct_download) or "", "st": int(show_time) or "", "encoding": encoding or ""}
+        return html(
+            render_list(
+                request.app.config.static_path,
+                path,
+                entries,
+                {k: v for k, v in query.items() if v},
+                {"sort": sort, "order": "desc" if reverse else "", "size": size if size != PAGE_SIZE else ""},
+                page,
+                page * size < len(listing),
+                show_time,
+            )
         )
-        html_str = """<html><head><style>span:hover{{background-color:#f2f2f2}}li{{weight:70%;}}</style></head><body><h2>{0}</h2><ul>{1}</ul></body></html>""".format(
-            "→".join(
-                [f'<a href="{prefix}"><span> / </span></a>']
-                + [
-                    f'<a href="{prefix}{"/".join([_ for _ in sub_path[:sub_path.index(it) + 1]])}/"><span>{it}</span></a>'
-                    for it in sub_path
-                ]
-            ),
-            "\n".join(
-                [
-                    "<li><a href='{0}{2}{4}'>{1}{2}</a><span style='margin=20px'>{3}</span></li>".format(
-                        quote(os.path.basename(it)),
-                        os.path.basename(it),
-                        "/" if os.path.isdir(it) else "",
-                        TimeStampToTime(os.path.getmtime(it)) if st != 0 else "",
-                        f"?{query_args}" if query_args else "",
-                    )
-                    for it in sorted(glob(path + "/*"), key=lambda x: x.lower())
-                ],
-            ),
+
+    def render_list(static_path, path, entries, query, view, page, has_next, st: bool = False):
+        sub_path = [it for it in os.path.relpath(path, static_path).split(os.sep) if it and it != "."]
+        # 文件链接只带下载相关参数，目录链接再带上排序方式
+        file_args = urlencode(query)
+        dir_args = urlencode({**query, **{k: v for k, v in view.items() if v and v != "name"}})
+        crumbs = [f'<a href="{prefix}"><span> / </span></a>'] + [
+            f'<a href="{prefix}{quote("/".join(sub_path[: i + 1]))}/"><span>{escape(it)}</span></a>'
+            for i, it in enumerate(sub_path)
+        ]
+        items = [
+            "<li><a href='{0}{2}{4}'>{1}{2}</a><span style='margin=20px'>{3}</span></li>".format(
+                quote(it.name),
+                escape(it.name),
+                "/" if it.is_dir else "",
+                TimeStampToTime(it.mtime) if st else "",
+                f"?{dir_args if it.is_dir else file_args}" if (dir_args if it.is_dir else file_args) else "",
+            )
+            for it in entries
+        ]
+        archives = " ".join(f'<a href="?archive={it}">{it}</a>' for it in FORMATS)
+        sorts = " ".join(
+            f'<a href="?{urlencode({**query, "sort": key, **({"order": "desc"} if key == view["sort"] and not view.get("order") else {})})}">{key}</a>'
+            for key in SORT_KEYS
+        )
+        view = {k: v for k, v in view.items() if v}
+        pages = []
+        if page > 1:
+            pages.append(f'<a href="?{urlencode({**query, **view, "page": page - 1})}">&laquo; {page - 1}</a>')
+        if has_next:
+            pages.append(f'<a href="?{urlencode({**query, **view, "page": page + 1})}">{page + 1} &raquo;</a>')
+        return """<html><head><style>span:hover{{background-color:#f2f2f2}}li{{weight:70%;}}</style></head><body><h2>{0}</h2><p>{1} | {4}</p><ul>{2}</ul><p>{3}</p></body></html>""".format(
+            "→".join(crumbs), sorts, "\n".join(items), " ".join(pages), archives
         )
-        return html_str
 
     return bp
 
@@ -134,6 +302,54 @@ def create_app(prefix: str = "/", upload_dir: str = "./"):
     bp = create_bp(prefix)
     app = Sanic(f"dserver")
     app.config.static_path = upload_dir
+    # 阻塞的文件系统调用都在 FS_WORKERS 个线程里排队
+    setup_fs(app)
+    app.config.REQUEST_MAX_SIZE = int(os.environ.get("REQUEST_MAX_SIZE", 10 * 1024 * 1024 * 1024))
+    app.config.LISTING_CACHE_SIZE = int(os.environ.get("LISTING_CACHE_SIZE", 1_000_000))
+    app.config.LISTING_CACHE_TTL = float(os.environ.get("LISTING_CACHE_TTL", 60))
+    app.ctx.listings = ListingCache(app.config.LISTING_CACHE_SIZE, app.config.LISTING_CACHE_TTL)
+    app.config.DIGEST_WORKERS = int(os.environ.get("DIGEST_WORKERS", 2))
+    # 文件系统不支持 xattr 时摘要缓存写到这里
+    app.config.DIGEST_CACHE_DIR = os.environ.get(
+        "DIGEST_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "dserver", "digests")
+    )
+    app.ctx.digests = DigestService(app.config.DIGEST_CACHE_DIR, app.config.DIGEST_WORKERS)
+    # 文件名搜索：每个 worker 在内存里维护整棵树的索引，按目录 mtime 增量刷新，
+    # 索引文件存在 SEARCH_INDEX_DIR，重启后直接加载
+    app.config.SEARCH_INDEX = os.environ.get("SEARCH_INDEX", "True").lower() == "true"
+    app.config.SEARCH_REFRESH_INTERVAL = float(os.environ.get("SEARCH_REFRESH_INTERVAL", 60))
+    app.config.SEARCH_INDEX_DIR = os.environ.get(
+        "SEARCH_INDEX_DIR", os.path.join(os.path.expanduser("~"), ".cache", "dserver", "search")
+    )
+    app.ctx.search = (
+        TreeIndex(upload_dir, index_path(app.config.SEARCH_INDEX_DIR, upload_dir)) if app.config.SEARCH_INDEX else None
+    )
+    if app.ctx.search is not None:
+        registry.add_collector(app.ctx.search.collect)
+
+    # 文本类文件和列表页按 Accept-Encoding 压缩，文件的压缩版本缓存在 COMPRESS_CACHE_DIR
+    app.config.COMPRESS = os.environ.get("COMPRESS", "True").lower() == "true"
+    app.config.COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+    app.config.COMPRESS_MAX_SIZE = int(os.environ.get("COMPRESS_MAX_SIZE", 64 * 1024 * 1024))
+    app.config.COMPRESS_CACHE_DIR = os.environ.get(
+        "COMPRESS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "dserver", "compressed")
+    )
+    app.ctx.precompressed = PrecompressedCache(
+        app.config.COMPRESS_CACHE_DIR, app.config.COMPRESS_LEVEL, app.config.COMPRESS_MAX_SIZE
+    )
+    app.register_middleware(compress_response, "response")
+    setup_metrics(app)
+    setup_limits(app)
+
+    @app.listener("after_server_start")
+    async def start_search_index(app, loop):
+        if app.ctx.search is not None:
+            app.add_task(app.ctx.search.run(app.config.SEARCH_REFRESH_INTERVAL), name="search_index")
+
+    @app.listener("after_server_stop")
+    async def close_digests(app, loop):
+        app.ctx.digests.close()
+
     app.blueprint(bp)
     return app
 
@@ -143,12 +359,14 @@ def parseargs():
     parser.add_argument("--host", "-H", type=str, default="0.0.0.0", help="host")
     parser.add_argument("--port", "-p", type=int, default=8000, help="port")
     parser.add_argument("--prefix", "-a", type=str, default="/", help="prefix")
+    add_arguments(parser)
     parser.add_argument("--path", "-P", type=str, default="./", help="dir path")
     return parser.parse_args()
 
 
 def main():
     args = parseargs()
+    apply_arguments(args)
     loader = AppLoader(factory=partial(create_app, args.prefix, args.path))
     app = loader.load()
     ssl = {
@@ -0,0 +1,319 @@
+"""目录树的文件名搜索
+
+整棵目录树的文件名放在内存里：trigram 倒排表用于子串和词前缀，一两个字符的名字前缀单独建表用于短前缀，
+条目 id 按加入顺序递增，倒排表天然有序。查询取最短的倒排表作为候选逐个校验，凑够一页就停。
+不足三个字符的子串和词查询没有倒排表可用，分段扫描全表，段与段之间释放锁。
+
+刷新时逐个 stat 目录，只有 mtime 变化的目录才重新 scandir，和已有的子条目对比增删；
+删除只打标记，标记过多时整体重排。索引定期 pickle 到 SEARCH_INDEX_DIR，重启后加载再增量刷新，
+不需要重新遍历整棵树。每个 worker 各自维护一份，只有拿到文件锁的 worker 写盘。
+"""
+import asyncio
+import hashlib
+import os
+import pickle
+import re
+import threading
+import time
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sanic.log import logger
+
+from sserver.metrics import registry
+from sserver.utils import run_sync, try_lock
+
+SEARCH_MODES = ("prefix", "substring", "token")
+INDEX_VERSION = 1
+ROOT = 0
+# 全表扫描时每次持有锁检查的条目数
+SCAN_BATCH = 50_000
+
+INDEX_ENTRIES = registry.gauge("search_index_entries", "文件名索引的条目数，live 有效、dead 待回收", ("state",))
+
+
+def trigrams(name: str) -> set:
+    return {name[i : i + 3] for i in range(len(name) - 2)}
+
+
+def query_tokens(query: str) -> List[str]:
+    return re.findall(r"[^\W_]+", query.lower())
+
+
+class TreeIndex:
+    def __init__(self, root: str, index_path: str = ""):
+        self.root = os.path.abspath(root)
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.ready = False
+        # 条目重新编号（compact / load）时加一，分段扫描据此判断 id 是否还有效
+        self.generation = 0
+        self.reset()
+
+    def reset(self):
+        # 条目 0 是根目录
+        self.names: List[Optional[str]] = [""]
+        self.lowers: List[Optional[str]] = [""]
+        self.parents = array("i", [-1])
+        self.kinds = bytearray(b"\1")
+        # 已展开的目录：id -> [mtime_ns, 子条目 id 列表]，符号链接指向的目录不展开
+        self.dirs: Dict[int, list] = {ROOT: [0, []]}
+        self.grams: Dict[str, array] = {}
+        # 一两个字符的名字前缀
+        self.heads: Dict[str, array] = {}
+        self.dead = 0
+
+    def __len__(self):
+        return len(self.names) - 1 - self.dead
+
+    def path(self, id_: int) -> str:
+        parts = []
+        while id_ > ROOT:
+            parts.append(self.names[id_])
+            id_ = self.parents[id_]
+        return "/".join(reversed(parts))
+
+    def add(self, name: str, parent: int, is_dir: bool) -> int:
+        id_ = len(self.names)
+        lower = name.lower()
+        self.names.append(name)
+        self.lowers.append(name if lower == name else lower)
+        self.parents.append(parent)
+        self.kinds.append(is_dir)
+        for gram in trigrams(lower):
+            self.grams.setdefault(gram, array("i")).append(id_)
+        for head in {lower[:1], lower[:2]}:
+            self.heads.setdefault(head, array("i")).append(id_)
+        return id_
+
+    def remove(self, id_: int):
+        """条目连同展开过的子树标记为删除，倒排表里的 id 在重排时清理"""
+        stack = [id_]
+        while stack:
+            it = stack.pop()
+            self.names[it] = self.lowers[it] = None
+            self.dead += 1
+            if (state := self.dirs.pop(it, None)) is not None:
+                stack.extend(state[1])
+
+    def compact(self):
+        """有效条目重新编号，重建倒排表"""
+        names, parents, kinds = self.names, self.parents, self.kinds
+        children = {id_: state[1] for id_, state in self.dirs.items()}
+        mtimes = {id_: state[0] for id_, state in self.dirs.items()}
+        self.reset()
+        self.generation += 1
+        self.dirs[ROOT][0] = mtimes[ROOT]
+        stack = [(ROOT, ROOT)]
+        while stack:
+            old, new = stack.pop()
+            for child in children[old]:
+                if names[child] is None:
+                    continue
+                id_ = self.add(names[child], new, bool(kinds[child]))
+                self.dirs[new][1].append(id_)
+                if child in children:
+                    self.dirs[id_] = [mtimes[child], []]
+                    stack.append((child, id_))
+        logger.info(f"search index compacted: {len(self)} entries, {len(names) - len(self.names)} removed")
+
+    def scan_dir(self, id_: int) -> bool:
+        """目录 mtime 变化时重新读取子条目，返回是否有变更；目录不存在时返回 False，由上级目录的刷新删除"""
+        with self.lock:
+            if (state := self.dirs.get(id_)) is None:
+                return False
+            path = os.path.join(self.root, self.path(id_))
+        try:
+            st = os.stat(path)
+            if st.st_mtime_ns == state[0]:
+                return False
+            entries = {}
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        entries[entry.name] = (entry.is_dir(), entry.is_dir(follow_symlinks=False))
+                    except OSError:
+                        continue
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return False
+        changed = False
+        with self.lock:
+            if (state := self.dirs.get(id_)) is None:
+                return False
+            kept = {}
+            for child in state[1]:
+                name = self.names[child]
+                if name in entries and bool(self.kinds[child]) == entries[name][0]:
+                    kept[name] = child
+                else:
+                    self.remove(child)
+                    changed = True
+            children = list(kept.values())
+            for name, (is_dir, expand) in entries.items():
+                if name in kept:
+                    continue
+                child = self.add(name, id_, is_dir)
+                children.append(child)
+                changed = True
+                if expand:
+                    self.dirs[child] = [0, []]
+            state[1] = children
+            # 刚修改过的目录下次还要重新读，避免 mtime 精度不足时漏掉同一时刻的后续变更
+            state[0] = st.st_mtime_ns if time.time() - st.st_mtime > 1 else 0
+        return changed
+
+    def refresh(self) -> int:
+        """从根目录开始按 mtime 增量刷新，返回有变更的目录数"""
+        changed, stack = 0, [ROOT]
+        while stack:
+            id_ = stack.pop()
+            changed += self.scan_dir(id_)
+            with self.lock:
+                if (state := self.dirs.get(id_)) is not None:
+                    stack.extend(it for it in state[1] if it in self.dirs)
+        with self.lock:
+            if self.dead > max(len(self), 100_000):
+                self.compact()
+            self.ready = True
+        return changed
+
+    def refresh_path(self, path: str) -> bool:
+        """立即刷新 path 所在的目录，上传完成后调用"""
+        rel = os.path.relpath(os.path.dirname(os.path.abspath(path)), self.root)
+        with self.lock:
+            id_ = ROOT
+            for part in [] if rel == "." else rel.split(os.sep):
+                id_ = next((it for it in self.dirs.get(id_, [0, []])[1] if self.names[it] == part), -1)
+                if id_ not in self.dirs:
+                    return False
+        return self.scan_dir(id_)
+
+    def candidates(self, needles: Iterable[str], head: str = "") -> Optional[Iterable[int]]:
+        """包含所有 needle 的条目的候选 id，取最短的倒排表；没有可用的倒排表时返回 None，需要全表扫描"""
+        lists = [self.grams.get(gram, ()) for needle in needles for gram in trigrams(needle)]
+        if head:
+            lists.append(self.heads.get(head, ()))
+        return min(lists, key=len) if lists else None
+
+    def matcher(self, query: str, mode: str) -> Tuple[Optional[Iterable[int]], Callable[[str], bool]]:
+        query = query.lower()
+        if mode == "prefix":
+            return self.candidates([query], query[:2]), lambda name: name.startswith(query)
+        if mode == "token":
+            tokens = query_tokens(query)
+            if not tokens:
+                return (), lambda name: False
+            # 词前缀：前面不是字母或数字
+            patterns = [re.compile(r"(?<![^\W_])" + re.escape(it)) for it in tokens]
+            return self.candidates(tokens), lambda name: all(p.search(name) for p in patterns)
+        return self.candidates([query]), lambda name: query in name
+
+    def match(self, ids: Iterable[int], test: Callable[[str], bool], skip: int, want: int) -> Tuple[list, int]:
+        """在 ids 中跳过 skip 个命中后取至多 want 个，返回 ([(相对路径, 是否目录)], 剩余的 skip)；调用方持有锁"""
+        found = []
+        for id_ in ids:
+            name = self.lowers[id_]
+            if name is None or not test(name):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            found.append((self.path(id_), bool(self.kinds[id_])))
+            if len(found) >= want:
+                break
+        return found, skip
+
+    def search(self, query: str, mode: str = "substring", offset: int = 0, limit: int = 100):
+        """返回 ([(相对路径, 是否目录)], 是否还有更多)，按条目加入顺序排列"""
+        with self.lock:
+            ids, test = self.matcher(query, mode)
+            if ids is not None:
+                found, _ = self.match(ids, test, offset, limit + 1)
+                return found[:limit], len(found) > limit
+            generation = self.generation
+        # 没有可用的倒排表，分段扫描，刷新和其他查询不用等整表扫完；中途重新编号过就从头再来
+        found, skip, start = [], offset, 1
+        while len(found) <= limit:
+            with self.lock:
+                if self.generation != generation:
+                    found, skip, start, generation = [], offset, 1, self.generation
+                end = min(start + SCAN_BATCH, len(self.lowers))
+                if start >= end:
+                    break
+                batch, skip = self.match(range(start, end), test, skip, limit + 1 - len(found))
+            found += batch
+            start = end
+        return found[:limit], len(found) > limit
+
+    def save(self):
+        # 锁内只做浅拷贝（列表和数组的复制是整块内存拷贝），耗时的序列化在锁外进行
+        with self.lock:
+            state = {
+                "version": INDEX_VERSION,
+                "root": self.root,
+                "names": list(self.names),
+                "parents": array("i", self.parents),
+                "kinds": bytearray(self.kinds),
+                "dirs": {id_: [mtime, list(children)] for id_, (mtime, children) in self.dirs.items()},
+                "grams": {gram: array("i", ids) for gram, ids in self.grams.items()},
+                "heads": {head: array("i", ids) for head, ids in self.heads.items()},
+                "dead": self.dead,
+            }
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.index_path)
+
+    def load(self) -> bool:
+        try:
+            with open(self.index_path, "rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"search index {self.index_path} unreadable: {e!r}")
+            return False
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION or data.get("root") != self.root:
+            return False
+        with self.lock:
+            for key in ("names", "parents", "kinds", "dirs", "grams", "heads", "dead"):
+                setattr(self, key, data[key])
+            self.lowers = [None if it is None else it.lower() for it in self.names]
+            self.generation += 1
+            self.ready = True
+        return True
+
+    def collect(self):
+        INDEX_ENTRIES.set("live", value=len(self))
+        INDEX_ENTRIES.set("dead", value=self.dead)
+
+    async def run(self, interval: float = 60):
+        """启动时加载索引文件，之后每 interval 秒刷新一次，有变更时拿到文件锁的 worker 写盘"""
+        start = time.perf_counter()
+        if await run_sync(self.load):
+            logger.info(f"search index loaded: {len(self)} entries in {time.perf_counter() - start:.3f}s")
+        await run_sync(os.makedirs, os.path.dirname(self.index_path), 0o755, True)
+        lock_fd = await run_sync(try_lock, f"{self.index_path}.lock")
+        saved = False
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    changed = await run_sync(self.refresh)
+                    if lock_fd is not None and (changed or not saved):
+                        await run_sync(self.save)
+                        saved = True
+                except Exception as e:
+                    logger.error(f"search index refresh failed: {e!r}")
+                else:
+                    logger.debug(f"search index refreshed: {changed} dirs in {time.perf_counter() - start:.3f}s")
+                await asyncio.sleep(interval)
+        finally:
+            if lock_fd is not None:
+                os.close(lock_fd)
+
+
+def index_path(cache_dir: str, root: str) -> str:
+    """每个服务目录一个索引文件"""
+    return os.path.join(cache_dir, hashlib.sha1(os.path.abspath(root).encode()).hexdigest()[:16] + ".idx")
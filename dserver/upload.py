@@ -0,0 +1,106 @@
+"""流式上传
+
+请求体边解析边按固定缓冲区写入目标目录下的临时文件，写完后原子地放到最终位置，
+已存在的同名文件不会被覆盖；可选在写盘的同时计算摘要并与客户端给出的值比对。
+"""
+import errno
+import os
+import uuid
+from typing import Iterable, Optional, Tuple
+
+from sserver.stream import DATA, END, PART, HashingWriter, MultipartError, MultipartParser, Throughput, part_filename
+from sserver import fs
+from sserver.limits import body_chunks
+from sserver.utils import run_sync
+
+from dserver.digest import ALGORITHMS
+
+TMP_PREFIX = ".upload-"
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+def parse_checksum(value: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """checksum 参数形如 sha256:<hex>"""
+    if not value:
+        return None, None
+    algorithm, _, expected = value.partition(":")
+    algorithm = algorithm.lower()
+    if algorithm not in ALGORITHMS or not expected:
+        raise ChecksumError(f"invalid checksum: {value}")
+    return algorithm, expected.lower()
+
+
+def resolve_dir(root: str, subdir: Optional[str]) -> str:
+    """上传目标目录，必须位于 root 之内"""
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, (subdir or "").lstrip("/")))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"invalid directory: {subdir}")
+    return path
+
+
+def place(tmp: str, dst: str) -> bool:
+    """把临时文件放到 dst，dst 已存在时返回 False 且不覆盖"""
+    try:
+        os.link(tmp, dst)
+    except FileExistsError:
+        return False
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EXDEV):
+            raise
+        # 不支持硬链接的文件系统
+        if os.path.exists(dst):
+            return False
+        os.rename(tmp, dst)
+        return True
+    os.remove(tmp)
+    return True
+
+
+async def save_upload(
+    request,
+    fields: Iterable[str],
+    save_dir: str,
+    max_size: float = float("inf"),
+    checksum: Optional[str] = None,
+):
+    """保存 multipart 请求中的第一个文件字段，返回 (文件路径, 是否新写入, 摘要, Throughput)"""
+    algorithm, expected = parse_checksum(checksum)
+    parser = MultipartParser.from_content_type(request.headers.get("content-type"))
+    meter = Throughput()
+    filename, writer, digest = None, None, None
+    tmp = os.path.join(save_dir, f"{TMP_PREFIX}{uuid.uuid4().hex}")
+    try:
+        async for data in body_chunks(request):
+            meter.add(len(data))
+            if meter.bytes > max_size:
+                raise MultipartError("request body too large")
+            for event, value in parser.feed(data):
+                if event == PART:
+                    name, part_name = part_filename(value)
+                    if name in fields and part_name and filename is None:
+                        filename = part_name
+                        writer = await HashingWriter(tmp, ALGORITHMS[algorithm]() if algorithm else None).open()
+                elif event == DATA and writer:
+                    await writer.write(value)
+                elif event == END and writer:
+                    await writer.close()
+                    digest = writer.hasher.hexdigest() if writer.hasher else None
+                    writer = None
+        parser.close()
+        if filename is None:
+            raise MultipartError(f"missing file field: {'/'.join(fields)}")
+        if expected and digest != expected:
+            raise ChecksumError(f"{algorithm} mismatch: expected {expected}, got {digest}")
+        dst = os.path.join(save_dir, filename)
+        created = await run_sync(place, tmp, dst)
+    except BaseException:
+        if writer:
+            await writer.close(flush=False)
+        raise
+    finally:
+        await fs.remove(tmp, missing_ok=True)
+    return dst, created, digest, meter
@@ -1 +1 @@
-from . import main, model, filters, utils
+from . import main, model, filters, utils, stream, session, download, cache, reconcile, compress, archive, metrics, maintenance, limits, events, blobs, layout, cluster, fs, bulk
@@ -0,0 +1,440 @@
+"""流式打包下载
+
+边读文件边生成 ZIP / TAR，不落临时文件，内存占用与文件大小无关，发送时等待
+客户端消费（response.send 会等待传输缓冲区排空）。
+
+TAR 和存储模式（不压缩）的 ZIP 布局在开始前就能完全确定，所以有 Content-Length，
+支持 Range 断点续传；ZIP 的 CRC 写在数据描述符和中央目录里，续传时只对需要的文件补算。
+deflate 模式的 ZIP 长度无法预知，只能顺序输出。
+"""
+import hashlib
+import os
+import struct
+import tarfile
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sserver.utils import run_sync
+
+READ_SIZE = 1024 * 1024
+# 小块数据（文件头、小文件）攒到这么大再发送，减少写调用次数
+SEND_BUFFER_SIZE = 256 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+MAX_ENTRIES = 0xFFFF
+
+FORMATS = {
+    "zip": "application/zip",
+    "tar": "application/x-tar",
+}
+
+
+@dataclass
+class Member:
+    """归档中的一项，path 为空表示目录"""
+
+    arcname: str
+    path: Optional[str]
+    size: int
+    mtime: float
+
+    @property
+    def is_dir(self):
+        return self.path is None
+
+
+def walk(root: str, prefix: str = "") -> List[Member]:
+    """递归列出 root 下的目录和普通文件，按名字排序，跳过符号链接"""
+    members = []
+
+    def visit(path: str, arcdir: str):
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda x: x.name)
+        for entry in entries:
+            arcname = f"{arcdir}{entry.name}"
+            try:
+                if entry.is_symlink():
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                if entry.is_dir(follow_symlinks=False):
+                    members.append(Member(arcname + "/", None, 0, st.st_mtime))
+                    visit(entry.path, arcname + "/")
+                elif entry.is_file(follow_symlinks=False):
+                    members.append(Member(arcname, entry.path, st.st_size, st.st_mtime))
+            except OSError:
+                continue
+
+    if prefix:
+        prefix = prefix.strip("/") + "/"
+        members.append(Member(prefix, None, 0, os.stat(root).st_mtime))
+    visit(root, prefix)
+    return members
+
+
+def unique_names(names: List[str]) -> List[str]:
+    """同名文件加上序号：a.txt, a (1).txt"""
+    seen, ret = set(), []
+    for name in names:
+        base, ext = os.path.splitext(name)
+        candidate, i = name, 1
+        while candidate in seen:
+            candidate, i = f"{base} ({i}){ext}", i + 1
+        seen.add(candidate)
+        ret.append(candidate)
+    return ret
+
+
+class Output:
+    """合并小块数据后再发送"""
+
+    def __init__(self, send: Callable[[bytes], Awaitable]):
+        self.send = send
+        self.buffer = bytearray()
+
+    async def write(self, data: bytes):
+        if len(data) >= SEND_BUFFER_SIZE and not self.buffer:
+            await self.send(data)
+            return
+        self.buffer += data
+        if len(self.buffer) >= SEND_BUFFER_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        if self.buffer:
+            await self.send(bytes(self.buffer))
+            self.buffer.clear()
+
+
+def read_block(fd: int, offset: int, size: int, crc: Optional[int] = None) -> Tuple[bytes, Optional[int]]:
+    data = os.pread(fd, size, offset)
+    if len(data) != size:
+        raise EOFError("file changed while archiving")
+    return data, (zlib.crc32(data, crc) if crc is not None else None)
+
+
+def file_crc(path: str, size: int) -> int:
+    crc, offset = 0, 0
+    with open(path, "rb") as f:
+        while offset < size:
+            data = f.read(min(READ_SIZE, size - offset))
+            if not data:
+                raise EOFError(f"{path} changed while archiving")
+            crc = zlib.crc32(data, crc)
+            offset += len(data)
+    return crc
+
+
+RAW, FILE, DESCRIPTOR, CENTRAL = "raw", "file", "descriptor", "central"
+
+
+class Archive:
+    """预先确定布局的归档：pieces 为 (类型, 长度, 数据) 列表，可以从任意偏移开始输出"""
+
+    content_type = ""
+    needs_crc = False
+
+    def __init__(self, members: List[Member]):
+        self.members = members
+        self.pieces: List[Tuple[str, int, object]] = []
+        self.crcs: Dict[int, int] = {}
+
+    @property
+    def size(self) -> int:
+        return sum(length for _, length, _ in self.pieces)
+
+    @property
+    def etag(self) -> str:
+        h = hashlib.sha1(type(self).__name__.encode())
+        for m in self.members:
+            h.update(f"{m.arcname}\0{m.size}\0{m.mtime}\0".encode(errors="surrogateescape"))
+        return f'"{h.hexdigest()}"'
+
+    async def write(self, send, offset: int = 0, count: Optional[int] = None, sendfile=None):
+        """输出 [offset, offset + count) 部分；sendfile(fd, offset, count) 可用时文件内容走零拷贝"""
+        count = self.size - offset if count is None else count
+        out = Output(send)
+        pos = 0
+        for kind, length, obj in self.pieces:
+            if count <= 0:
+                break
+            if pos + length <= offset:
+                pos += length
+                continue
+            lo = offset - pos
+            n = min(length - lo, count)
+            if kind == FILE:
+                await self.write_file(out, obj, lo, n, sendfile)
+            else:
+                data = obj if kind == RAW else await self.render(kind, obj)
+                await out.write(data[lo : lo + n])
+            offset += n
+            count -= n
+            pos += length
+        await out.flush()
+
+    async def write_file(self, out: Output, member_index: int, offset: int, count: int, sendfile=None):
+        member = self.members[member_index]
+        # 整个文件顺序输出时顺便算 CRC，否则等需要时再单独计算
+        track = self.needs_crc and offset == 0 and count == member.size and member_index not in self.crcs
+        fd = await run_sync(os.open, member.path, os.O_RDONLY)
+        try:
+            if sendfile is not None and not self.needs_crc:
+                await out.flush()
+                await sendfile(fd, offset, count)
+                return
+            crc = 0 if track else None
+            end = offset + count
+            while offset < end:
+                data, crc = await run_sync(read_block, fd, offset, min(READ_SIZE, end - offset), crc)
+                await out.write(data)
+                offset += len(data)
+            if track:
+                self.crcs[member_index] = crc
+        finally:
+            await run_sync(os.close, fd)
+
+    async def crc(self, member_index: int) -> int:
+        if (crc := self.crcs.get(member_index)) is None:
+            member = self.members[member_index]
+            crc = await run_sync(file_crc, member.path, member.size) if member.size else 0
+            self.crcs[member_index] = crc
+        return crc
+
+    async def render(self, kind: str, obj) -> bytes:
+        raise NotImplementedError
+
+
+class TarArchive(Archive):
+    """PAX 格式的 tar，长文件名和超大文件都由扩展头表示"""
+
+    content_type = FORMATS["tar"]
+
+    def __init__(self, members: List[Member]):
+        super().__init__(members)
+        for i, m in enumerate(members):
+            info = tarfile.TarInfo(m.arcname.rstrip("/") if m.is_dir else m.arcname)
+            info.mtime = int(m.mtime)
+            if m.is_dir:
+                info.type, info.mode = tarfile.DIRTYPE, 0o755
+            else:
+                info.size, info.mode = m.size, 0o644
+            header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+            self.pieces.append((RAW, len(header), header))
+            if m.size:
+                self.pieces.append((FILE, m.size, i))
+                if pad := -m.size % tarfile.BLOCKSIZE:
+                    self.pieces.append((RAW, pad, b"\0" * pad))
+        end = b"\0" * (tarfile.BLOCKSIZE * 2)
+        self.pieces.append((RAW, len(end), end))
+
+
+def dos_time(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+@dataclass
+class ZipEntry:
+    name: bytes
+    offset: int
+    size: int
+    zip64: bool
+    mtime: float
+    is_dir: bool
+    method: int = 0
+    crc: int = 0
+    compressed: int = 0
+
+
+class ZipArchive(Archive):
+    """ZIP，文件头里不写 CRC（通用标志位 3），CRC 和大小写在文件数据后的数据描述符里
+
+    超过 4GB 的文件、偏移和超过 65535 个条目时使用 ZIP64 扩展。
+    """
+
+    content_type = FORMATS["zip"]
+    needs_crc = True
+    FLAGS = 0x08 | 0x800  # 数据描述符 | 文件名为 UTF-8
+
+    def __init__(self, members: List[Member]):
+        super().__init__(members)
+        self.entries: List[ZipEntry] = []
+        self.central: Optional[bytes] = None
+        pos = 0
+        for i, m in enumerate(members):
+            entry = ZipEntry(self.encode(m.arcname), pos, m.size, m.size >= ZIP64_LIMIT, m.mtime, m.is_dir)
+            entry.compressed = m.size
+            self.entries.append(entry)
+            header = self.local_header(entry)
+            self.pieces.append((RAW, len(header), header))
+            if m.size:
+                self.pieces.append((FILE, m.size, i))
+            self.pieces.append((DESCRIPTOR, 24 if entry.zip64 else 16, i))
+            pos += len(header) + m.size + (24 if entry.zip64 else 16)
+        self.central_offset = pos
+        length = sum(46 + len(e.name) + len(self.central_extra(e)) for e in self.entries)
+        length += len(self.end_records(self.central_offset, length))
+        self.pieces.append((CENTRAL, length, None))
+
+    @staticmethod
+    def encode(name: str) -> bytes:
+        return name.encode("utf-8", "surrogateescape")
+
+    def local_header(self, e: ZipEntry) -> bytes:
+        extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0) if e.zip64 else b""
+        size = ZIP64_LIMIT if e.zip64 else 0
+        t, d = dos_time(e.mtime)
+        return (
+            struct.pack(
+                "<IHHHHHIIIHH",
+                0x04034B50,
+                45 if e.zip64 else 20,
+                self.FLAGS,
+                e.method,
+                t,
+                d,
+                0,
+                size,
+                size,
+                len(e.name),
+                len(extra),
+            )
+            + e.name
+            + extra
+        )
+
+    @staticmethod
+    def descriptor(e: ZipEntry) -> bytes:
+        if e.zip64:
+            return struct.pack("<IIQQ", 0x08074B50, e.crc, e.compressed, e.size)
+        return struct.pack("<IIII", 0x08074B50, e.crc, e.compressed, e.size)
+
+    @staticmethod
+    def central_extra(e: ZipEntry) -> bytes:
+        fields = []
+        if e.zip64:
+            fields += [e.size, e.compressed]
+        if e.offset >= ZIP64_LIMIT:
+            fields.append(e.offset)
+        if not fields:
+            return b""
+        return struct.pack(f"<HH{len(fields)}Q", 0x0001, 8 * len(fields), *fields)
+
+    def central_header(self, e: ZipEntry) -> bytes:
+        extra = self.central_extra(e)
+        t, d = dos_time(e.mtime)
+        zip64 = e.zip64 or e.offset >= ZIP64_LIMIT
+        attrs = ((0o40755 << 16) | 0x10) if e.is_dir else (0o100644 << 16)
+        return (
+            struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                0x02014B50,
+                (3 << 8) | 45,
+                45 if zip64 else 20,
+                self.FLAGS,
+                e.method,
+                t,
+                d,
+                e.crc,
+                ZIP64_LIMIT if e.zip64 else e.compressed,
+                ZIP64_LIMIT if e.zip64 else e.size,
+                len(e.name),
+                len(extra),
+                0,
+                0,
+                0,
+                attrs,
+                min(e.offset, ZIP64_LIMIT),
+            )
+            + e.name
+            + extra
+        )
+
+    def end_records(self, offset: int, length: int) -> bytes:
+        count = len(self.entries)
+        ret = b""
+        if count >= MAX_ENTRIES or offset >= ZIP64_LIMIT or length >= ZIP64_LIMIT:
+            ret += struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, length, offset)
+            ret += struct.pack("<IIQI", 0x07064B50, 0, offset + length, 1)
+            return ret + struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, 0xFFFF, 0xFFFF, ZIP64_LIMIT, ZIP64_LIMIT, 0)
+        return ret + struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, count, count, length, offset, 0)
+
+    async def render(self, kind: str, obj) -> bytes:
+        if kind == DESCRIPTOR:
+            entry = self.entries[obj]
+            entry.crc = await self.crc(obj)
+            return self.descriptor(entry)
+        if self.central is None:
+            for i, entry in enumerate(self.entries):
+                entry.crc = await self.crc(i)
+            central = b"".join(self.central_header(e) for e in self.entries)
+            self.central = central + self.end_records(self.central_offset, len(central))
+        return self.central
+
+
+def deflate_block(fd: int, offset: int, size: int, crc: int, compressor) -> Tuple[bytes, int]:
+    data, crc = read_block(fd, offset, size, crc)
+    return compressor.compress(data), crc
+
+
+class DeflatedZipArchive(ZipArchive):
+    """deflate 压缩的 ZIP，压缩后大小未知，只能从头顺序输出"""
+
+    def __init__(self, members: List[Member], level: int = 6):
+        Archive.__init__(self, members)
+        self.level = level
+        self.entries = []
+
+    @property
+    def size(self):
+        return None
+
+    async def write(self, send, offset: int = 0, count: Optional[int] = None, sendfile=None):
+        out = Output(send)
+        pos = 0
+        for m in self.members:
+            # 压缩后可能略大于原文件，留出余量决定是否需要 ZIP64
+            zip64 = m.size + (m.size >> 8) + 1024 >= ZIP64_LIMIT
+            entry = ZipEntry(self.encode(m.arcname), pos, m.size, zip64, m.mtime, m.is_dir, 0 if m.is_dir else 8)
+            header = self.local_header(entry)
+            await out.write(header)
+            pos += len(header)
+            if not m.is_dir:
+                entry.crc, entry.compressed = await self.write_deflated(out, m)
+                pos += entry.compressed
+            descriptor = self.descriptor(entry)
+            await out.write(descriptor)
+            pos += len(descriptor)
+            self.entries.append(entry)
+        central = b"".join(self.central_header(e) for e in self.entries)
+        await out.write(central + self.end_records(pos, len(central)))
+        await out.flush()
+
+    async def write_deflated(self, out: Output, member: Member) -> Tuple[int, int]:
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        crc, written, offset = 0, 0, 0
+        fd = await run_sync(os.open, member.path, os.O_RDONLY)
+        try:
+            while offset < member.size:
+                n = min(READ_SIZE, member.size - offset)
+                data, crc = await run_sync(deflate_block, fd, offset, n, crc, compressor)
+                offset += n
+                if data:
+                    await out.write(data)
+                    written += len(data)
+        finally:
+            await run_sync(os.close, fd)
+        data = compressor.flush()
+        await out.write(data)
+        return crc, written + len(data)
+
+
+def create_archive(members: List[Member], fmt: str = "zip", deflate: bool = False) -> Archive:
+    if fmt == "tar":
+        return TarArchive(members)
+    if fmt == "zip":
+        return DeflatedZipArchive(members) if deflate else ZipArchive(members)
+    raise ValueError(f"unsupported archive format: {fmt}")
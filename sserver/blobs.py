@@ -0,0 +1,185 @@
+"""内容寻址的 blob 存储，相同内容在磁盘上只存一份
+
+blob 放在 UPLOAD_DIR/.blobs/<sha256 前两位>/<sha256>，每条 FileRecord 的文件 UPLOAD_DIR/<id>
+是 blob 的硬链接，记录的 hash 就是它引用的 blob。引用计数直接用 inode 的链接数：blob 本身占一个，
+每个引用它的记录文件占一个，删到只剩 blob 自己时连 blob 一起删除。
+下载、打包、改名仍然按 UPLOAD_DIR/<id> 访问，不需要知道 blob 的存在。
+
+不支持硬链接或链接数到上限时改用 reflink（FICLONE），仍然不行就各自保留一份，只是不再共享空间。
+"""
+import errno
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+from typing import List, Optional, Tuple
+
+from sserver.utils import run_sync
+
+BLOB_DIR = ".blobs"
+READ_SIZE = 1024 * 1024
+# linux/fs.h
+FICLONE = 0x40049409
+
+_digest = re.compile(r"^[0-9a-f]{64}$")
+
+
+def valid_digest(digest: str) -> bool:
+    return bool(_digest.match(digest or ""))
+
+
+def blob_path(upload_dir: str, digest: str) -> str:
+    return os.path.join(upload_dir, BLOB_DIR, digest[:2], digest)
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while data := f.read(READ_SIZE):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def hash_block(fd: int, offset: int, size: int, digest) -> int:
+    data = os.pread(fd, size, offset)
+    digest.update(data)
+    return len(data)
+
+
+async def hash_file_blocks(path: str) -> str:
+    """与 hash_file 相同，但每块单独提交到文件系统线程池，大文件不会长时间占住一个线程"""
+    digest = hashlib.sha256()
+    fd = await run_sync(os.open, path, os.O_RDONLY)
+    try:
+        offset = 0
+        while n := await run_sync(hash_block, fd, offset, READ_SIZE, digest):
+            offset += n
+    finally:
+        await run_sync(os.close, fd)
+    return digest.hexdigest()
+
+
+def reflink(src: str, dst: str) -> bool:
+    """写时复制的克隆，btrfs / xfs 等支持，其他文件系统返回 False"""
+    try:
+        with open(src, "rb") as rf, open(dst, "xb") as wf:
+            try:
+                fcntl.ioctl(wf.fileno(), FICLONE, rf.fileno())
+                return True
+            except OSError:
+                pass
+        os.remove(dst)
+    except OSError:
+        pass
+    return False
+
+
+def clone(src: str, dst: str, copy: bool = False) -> bool:
+    """让 dst 共享 src 的数据：硬链接，其次 reflink；copy 为 True 时最后退化为拷贝。dst 已存在时抛 FileExistsError"""
+    try:
+        os.link(src, dst)
+        return True
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno not in (errno.EMLINK, errno.EPERM, errno.ENOTSUP, errno.EXDEV):
+            raise
+    if reflink(src, dst):
+        return True
+    if copy:
+        shutil.copyfile(src, dst)
+        return True
+    return False
+
+
+def find(upload_dir: str, digest: str, size: int) -> Optional[str]:
+    """内容为 digest、大小为 size 的 blob 路径，没有时返回 None"""
+    if not valid_digest(digest):
+        return None
+    path = blob_path(upload_dir, digest)
+    try:
+        return path if os.stat(path).st_size == size else None
+    except FileNotFoundError:
+        return None
+
+
+def adopt(upload_dir: str, path: str, digest: Optional[str] = None) -> Tuple[str, bool]:
+    """把刚写好的文件纳入 blob 存储，返回 (sha256, 是否复用了已有的 blob)
+
+    blob 不存在时把 path 链接成新的 blob；已存在时用 blob 的链接替换 path，释放重复的数据。
+    """
+    digest = digest or hash_file(path)
+    blob = blob_path(upload_dir, digest)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    try:
+        clone(path, blob)
+        return digest, False
+    except FileExistsError:
+        pass
+    size = os.stat(path).st_size
+    # 点开头，对账和监听都会跳过
+    tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.dedup")
+    try:
+        if os.stat(blob).st_size != size or not clone(blob, tmp):
+            return digest, False
+    except FileNotFoundError:
+        # blob 刚被删掉，下次上传同样内容时再共享
+        return digest, False
+    os.replace(tmp, path)
+    return digest, True
+
+
+def link(upload_dir: str, digest: str, size: int, dst: str) -> bool:
+    """秒传：从已有的 blob 直接生成 dst，不存在时返回 False"""
+    if not (blob := find(upload_dir, digest, size)):
+        return False
+    try:
+        return clone(blob, dst, copy=True)
+    except FileNotFoundError:
+        return False
+
+
+def release(upload_dir: str, path: str, digest: Optional[str] = None) -> int:
+    """删除一条记录的文件，最后一个引用删除后连同 blob 一起删除，返回实际释放的字节数
+
+    与并发的秒传交错时，新文件可能链接到即将删除的 blob 上，数据仍在，只是之后不再与新上传共享。
+    """
+    try:
+        st = os.stat(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    if st.st_nlink <= 1:
+        return st.st_size
+    if not valid_digest(digest or ""):
+        return 0
+    blob = blob_path(upload_dir, digest)
+    try:
+        bst = os.stat(blob)
+        if bst.st_ino == st.st_ino and bst.st_nlink <= 1:
+            os.remove(blob)
+            return bst.st_size
+    except FileNotFoundError:
+        pass
+    return 0
+
+
+def orphan_blobs(upload_dir: str, deadline: float) -> List[Tuple[str, int]]:
+    """没有记录引用（链接数为 1）且 deadline 之前就是这样的 blob，返回 (路径, 大小)"""
+    orphans = []
+    try:
+        shards = os.scandir(os.path.join(upload_dir, BLOB_DIR))
+    except FileNotFoundError:
+        return orphans
+    with shards:
+        for shard in shards:
+            if not shard.is_dir(follow_symlinks=False):
+                continue
+            with os.scandir(shard.path) as it:
+                for entry in it:
+                    st = entry.stat(follow_symlinks=False)
+                    # 链接数变化会更新 ctime
+                    if st.st_nlink <= 1 and st.st_ctime < deadline:
+                        orphans.append((entry.path, st.st_size))
+    return orphans
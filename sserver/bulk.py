@@ -0,0 +1,166 @@
+"""批量上传和批量文件操作
+
+POST /upload/bulk 的请求体是 tar 流（可以是 gzip 压缩的）或带多个文件字段的 multipart，边解析边写盘：
+每个文件先写到 UPLOAD_DIR/.bulk/<新记录 id>，整个请求体收完后再一起移到正式位置，一次 insert_many 登记；
+请求体不完整或格式错误时删除已写入的文件，不登记任何记录。中途崩溃留下的文件由后台维护当作孤儿清理。
+批量删除、改名按 id 列表一次 $in 查询，文件操作在一次线程池调用里完成。
+"""
+import hashlib
+import os
+import posixpath
+import zlib
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from sserver import fs
+from sserver.blobs import release
+from sserver.layout import file_path, prepare, shard_path
+from sserver.limits import body_chunks
+from sserver.model import FileRecord
+from sserver.stream import DATA, END, PART, HashingWriter, MultipartParser, TarParser, Throughput, part_filename
+from sserver.utils import run_sync
+
+BULK_DIR = ".bulk"
+
+
+class BulkError(ValueError):
+    pass
+
+
+@dataclass
+class Ingested:
+    # 包内路径或 multipart 的文件名，结果按它和客户端对应
+    name: str
+    path: str
+    record: FileRecord
+
+
+class Gunzip:
+    """按请求体的前两个字节判断是否为 gzip，是的话边收边解压"""
+
+    def __init__(self):
+        self.head = b""
+        self.decompressor = None
+        self.checked = False
+
+    def feed(self, data: bytes) -> bytes:
+        if not self.checked:
+            self.head += data
+            if len(self.head) < 2:
+                return b""
+            data, self.head, self.checked = self.head, b"", True
+            if data[:2] == b"\x1f\x8b":
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return self.decompressor.decompress(data) if self.decompressor else data
+
+    def flush(self) -> bytes:
+        if not self.checked:
+            return self.head
+        if self.decompressor:
+            if not self.decompressor.eof:
+                raise BulkError("gzip stream ended unexpectedly")
+            return self.decompressor.flush()
+        return b""
+
+
+async def ingest(
+    request, upload_dir: str, max_size: float = float("inf"), max_files: int = 10000
+) -> Tuple[List[Ingested], List[str], Throughput]:
+    """接收整个请求体，返回 (写入的文件, 跳过的 tar 条目, Throughput)；记录还没有保存"""
+    content_type = request.headers.get("content-type", "")
+    multipart = content_type.startswith("multipart/")
+    parser = MultipartParser.from_content_type(content_type) if multipart else TarParser()
+    gunzip = None if multipart else Gunzip()
+    meter = Throughput()
+    items: List[Ingested] = []
+    writer, current, unpacked = None, None, 0
+    bulk_dir = os.path.join(upload_dir, BULK_DIR)
+    await fs.makedirs(bulk_dir)
+
+    def events(data: bytes):
+        nonlocal unpacked
+        if gunzip:
+            data = gunzip.feed(data)
+            # 解压后的大小同样受限，防止压缩炸弹
+            unpacked += len(data)
+            if unpacked > max_size:
+                raise BulkError("unpacked size too large")
+        return parser.feed(data)
+
+    async def handle(event, value):
+        nonlocal writer, current
+        if event == PART:
+            name = value["name"] if not multipart else part_filename(value)[1]
+            if not name or not posixpath.basename(name):
+                return
+            if len(items) >= max_files:
+                raise BulkError(f"too many files, max {max_files}")
+            record = FileRecord(posixpath.basename(name), size=0)
+            path = os.path.join(bulk_dir, record.id)
+            writer = await HashingWriter(path, hashlib.sha256()).open()
+            current = Ingested(name, path, record)
+        elif event == DATA and writer:
+            await writer.write(value)
+        elif event == END and writer:
+            await writer.close()
+            current.record.size, current.record.hash = writer.size, writer.hasher.hexdigest()
+            items.append(current)
+            writer, current = None, None
+
+    try:
+        async for data in body_chunks(request):
+            meter.add(len(data))
+            if meter.bytes > max_size:
+                raise BulkError("request body too large")
+            for event, value in events(data):
+                await handle(event, value)
+        if gunzip:
+            for event, value in parser.feed(gunzip.flush()):
+                await handle(event, value)
+        parser.close()
+        await run_sync(place_files, upload_dir, items)
+    except BaseException:
+        if writer:
+            await writer.close(flush=False)
+            items.append(current)
+        await run_sync(remove_files, [it.path for it in items])
+        raise
+    return items, getattr(parser, "skipped", []), meter
+
+
+def place_files(upload_dir: str, items: List[Ingested]):
+    """收完的文件移到记录 id 对应的位置"""
+    for it in items:
+        path = prepare(shard_path(upload_dir, it.record.id))
+        os.rename(it.path, path)
+        it.path = path
+
+
+def remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def release_files(upload_dir: str, records: List[FileRecord]) -> int:
+    """删除多条记录的文件，返回实际释放的字节数"""
+    return sum(release(upload_dir, file_path(upload_dir, it.id), it.hash) for it in records)
+
+
+def rename_files(upload_dir: str, pairs: List[Tuple[str, str]]) -> List[Optional[str]]:
+    """把 (旧 id, 新 id) 的文件逐个改名，返回每一项的错误信息，成功为 None"""
+    errors = []
+    for src, dst in pairs:
+        try:
+            os.rename(file_path(upload_dir, src), prepare(shard_path(upload_dir, dst)))
+            errors.append(None)
+        except OSError as e:
+            errors.append(f"{type(e).__name__}: {e.strerror or e}")
+    return errors
+
+
+async def rename_back(upload_dir: str, pairs: List[Tuple[str, str]]):
+    await run_sync(rename_files, upload_dir, [(dst, src) for src, dst in pairs])
+
@@ -0,0 +1,224 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray, RawValue
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from sserver import fs
+
+
+class LRUCache:
+    """按字节数限制容量的 LRU 缓存"""
+
+    def __init__(self, max_bytes: int, max_item_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        if (item := self.data.get(key)) is None:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def put(self, key, value, size: int) -> bool:
+        if size > self.max_item_bytes or size > self.max_bytes:
+            return False
+        self.pop(key)
+        self.data[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self.data.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+        return True
+
+    def pop(self, key):
+        if (item := self.data.pop(key, None)) is not None:
+            self.bytes -= item[1]
+            return item[0]
+        return None
+
+    def clear(self):
+        self.data.clear()
+        self.bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "items": len(self.data),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+@dataclass
+class CachedFile:
+    """缓存的小文件：内容加上预先生成好的响应头
+
+    size / mtime_ns 是源文件的，用于校验是否过期；body 可能是压缩后的版本。
+    """
+
+    id: str
+    path: str
+    size: int
+    mtime_ns: int
+    body: bytes
+    mime_type: str
+    headers: Dict[str, str] = field(default_factory=dict)
+    # 记录的过期时间戳，过期后不再从缓存提供
+    expires_at: Optional[float] = None
+
+    async def fresh(self) -> bool:
+        if self.expires_at is not None and time.time() >= self.expires_at:
+            return False
+        try:
+            st = await fs.stat(self.path)
+        except OSError:
+            return False
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime_ns
+
+
+class HotFileCache(LRUCache):
+    """热点小文件缓存，命中时只需要一次 stat 校验（在文件系统线程池里），不查库也不打开文件"""
+
+    async def get(self, key) -> Optional[CachedFile]:
+        if (cached := super().get(key)) and not await cached.fresh():
+            self.pop(key)
+            self.hits -= 1
+            self.misses += 1
+            return None
+        return cached
+
+    def put_file(self, key, cached: CachedFile) -> bool:
+        return self.put(key, cached, len(cached.body))
+
+    def invalidate(self, id_: str):
+        for key in [k for k, (v, _) in self.data.items() if v.id == id_]:
+            self.pop(key)
+
+
+class InvalidationLog:
+    """跨 worker 进程的失效广播
+
+    共享内存里的环形缓冲区加一个递增序号，由主进程创建后经 shared_ctx 传给各 worker。
+    写入方追加 key，读取方比较序号取出新增的 key；落后超过一圈时只能整体清空缓存。
+    """
+
+    SLOTS = 4096
+    WIDTH = 128
+
+    def __init__(self, seq, keys, lock):
+        self.seq = seq
+        self.keys = keys
+        self.lock = lock
+
+    @classmethod
+    def create(cls):
+        return RawValue("Q", 0), RawArray("c", cls.SLOTS * cls.WIDTH), Lock()
+
+    def publish(self, key: str):
+        data = key.encode()[: self.WIDTH].ljust(self.WIDTH, b"\x00")
+        with self.lock:
+            slot = self.seq.value % self.SLOTS
+            self.keys[slot * self.WIDTH : (slot + 1) * self.WIDTH] = data
+            self.seq.value += 1
+
+    def poll(self, since: int) -> Tuple[int, Optional[List[str]]]:
+        """返回 (最新序号, since 之后的 key 列表)，列表为 None 表示已经丢失部分事件"""
+        seq = self.seq.value
+        if seq == since:
+            return seq, []
+        with self.lock:
+            seq = self.seq.value
+            if seq - since > self.SLOTS:
+                return seq, None
+            keys = []
+            for i in range(since, seq):
+                slot = i % self.SLOTS
+                keys.append(self.keys[slot * self.WIDTH : (slot + 1) * self.WIDTH].rstrip(b"\x00").decode(errors="ignore"))
+        return seq, keys
+
+
+MISSING = object()
+
+
+class RecordCache(LRUCache):
+    """元数据记录的读穿透缓存，带 TTL 和不存在记录的负缓存
+
+    每次读取前先同步其他 worker 广播的失效事件。
+    """
+
+    def __init__(self, max_items: int, ttl: float, negative_ttl: float, log: Optional[InvalidationLog] = None):
+        super().__init__(max_items, 1)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.log = log
+        self.seen = log.seq.value if log else 0
+        self.negative_hits = 0
+        self.expired = 0
+
+    def sync(self):
+        if not self.log:
+            return
+        self.seen, keys = self.log.poll(self.seen)
+        if keys is None:
+            self.clear()
+            return
+        for key in keys:
+            if len(key.encode()) >= self.log.WIDTH:
+                # key 被截断过，无法精确失效
+                self.clear()
+                return
+            self.pop(key)
+
+    def lookup(self, key):
+        """返回缓存的记录，负缓存返回 None，未命中返回 MISSING"""
+        self.sync()
+        if (item := super().get(key)) is None:
+            return MISSING
+        value, expires = item
+        if expires < time.monotonic():
+            self.pop(key)
+            self.hits -= 1
+            self.misses += 1
+            self.expired += 1
+            return MISSING
+        if value is None:
+            self.negative_hits += 1
+        return value
+
+    @property
+    def version(self) -> int:
+        return self.log.seq.value if self.log else 0
+
+    def store(self, key, value, version: Optional[int] = None):
+        """写入缓存；version 为查库前的序号，期间 key 被其他 worker 失效时放弃写入"""
+        if self.log and version is not None:
+            _, keys = self.log.poll(version)
+            if keys is None or key in keys:
+                return
+        self.put(key, (value, time.monotonic() + (self.ttl if value is not None else self.negative_ttl)), 1)
+
+    def invalidate(self, key):
+        self.pop(key)
+        if self.log:
+            self.log.publish(key)
+
+    def stats(self):
+        return {**super().stats(), "negative_hits": self.negative_hits, "expired": self.expired}
+
@@ -0,0 +1,432 @@
+"""多节点集群：静态配置的节点列表，上传会话亲和与跨节点取文件
+
+所有节点共用同一个元数据库（MongoDB，或同一台机器上的同一个 SQLite 文件），UPLOAD_DIR 各自独立：
+
+- FileRecord.node 记录文件落在哪个节点
+- 分块上传会话的 id 带上创建节点的后缀 {ulid}.{node}，分块、查询、完成、取消请求转发给该节点
+- 下载时文件不在本地就从所在节点流式转发，可选地同时写入本地 .peer-cache 读穿缓存；删除和改名转发给所在节点
+- 旧版 PATCH 合并时本地缺少的分块从其他节点拉取
+
+节点间用最简单的 HTTP/1.1（每次请求一个连接）通信，转发的请求带 X-Cluster-Hop，对端只在本地处理，不会再转发。
+配置示例：CLUSTER_NODE=n1 CLUSTER_PEERS=n1=http://10.0.0.1:3001,n2=http://10.0.0.2:3001
+"""
+import asyncio
+import hashlib
+import json as jsonlib
+import os
+import re
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiofiles
+from sanic.log import logger
+from sanic.response import json
+
+from sserver import fs
+from sserver.utils import run_sync
+
+HOP_HEADER = "X-Cluster-Hop"
+NODE_HEADER = "X-Cluster-Node"
+CONNECT_TIMEOUT = 5
+READ_SIZE = 256 * 1024
+CACHE_DIR = ".peer-cache"
+# 不转发的逐跳头
+HOP_BY_HOP = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+    "content-length",
+}
+
+_node_name = re.compile(r"^[0-9A-Za-z_-]{1,64}$")
+
+
+class PeerError(ConnectionError):
+    pass
+
+
+class Peer:
+    def __init__(self, name: str, url: str):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"invalid peer url: {url}")
+        self.name = name
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl = parts.scheme == "https"
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+
+
+def parse_peers(value: str) -> Dict[str, Peer]:
+    """n1=http://host:port,n2=http://host:port"""
+    peers = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        name, sep, url = item.strip().partition("=")
+        if not sep or not _node_name.match(name):
+            raise ValueError(f"invalid peer: {item}")
+        peers[name] = Peer(name, url.strip())
+    return peers
+
+
+class PeerResponse:
+    """对端的响应头已经读完，body 由 iter_body 流式读取"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, status: int, headers):
+        self.reader = reader
+        self.writer = writer
+        self.status = status
+        self.headers: List[Tuple[str, str]] = headers
+
+    def header(self, name: str) -> Optional[str]:
+        name = name.lower()
+        return next((v for k, v in self.headers if k.lower() == name), None)
+
+    async def iter_body(self) -> AsyncIterator[bytes]:
+        if self.header("transfer-encoding") == "chunked":
+            while True:
+                size = int((await self.reader.readline()).split(b";", 1)[0].strip() or b"0", 16)
+                if not size:
+                    await self.reader.readline()
+                    return
+                yield await self.reader.readexactly(size)
+                await self.reader.readexactly(2)
+        elif (length := self.header("content-length")) is not None:
+            remaining = int(length)
+            while remaining:
+                if not (data := await self.reader.read(min(READ_SIZE, remaining))):
+                    raise PeerError("peer closed connection early")
+                remaining -= len(data)
+                yield data
+        else:
+            while data := await self.reader.read(READ_SIZE):
+                yield data
+
+    async def read(self) -> bytes:
+        return b"".join([it async for it in self.iter_body()])
+
+    def close(self):
+        self.writer.close()
+
+
+async def peer_request(
+    peer: Peer,
+    method: str,
+    target: str,
+    headers: List[Tuple[str, str]],
+    body=None,
+    timeout: float = 300,
+) -> PeerResponse:
+    """发送一次请求并读完响应头；body 为 bytes 或异步迭代器，后者没有 Content-Length 时按 chunked 发送"""
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(peer.host, peer.port, ssl=peer.ssl or None, limit=READ_SIZE), CONNECT_TIMEOUT
+        )
+    except (OSError, asyncio.TimeoutError) as e:
+        raise PeerError(f"peer {peer.name} unavailable: {e!r}") from e
+    try:
+        lines = [f"{method} {peer.prefix}{target} HTTP/1.1", f"Host: {peer.netloc}", "Connection: close"]
+        lines += [f"{k}: {v}" for k, v in headers]
+        length = dict((k.lower(), v) for k, v in headers).get("content-length")
+        chunked = body is not None and not isinstance(body, bytes) and length is None
+        if isinstance(body, bytes) and length is None:
+            lines.append(f"Content-Length: {len(body)}")
+        elif chunked:
+            lines.append("Transfer-Encoding: chunked")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if isinstance(body, bytes):
+            writer.write(body)
+        elif body is not None:
+            async for data in body:
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data) if chunked else data)
+                await writer.drain()
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        status = int(status_line.split(" ", 2)[1])
+        response_headers = [tuple(it.split(":", 1)) for it in header_lines if ":" in it]
+        return PeerResponse(reader, writer, status, [(k.strip(), v.strip()) for k, v in response_headers])
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+        writer.close()
+        raise PeerError(f"peer {peer.name} failed: {e!r}") from e
+
+
+class PeerCache:
+    """从其他节点取来的文件在本地的读穿缓存，按 atime 淘汰到 max_bytes 以内"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def path(self, id_: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(id_.encode(errors="surrogateescape")).hexdigest())
+
+    def get(self, id_: str, size: int) -> Optional[str]:
+        path = self.path(id_)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if st.st_size != size:
+            return None
+        os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+        return path
+
+    def temp_path(self) -> str:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+
+    def commit(self, tmp: str, id_: str):
+        os.replace(tmp, self.path(id_))
+        self.evict()
+
+    def discard(self, *ids: str):
+        for id_ in ids:
+            try:
+                os.remove(self.path(id_))
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        self.prune(float("inf"))
+
+    def prune(self, max_age: float, max_bytes: Optional[float] = None) -> List[Tuple[str, int]]:
+        """删除 max_age 秒没有访问的文件和中断下载留下的临时文件，再按 atime 淘汰到 max_bytes（默认为配置值）以内
+
+        返回删除的 (路径, 大小)。
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        deadline = time.time() - max_age
+        # pending 是还在写入的临时文件，不删但计入总大小
+        removed, kept, pending = [], [], 0
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    # 临时文件按 mtime 判断，还在写入的不删
+                    if entry.name.startswith("."):
+                        if entry.name.startswith(".tmp-") and st.st_mtime < deadline:
+                            removed.append((entry.path, st.st_size))
+                        else:
+                            pending += st.st_size
+                    elif st.st_atime < deadline:
+                        removed.append((entry.path, st.st_size))
+                    else:
+                        kept.append((st.st_atime, entry.path, st.st_size))
+        except FileNotFoundError:
+            return removed
+        total = pending + sum(size for _, _, size in kept)
+        for _, path, size in sorted(kept):
+            if total <= max_bytes:
+                break
+            removed.append((path, size))
+            total -= size
+        for path, _ in removed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def forward_headers(request, node: str) -> List[Tuple[str, str]]:
+    headers = [(k, v) for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP]
+    headers.append(("X-Forwarded-For", request.remote_addr or request.ip or ""))
+    headers.append((HOP_HEADER, node))
+    if (length := request.headers.get("content-length")) is not None:
+        headers.append(("Content-Length", length))
+    return headers
+
+
+def hopped(request) -> bool:
+    return HOP_HEADER.lower() in request.headers
+
+
+class Cluster:
+    def __init__(self, node: str, peers: Dict[str, Peer], timeout: float = 300, cache: Optional[PeerCache] = None):
+        if not _node_name.match(node or ""):
+            raise ValueError(f"invalid cluster node name: {node}")
+        self.node = node
+        self.peers = {name: peer for name, peer in peers.items() if name != node}
+        self.timeout = timeout
+        self.cache = cache
+
+    def remote(self, request, node: Optional[str]) -> Optional[Peer]:
+        """node 是可以转发的其他节点时返回它；已经被转发过的请求只在本地处理"""
+        if not node or node == self.node or hopped(request):
+            return None
+        return self.peers.get(node)
+
+    def session_id(self, id_: str) -> str:
+        return f"{id_}.{self.node}"
+
+    @staticmethod
+    def session_node(sid: str) -> Optional[str]:
+        return sid.partition(".")[2] or None
+
+    async def proxy(self, request, peer: Peer, target: Optional[str] = None, extra: Optional[dict] = None):
+        """把当前请求原样转发给 peer，响应流式返回"""
+        target = target or request.path + (f"?{request.query_string}" if request.query_string else "")
+        headers = forward_headers(request, self.node) + list((extra or {}).items())
+        if request.route and request.route.extra.stream:
+            body = request.stream
+        else:
+            body = request.body or None
+        try:
+            upstream = await peer_request(peer, request.method, target, headers, body, self.timeout)
+        except PeerError as e:
+            logger.warning(str(e))
+            return json({"code": -502, "msg": f"cluster node {peer.name} unavailable"}, status=502)
+        try:
+            await self.relay(request, upstream)
+        finally:
+            upstream.close()
+
+    async def relay(self, request, upstream: PeerResponse, tee: Optional[str] = None, on_complete=None):
+        """把对端响应转给客户端，tee 不为空时同时写入该文件
+
+        on_complete 在 body 完整收到后、最后一块发给客户端之前调用：客户端收完最后一个字节就断开时，
+        处理函数会被取消，之后的代码不一定执行。
+        """
+        # 对端的头名大小写不定，Content-Type 单独传、节点头由本节点重写，按小写过滤
+        skip = (HOP_BY_HOP - {"content-length"}) | {"content-type", NODE_HEADER.lower()}
+        headers = {k: v for k, v in upstream.headers if k.lower() not in skip}
+        headers[NODE_HEADER] = self.node
+        response = await request.respond(
+            status=upstream.status, headers=headers, content_type=upstream.header("content-type")
+        )
+        if request.method == "HEAD":
+            await response.eof()
+            return
+        f = await aiofiles.open(tee, "wb") if tee else None
+        last = b""
+        try:
+            async for data in upstream.iter_body():
+                if f:
+                    await f.write(data)
+                if last:
+                    await response.send(last)
+                last = data
+        finally:
+            if f:
+                await f.close()
+        if on_complete:
+            await on_complete()
+        await response.send(last, end_stream=True)
+
+    async def download(self, request, file):
+        """文件不在本地：依次尝试记录的节点和其他节点，完整的 GET 顺带填充读穿缓存"""
+        if hopped(request):
+            return None
+        peers = [self.peers[file.node]] if file.node in self.peers else list(self.peers.values())
+        target = request.path + (f"?{request.query_string}" if request.query_string else "")
+        fill = self.cache is not None and request.method == "GET" and "range" not in request.headers
+        headers = forward_headers(request, self.node)
+        if fill:
+            # 缓存原始内容，压缩交给本地的下载逻辑
+            headers = [(k, v) for k, v in headers if k.lower() != "accept-encoding"] + [("Accept-Encoding", "identity")]
+        for peer in peers:
+            try:
+                upstream = await peer_request(peer, request.method, target, headers, timeout=self.timeout)
+            except PeerError as e:
+                logger.warning(str(e))
+                continue
+            if upstream.status in (404, 400) and len(peers) > 1:
+                upstream.close()
+                continue
+            tmp = self.cache.temp_path() if fill and upstream.status == 200 else None
+
+            async def commit():
+                await run_sync(self.cache.commit, tmp, file.id)
+
+            try:
+                await self.relay(request, upstream, tmp, commit if tmp else None)
+            finally:
+                upstream.close()
+                if tmp:
+                    await fs.remove(tmp, missing_ok=True)
+            return True
+        return None
+
+    async def call(self, peer: Peer, method: str, target: str, payload: dict) -> dict:
+        """向 peer 发一个 JSON 请求并返回解析后的响应，批量操作按节点拆分后用它转发，失败时抛 PeerError"""
+        body = jsonlib.dumps(payload, ensure_ascii=False).encode()
+        headers = [(HOP_HEADER, self.node), ("Content-Type", "application/json"), ("Accept", "application/json")]
+        upstream = await peer_request(peer, method, target, headers, body, self.timeout)
+        try:
+            return jsonlib.loads(await upstream.read())
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            raise PeerError(f"peer {peer.name} failed: {e!r}") from e
+        finally:
+            upstream.close()
+
+    async def pull(self, name: str, dst: str) -> Optional[Peer]:
+        """从其他节点取回 UPLOAD_DIR 顶层的文件（旧版分块），返回取到的节点，所有节点都没有时返回 None
+
+        对端的文件不会删除，合并成功后由调用方通过 release_chunks 通知对端。
+        """
+        headers = [(HOP_HEADER, self.node), ("Accept-Encoding", "identity")]
+        for peer in self.peers.values():
+            try:
+                upstream = await peer_request(peer, "GET", f"/{name}?static=1", headers, timeout=self.timeout)
+            except PeerError as e:
+                logger.warning(str(e))
+                continue
+            try:
+                if upstream.status != 200:
+                    continue
+                # 点开头，对账不会把临时文件登记成记录
+                tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.pull")
+                async with aiofiles.open(tmp, "wb") as f:
+                    async for data in upstream.iter_body():
+                        await f.write(data)
+                await run_sync(os.replace, tmp, dst)
+                return peer
+            finally:
+                upstream.close()
+        return None
+
+    async def release_chunks(self, pulled: Dict[Peer, List[str]]):
+        """通知对端删除已经拉取并合并的旧版分块；失败只记日志，剩下的由对端的后台维护按 ORPHAN_AGE 清理"""
+        for peer, names in pulled.items():
+            try:
+                await self.call(peer, "POST", "/upload/chunks/delete", {"names": names})
+            except PeerError as e:
+                logger.warning(f"release chunks on {peer.name} failed: {e!r}")
+
+
+def setup_cluster(app):
+    """从环境变量读取集群配置，没有配置 CLUSTER_NODE 时为单机模式"""
+    app.config.CLUSTER_NODE = os.environ.get("CLUSTER_NODE", "")
+    app.config.CLUSTER_PEERS = os.environ.get("CLUSTER_PEERS", "")
+    app.config.CLUSTER_TIMEOUT = float(os.environ.get("CLUSTER_TIMEOUT", 300))
+    app.config.CLUSTER_CACHE_BYTES = int(os.environ.get("CLUSTER_CACHE_BYTES", 0))
+    app.ctx.cluster = None
+    if not app.config.CLUSTER_NODE:
+        return None
+    cache = None
+    if app.config.CLUSTER_CACHE_BYTES > 0:
+        cache = PeerCache(os.path.join(app.config.UPLOAD_DIR, CACHE_DIR), app.config.CLUSTER_CACHE_BYTES)
+    app.ctx.cluster = Cluster(
+        app.config.CLUSTER_NODE, parse_peers(app.config.CLUSTER_PEERS), app.config.CLUSTER_TIMEOUT, cache
+    )
+    return app.ctx.cluster
@@ -0,0 +1,265 @@
+"""响应压缩
+
+按 Accept-Encoding 协商 gzip，安装了 brotli / zstandard 时也支持 br / zstd。
+动态生成的 HTML / JSON 在响应中间件里压缩；文件的压缩版本按 (路径, 大小, mtime)
+缓存在磁盘上，源文件不变就一直复用，每个版本只压缩一次；同一 worker 里对同一版本的并发请求等待同一次压缩。
+缓存目录由后台维护按访问时间和总大小清理（PrecompressedCache.prune），源文件删除后的版本也会随之过期。
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from sserver.utils import run_sync
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# 小于这个大小压缩收益不明显
+MIN_SIZE = 1024
+# 超过这个大小的动态响应放到线程池里压缩
+THREAD_SIZE = 64 * 1024
+BLOCK_SIZE = 1024 * 1024
+# 命中缓存时最多按这个间隔刷新一次 atime，供清理使用
+ACCESS_RESOLUTION = 3600
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/xhtml+xml",
+    "application/rss+xml",
+    "application/atom+xml",
+    "application/ld+json",
+    "application/manifest+json",
+    "application/wasm",
+    "image/svg+xml",
+    "image/x-icon",
+}
+
+
+class _Brotli:
+    def __init__(self, level: int):
+        self.c = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data: bytes) -> bytes:
+        return self.c.process(data)
+
+    def flush(self) -> bytes:
+        return self.c.finish()
+
+
+def _gzip(level: int):
+    # wbits=31 输出带 gzip 头的格式
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def _zstd(level: int):
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+# 按优先级排列，客户端 q 值相同时选靠前的
+ENCODERS = {}
+if brotli is not None:
+    ENCODERS["br"] = _Brotli
+if zstandard is not None:
+    ENCODERS["zstd"] = _zstd
+ENCODERS["gzip"] = _gzip
+
+
+def compressible(mime_type: Optional[str]) -> bool:
+    if not mime_type:
+        return False
+    mime_type = mime_type.split(";", 1)[0].strip().lower()
+    return mime_type.startswith("text/") or mime_type in COMPRESSIBLE_TYPES
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """从 Accept-Encoding 中选出服务端支持且 q 值最高的编码，没有时返回 None"""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in ENCODERS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data: bytes, encoding: str, level: int = 6) -> bytes:
+    c = ENCODERS[encoding](level)
+    return c.compress(data) + c.flush()
+
+
+def compress_file(src: str, dst: str, encoding: str, level: int = 6):
+    """按块流式压缩，先写同目录下的唯一临时文件再改名，读到的 dst 总是完整的"""
+    fd, tmp = tempfile.mkstemp(prefix=f".{os.path.basename(dst)}.", suffix=".tmp", dir=os.path.dirname(dst))
+    c = ENCODERS[encoding](level)
+    try:
+        with open(src, "rb") as fin, os.fdopen(fd, "wb") as fout:
+            while data := fin.read(BLOCK_SIZE):
+                fout.write(c.compress(data))
+            fout.write(c.flush())
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def touch(path: str) -> bool:
+    """文件存在时返回 True，并按 ACCESS_RESOLUTION 刷新 atime"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    if time.time() - st.st_atime >= ACCESS_RESOLUTION:
+        os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+    return True
+
+
+class PrecompressedCache:
+    """磁盘上的压缩版本缓存，文件名包含源文件路径的哈希、大小和 mtime"""
+
+    def __init__(
+        self, cache_dir: str, level: int = 6, max_size: int = 64 * 1024 * 1024, max_bytes: float = float("inf")
+    ):
+        self.cache_dir = cache_dir
+        self.level = level
+        self.max_size = max_size
+        # 缓存目录的总大小上限，由 prune 执行
+        self.max_bytes = max_bytes
+        # 正在生成的版本：dst -> 压缩任务
+        self.building: Dict[str, asyncio.Future] = {}
+
+    def variant_path(self, path: str, st: os.stat_result, encoding: str) -> str:
+        key = hashlib.sha1(os.path.abspath(path).encode(errors="surrogateescape")).hexdigest()
+        return os.path.join(self.cache_dir, encoding, f"{key}-{st.st_size:x}-{st.st_mtime_ns:x}")
+
+    async def variant(self, path: str, st: os.stat_result, encoding: str) -> Optional[str]:
+        """返回压缩版本的路径，不值得压缩时返回 None"""
+        if not MIN_SIZE <= st.st_size <= self.max_size or encoding not in ENCODERS:
+            return None
+        dst = self.variant_path(path, st, encoding)
+        if await run_sync(touch, dst):
+            return dst
+        if (task := self.building.get(dst)) is None:
+            task = self.building[dst] = asyncio.ensure_future(run_sync(self._build, path, dst, encoding))
+            task.add_done_callback(lambda _: self.building.pop(dst, None))
+        # 某个请求断开不能取消其他请求在等的压缩
+        await asyncio.shield(task)
+        return dst
+
+    def _build(self, path: str, dst: str, encoding: str):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        compress_file(path, dst, encoding, self.level)
+        # 清理同一源文件的旧版本
+        prefix = os.path.basename(dst).split("-", 1)[0] + "-"
+        with os.scandir(os.path.dirname(dst)) as it:
+            for entry in it:
+                if entry.name.startswith(prefix) and entry.path != dst:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def prune(self, max_age: float, max_bytes: Optional[float] = None) -> List[Tuple[str, int]]:
+        """删除 max_age 秒没有访问的版本和遗留的临时文件，再按 atime 淘汰到 max_bytes（默认为配置值）以内
+
+        返回删除的 (路径, 大小)。
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        deadline = time.time() - max_age
+        # pending 是还在写入的临时文件，不删但计入总大小
+        removed, kept, pending = [], [], 0
+        try:
+            encodings = [it.path for it in os.scandir(self.cache_dir) if it.is_dir(follow_symlinks=False)]
+        except FileNotFoundError:
+            return removed
+        for directory in encodings:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    # 临时文件按 mtime 判断，还在写入的不删
+                    if (st.st_mtime if entry.name.endswith(".tmp") else st.st_atime) < deadline:
+                        removed.append((entry.path, st.st_size))
+                    elif entry.name.endswith(".tmp"):
+                        pending += st.st_size
+                    else:
+                        kept.append((st.st_atime, entry.path, st.st_size))
+        total = pending + sum(size for _, _, size in kept)
+        for _, path, size in sorted(kept):
+            if total <= max_bytes:
+                break
+            removed.append((path, size))
+            total -= size
+        for path, _ in removed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def request_encoding(request, mime_type: Optional[str] = None) -> Optional[str]:
+    """文件下载时选用的压缩编码，不传 mime_type 时只看请求；Range 请求按原始字节计算偏移，不压缩"""
+    if not request.app.config.get("COMPRESS", True) or request.headers.get("range"):
+        return None
+    if mime_type is not None and not compressible(mime_type):
+        return None
+    return negotiate(request.headers.get("accept-encoding"))
+
+
+def add_vary(headers):
+    vary = headers.get("Vary")
+    if not vary:
+        headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        headers["Vary"] = f"{vary}, Accept-Encoding"
+
+
+async def compress_response(request, response):
+    """响应中间件：压缩整块返回的 HTML / JSON 等文本响应
+
+    带 ETag 的是文件响应，由下载逻辑选用预压缩版本，这里不再处理。
+    """
+    if not request.app.config.get("COMPRESS", True) or request.method == "HEAD":
+        return
+    body = getattr(response, "body", None)
+    if response.status != 200 or not body or "content-encoding" in response.headers or "etag" in response.headers:
+        return
+    if not compressible(response.content_type):
+        return
+    add_vary(response.headers)
+    if len(body) < MIN_SIZE or not (encoding := negotiate(request.headers.get("accept-encoding"))):
+        return
+    level = request.app.config.get("COMPRESS_LEVEL", 6)
+    if len(body) >= THREAD_SIZE:
+        response.body = await run_sync(compress, body, encoding, level)
+    else:
+        response.body = compress(body, encoding, level)
+    response.headers["Content-Encoding"] = encoding
@@ -0,0 +1,370 @@
+import asyncio
+import os
+from functools import partial
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+
+import aiofiles
+import sanic
+from sanic import Request
+from sanic.http.http1 import Http
+from sanic.response import empty, raw
+from sanic.server.protocols.base_protocol import SanicProtocol
+
+from sserver import fs
+from sserver.cache import CachedFile
+from sserver.limits import shaped, take
+
+CHUNK_SIZE = 4 * 1024 * 1024
+# 限速时每次 sendfile 最多发送的字节数，令牌按这个粒度扣减
+SHAPED_SLICE = 256 * 1024
+# 超过这个数量的区间直接忽略 Range，防止构造大量小区间拖垮服务
+MAX_RANGES = 32
+# sendfile 绕过 sanic 直接写 socket，要用到 sanic 的两个内部状态：连接的可写事件 SanicProtocol._can_write
+# 和 Http.response_bytes_left。只在验证过的版本上启用，升级 sanic 后先跑 tests/test_download.py 再加进来
+SENDFILE_SANIC_VERSIONS = ("23.12.",)
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """解析 Range 请求头，返回闭区间列表；没有或无法解析时返回 None 表示整个文件
+
+    Raises:
+        RangeNotSatisfiable: 所有区间都超出文件范围
+    """
+    if not header or not header.strip().lower().startswith("bytes="):
+        return None
+    specs = [it.strip() for it in header.split("=", 1)[1].split(",") if it.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        start, sep, end = spec.partition("-")
+        start, end = start.strip(), end.strip()
+        if not sep or not (start.isdigit() or end.isdigit()) or (start and not start.isdigit()):
+            return None
+        if end and not end.isdigit():
+            return None
+        if not start:
+            # 后缀区间 bytes=-N，取最后 N 个字节
+            length = int(end)
+            if length == 0 or size == 0:
+                continue
+            ranges.append((max(size - length, 0), size - 1))
+            continue
+        first = int(start)
+        last = int(end) if end else size - 1
+        if end and last < first:
+            return None
+        if first >= size:
+            continue
+        ranges.append((first, min(last, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable(header)
+
+    # 合并重叠或相邻的区间
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def content_disposition(filename: str) -> str:
+    return f'attachment; filename="{filename}"'
+
+
+def sanic_internals_supported() -> bool:
+    return (
+        sanic.__version__.startswith(SENDFILE_SANIC_VERSIONS)
+        and "response_bytes_left" in getattr(Http, "__slots__", ())
+        and "_can_write" in getattr(SanicProtocol, "__slots__", ())
+    )
+
+
+SANIC_INTERNALS = sanic_internals_supported()
+
+
+def use_sendfile(request: Request) -> bool:
+    """明文 HTTP/1 连接才能把 socket 交给内核 sendfile，TLS 需要在用户态加密"""
+    transport = request.transport
+    return (
+        request.app.config.get("SENDFILE", True)
+        and SANIC_INTERNALS
+        and hasattr(os, "sendfile")
+        and transport is not None
+        and transport.get_extra_info("sslcontext") is None
+        and transport.get_extra_info("socket") is not None
+        and isinstance(request.stream, Http)
+    )
+
+
+def file_etag(id_: str, st: os.stat_result, encoding: Optional[str] = None) -> str:
+    """强 ETag，由文件 id、大小和修改时间决定，压缩版本带上编码"""
+    return f'"{id_}-{st.st_size:x}-{st.st_mtime_ns:x}{"-" + encoding if encoding else ""}"'
+
+
+def validators(etag: Optional[str], mtime: Optional[float]) -> Dict[str, str]:
+    headers = {}
+    if etag:
+        headers["ETag"] = etag
+    if mtime is not None:
+        headers["Last-Modified"] = formatdate(mtime, usegmt=True)
+    return headers
+
+
+def http_date(value: Optional[str]) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def not_modified(request: Request, etag: Optional[str], mtime: Optional[float]) -> bool:
+    """If-None-Match 优先（弱比较），没有时才看 If-Modified-Since"""
+    if request.method not in ("GET", "HEAD"):
+        return False
+    if (inm := request.headers.get("if-none-match")) is not None:
+        if not etag:
+            return False
+        tags = [it.strip() for it in inm.split(",")]
+        return "*" in tags or etag in [it[2:] if it.startswith("W/") else it for it in tags]
+    since = http_date(request.headers.get("if-modified-since"))
+    return since is not None and mtime is not None and int(mtime) <= since
+
+
+def range_header(request: Request, etag: Optional[str], mtime: Optional[float]) -> Optional[str]:
+    """If-Range 与当前版本不一致时忽略 Range，返回整个文件"""
+    if (if_range := request.headers.get("if-range")) is None:
+        return request.headers.get("range")
+    if if_range.startswith('"'):
+        return request.headers.get("range") if etag and if_range == etag else None
+    since = http_date(if_range)
+    return request.headers.get("range") if since is not None and mtime is not None and int(mtime) == since else None
+
+
+def plan(
+    request: Request,
+    mime_type: str,
+    size: int,
+    headers: Dict[str, str],
+    etag: Optional[str] = None,
+    mtime: Optional[float] = None,
+):
+    """根据条件请求和 Range 决定响应
+
+    Returns:
+        (status, content_type, segments, trailer)，segments 为 (分段前缀, 偏移, 长度)，
+        304/416 时 segments 为 None。headers 会被就地补全。
+    """
+    headers.update(validators(etag, mtime))
+    headers["Accept-Ranges"] = "bytes"
+    if not_modified(request, etag, mtime):
+        return 304, None, None, b""
+
+    try:
+        ranges = parse_range(range_header(request, etag, mtime), size)
+    except RangeNotSatisfiable:
+        headers["Content-Range"] = f"bytes */{size}"
+        return 416, None, None, b""
+
+    trailer = b""
+    content_type = mime_type
+    if ranges is None:
+        status, segments = 200, [(b"", 0, size)]
+    elif len(ranges) == 1:
+        (first, last), status = ranges[0], 206
+        headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+        segments = [(b"", first, last - first + 1)]
+    else:
+        status = 206
+        boundary = os.urandom(12).hex()
+        content_type = f"multipart/byteranges; boundary={boundary}"
+        segments = [
+            (
+                f"\r\n--{boundary}\r\nContent-Type: {mime_type}\r\n"
+                f"Content-Range: bytes {first}-{last}/{size}\r\n\r\n".encode(),
+                first,
+                last - first + 1,
+            )
+            for first, last in ranges
+        ]
+        trailer = f"\r\n--{boundary}--\r\n".encode()
+    headers["Content-Length"] = str(sum(len(p) + n for p, _, n in segments) + len(trailer))
+    return status, content_type, segments, trailer
+
+
+async def send_file(
+    request: Request,
+    path: str,
+    mime_type: str,
+    filename: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    size: Optional[int] = None,
+    etag: Optional[str] = None,
+    mtime: Optional[float] = None,
+):
+    """发送文件，支持条件请求和单区间/多区间 Range 请求
+
+    明文连接走 sendfile 零拷贝，TLS 连接退化为分块读取后发送。
+    """
+    size = await fs.getsize(path) if size is None else size
+    headers = dict(headers or {})
+    if filename:
+        headers.setdefault("Content-Disposition", content_disposition(filename))
+
+    status, content_type, segments, trailer = plan(request, mime_type, size, headers, etag, mtime)
+    if segments is None:
+        return empty(status=status, headers=headers)
+
+    response = await request.respond(status=status, headers=headers, content_type=content_type)
+    if request.method == "HEAD":
+        await response.eof()
+        return
+
+    if use_sendfile(request):
+        fd = await fs.run(os.open, path, os.O_RDONLY)
+        try:
+            for prefix, offset, count in segments:
+                # 先经 sanic 发出响应头/分段头，再把文件内容交给内核
+                await response.send(prefix)
+                await sendfile(request, fd, offset, count)
+        finally:
+            os.close(fd)
+    else:
+        send = shaped(request, response.send)
+        async with aiofiles.open(path, "rb") as f:
+            for prefix, offset, count in segments:
+                if prefix:
+                    await response.send(prefix)
+                await f.seek(offset)
+                while count > 0:
+                    data = await f.read(min(count, CHUNK_SIZE))
+                    if not data:
+                        raise EOFError(f"{path} is shorter than expected")
+                    count -= len(data)
+                    await send(data)
+    await response.send(trailer, end_stream=True)
+
+
+async def send_archive(request: Request, archive, filename: str, headers: Optional[Dict[str, str]] = None):
+    """发送流式生成的归档，布局确定的归档支持条件请求和 Range"""
+    headers = {**(headers or {}), "Content-Disposition": content_disposition(filename)}
+    if archive.size is None:
+        response = await request.respond(headers=headers, content_type=archive.content_type)
+        if request.method != "HEAD":
+            await archive.write(shaped(request, response.send))
+        await response.eof()
+        return
+
+    status, content_type, segments, trailer = plan(request, archive.content_type, archive.size, headers, archive.etag)
+    if segments is None:
+        return empty(status=status, headers=headers)
+    response = await request.respond(status=status, headers=headers, content_type=content_type)
+    if request.method == "HEAD":
+        await response.eof()
+        return
+    zero_copy = partial(sendfile, request) if use_sendfile(request) else None
+    send = shaped(request, response.send)
+    for prefix, offset, count in segments:
+        await response.send(prefix)
+        await archive.write(send, offset, count, zero_copy)
+    await response.send(trailer, end_stream=True)
+
+
+def send_cached(request: Request, cached: CachedFile):
+    """从内存缓存直接构造响应"""
+    headers = dict(cached.headers)
+    etag, mtime = headers.get("ETag"), cached.mtime_ns / 1e9
+    size = len(cached.body)
+    status, content_type, segments, trailer = plan(request, cached.mime_type, size, headers, etag, mtime)
+    if segments is None:
+        return empty(status=status, headers=headers)
+    if len(segments) == 1 and segments[0][2] == size:
+        body = cached.body
+    else:
+        body = b"".join(prefix + cached.body[offset : offset + count] for prefix, offset, count in segments) + trailer
+    return raw(body, status=status, headers=headers, content_type=content_type)
+
+
+async def load_cached(
+    id_: str,
+    path: str,
+    st: os.stat_result,
+    mime_type: str,
+    filename: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    variant: Optional[str] = None,
+):
+    """读入小文件，variant 为压缩版本的路径，此时 headers 中应带有 Content-Encoding"""
+    async with aiofiles.open(variant or path, "rb") as f:
+        body = await f.read()
+    headers = dict(headers or {})
+    if filename:
+        headers["Content-Disposition"] = content_disposition(filename)
+    headers.update(validators(file_etag(id_, st, headers.get("Content-Encoding")), st.st_mtime))
+    return CachedFile(id_, path, st.st_size, st.st_mtime_ns, body, mime_type, headers)
+
+
+async def sendfile(request: Request, fd: int, offset: int, count: int):
+    """用 os.sendfile 把 fd 的 [offset, offset + count) 直接写到客户端 socket"""
+    loop = asyncio.get_running_loop()
+    transport = request.transport
+    # 等 transport 缓冲区里的响应头真正写出去，保证字节顺序
+    await drain(request)
+
+    # 复制一个 fd 来等待可写，避免和 transport 自己注册的 fd 冲突
+    out = os.dup(transport.get_extra_info("socket").fileno())
+    limited = getattr(request.ctx, "lease", None) is not None
+    try:
+        remaining = count
+        while remaining > 0:
+            try:
+                sent = os.sendfile(out, fd, offset, min(remaining, SHAPED_SLICE) if limited else remaining)
+            except BlockingIOError:
+                await writable(loop, out)
+                continue
+            if sent == 0:
+                raise EOFError("file is shorter than expected")
+            offset += sent
+            remaining -= sent
+            if limited:
+                await take(request, sent)
+    finally:
+        os.close(out)
+    # 绕过了 sanic 的写入，需要同步它记录的剩余字节数
+    request.stream.response_bytes_left -= count
+
+
+async def drain(request: Request):
+    """等 sanic 已经写进 transport 的数据全部发出
+
+    临时把写缓冲区的高低水位都设为 0，asyncio 的流控在缓冲区清空时调用 resume_writing，置位 sanic 的可写事件；
+    连接断开时 sanic 同样会置位。
+    """
+    transport = request.transport
+    if not transport.get_write_buffer_size():
+        return
+    low, high = transport.get_write_buffer_limits()
+    transport.set_write_buffer_limits(high=0, low=0)
+    try:
+        await request.stream.protocol._can_write.wait()
+    finally:
+        if not transport.is_closing():
+            transport.set_write_buffer_limits(high=high, low=low)
+
+
+async def writable(loop, fd: int):
+    fut = loop.create_future()
+    loop.add_writer(fd, lambda: fut.done() or fut.set_result(None))
+    try:
+        await fut
+    finally:
+        loop.remove_writer(fd)
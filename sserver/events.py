@@ -0,0 +1,191 @@
+"""服务端推送：消息和文件的新增 / 删除通过 SSE 实时推给页面
+
+事件写进主进程创建的共享内存环形缓冲区（与记录缓存的失效广播同一结构），每个 worker
+一个轮询任务读出新事件，再分发给本进程内的各个连接；本进程发布的事件立即唤醒轮询。
+
+事件序号就是 SSE 的 id，断线重连时浏览器带上 Last-Event-ID，从环形缓冲区补发错过的事件；
+落后超过一圈时发 reset，页面重新加载第一页列表。
+"""
+import asyncio
+import json
+from typing import Dict, List, Optional, Set, Tuple
+
+from sanic.log import logger
+
+from sserver.cache import InvalidationLog
+
+# 浏览器断线后的重连间隔（毫秒）
+RETRY_MS = 3000
+KEEPALIVE = 15
+QUEUE_SIZE = 1000
+RESET = "reset"
+
+
+class EventLog(InvalidationLog):
+    """事件的环形缓冲区，每个槽位放一条 JSON
+
+    放不下的事件只保留类型和 id，标记 partial，由各 worker 读出时查库补全。
+    """
+
+    SLOTS = 1024
+    WIDTH = 2048
+
+    def publish_event(self, type_: str, data: dict):
+        payload = json.dumps({"type": type_, "data": data}, ensure_ascii=False, default=str)
+        if len(payload.encode()) > self.WIDTH:
+            payload = json.dumps({"type": type_, "data": {"id": data.get("id")}, "partial": True})
+        self.publish(payload)
+
+
+class EventHub:
+    """每个 worker 一个：轮询 EventLog，把新事件分发给本进程的 SSE 连接
+
+    models 为 {"file": FileRecord, "msg": MsgRecord}，用于补全 partial 事件。
+    """
+
+    def __init__(self, log: EventLog, models: Dict[str, type], interval: float = 0.2):
+        self.log = log
+        self.models = models
+        self.interval = interval
+        self.seq = log.seq.value
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def publish(self, type_: str, data: dict):
+        self.log.publish_event(type_, data)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(QUEUE_SIZE)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def close(self):
+        for queue in self.subscribers:
+            self.deliver(queue, None)
+
+    @staticmethod
+    def deliver(queue: asyncio.Queue, item):
+        if queue.full():
+            # 跟不上的连接丢掉积压，让页面整体刷新
+            while not queue.empty():
+                queue.get_nowait()
+            item = item and (item[0], RESET, None)
+        queue.put_nowait(item)
+
+    async def decode(self, since: int, raw: List[str]) -> List[Tuple[int, str, dict]]:
+        """(序号, 类型, 数据) 列表，partial 事件查库补全，记录已经不存在时丢弃"""
+        events = []
+        for seq, payload in enumerate(raw, since + 1):
+            try:
+                event = json.loads(payload)
+            except ValueError:
+                continue
+            if event.get("partial") and event["type"].endswith(".created"):
+                model = self.models.get(event["type"].split(".", 1)[0])
+                if not model or not (record := await model.get(event["data"]["id"])):
+                    continue
+                event["data"] = record.json()
+            events.append((seq, event["type"], event["data"]))
+        return events
+
+    async def replay(self, since: int) -> Tuple[int, Optional[List[Tuple[int, str, dict]]]]:
+        seq, raw = self.log.poll(since)
+        return seq, None if raw is None else await self.decode(since, raw)
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.dispatch()
+            except Exception:
+                logger.exception("event dispatch failed")
+
+    async def dispatch(self):
+        since = self.seq
+        self.seq, events = await self.replay(since)
+        if events is None:
+            events = [(self.seq, RESET, None)]
+        for item in events:
+            for queue in list(self.subscribers):
+                self.deliver(queue, item)
+
+
+def format_event(seq: int, type_: str, data) -> str:
+    return f"id: {seq}\nevent: {type_}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def stream_events(request):
+    """SSE 事件流
+
+    Args:
+        since (int, optional): 页面渲染时的事件序号，从它之后开始推送；重连时以 Last-Event-ID 为准
+    """
+    hub: EventHub = request.app.ctx.events
+    since = request.headers.get("Last-Event-ID") or request.args.get("since")
+    queue = hub.subscribe()
+    try:
+        response = await request.respond(
+            content_type="text/event-stream; charset=utf-8",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+        start = last = hub.seq
+        events = []
+        if since and since.isdigit() and int(since) <= last:
+            start = int(since)
+            last, events = await hub.replay(start)
+            events = [(last, RESET, None)] if events is None else events
+        await response.send(f"retry: {RETRY_MS}\n" + format_event(start, "hello", {"seq": start}))
+        for item in events:
+            await response.send(format_event(*item))
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), KEEPALIVE)
+            except asyncio.TimeoutError:
+                await response.send(": ping\n\n")
+                continue
+            if item is None:
+                break
+            # 订阅后到补发结束之间的事件会出现两次
+            if item[0] > last or item[1] == RESET:
+                last = max(last, item[0])
+                await response.send(format_event(*item))
+    finally:
+        hub.unsubscribe(queue)
+
+
+hub: Optional[EventHub] = None
+
+
+def publish(type_: str, data: dict):
+    """供记录的 save / delete 调用，事件推送没有启用时忽略"""
+    if hub is not None:
+        hub.publish(type_, data)
+
+
+def setup_events(app, models: Dict[str, type]):
+    """注册共享环形缓冲区和每个 worker 的分发任务，SSE 路由 stream_events 由蓝图挂载"""
+
+    @app.main_process_start
+    async def create_event_log(app, loop):
+        app.shared_ctx.event_log = EventLog.create()
+
+    @app.listener("before_server_start")
+    async def attach_events(app, loop):
+        global hub
+        shared = getattr(app.shared_ctx, "event_log", None) or EventLog.create()
+        app.ctx.events = hub = EventHub(EventLog(*shared), models, app.config.get("EVENTS_POLL_INTERVAL", 0.2))
+        app.add_task(hub.run(), name="event_dispatch")
+
+    @app.listener("before_server_stop")
+    async def close_events(app, loop):
+        app.ctx.events.close()
@@ -0,0 +1,182 @@
+"""阻塞文件系统调用的专用线程池，sserver 和 dserver 共用
+
+每个 worker 一个有界线程池，同时设为事件循环的默认 executor，run_sync、aiofiles 和 sanic 的文件发送
+都在这里排队，慢盘只会让池子排队，不会卡住事件循环上的其他连接。
+
+通过 run 提交的调用按操作名（函数名）记录排队等待和执行耗时，线程池的排队数和运行数作为仪表盘导出，
+用来确定 FS_WORKERS 和发现磁盘卡顿；单次调用超过 FS_SLOW_SECONDS 时打警告日志。
+"""
+import asyncio
+import glob as _glob
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from sanic.log import logger
+
+from sserver.metrics import LATENCY_BUCKETS, registry
+
+FS_SECONDS = registry.histogram("fs_op_duration_seconds", "文件系统调用在线程池中的执行耗时", ("op",))
+FS_WAIT_SECONDS = registry.histogram(
+    "fs_op_wait_seconds", "文件系统调用提交后排队等待线程的时间", ("op",), buckets=(0.0001, 0.0005) + LATENCY_BUCKETS
+)
+FS_EXECUTOR = registry.gauge("fs_executor_threads", "文件系统线程池：workers 上限、running 执行中、queued 排队中", ("state",))
+
+
+class FsExecutor(ThreadPoolExecutor):
+    """统计排队数和运行数的线程池，包括 aiofiles 等不经过 run 的提交"""
+
+    def __init__(self, workers: int):
+        super().__init__(max_workers=workers, thread_name_prefix="fs")
+        self.workers = workers
+        self.queued = 0
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self.lock:
+            self.queued += 1
+        try:
+            return super().submit(self._call, fn, args, kwargs)
+        except BaseException:
+            with self.lock:
+                self.queued -= 1
+            raise
+
+    def _call(self, fn, args, kwargs):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+executor: Optional[FsExecutor] = None
+slow_seconds = 1.0
+
+
+def _collect():
+    if executor is not None:
+        FS_EXECUTOR.set("workers", value=executor.workers)
+        FS_EXECUTOR.set("running", value=executor.running)
+        FS_EXECUTOR.set("queued", value=executor.queued)
+
+
+registry.add_collector(_collect)
+
+
+def op_name(func: Callable) -> str:
+    name = getattr(func, "__qualname__", None) or getattr(func, "__name__", None) or type(func).__name__
+    return name.rsplit(".<locals>.", 1)[-1]
+
+
+async def run(func: Callable, *args, op: Optional[str] = None) -> Any:
+    """在文件系统线程池里执行阻塞调用，op 为指标里的操作名，默认取函数名"""
+    started = []
+
+    def call():
+        started.append(time.perf_counter())
+        return func(*args)
+
+    submitted = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, call)
+    finally:
+        # 指标只在事件循环线程里修改
+        end = time.perf_counter()
+        start = started[0] if started else end
+        op = op or op_name(func)
+        FS_WAIT_SECONDS.observe(start - submitted, op)
+        FS_SECONDS.observe(end - start, op)
+        if end - submitted > slow_seconds:
+            logger.warning(f"slow fs op {op}: waited {start - submitted:.3f}s, ran {end - start:.3f}s")
+
+
+_background = set()
+
+
+def _spawned(task: asyncio.Task):
+    _background.discard(task)
+    if not task.cancelled() and (e := task.exception()) is not None:
+        logger.warning(f"background fs op failed: {e!r}")
+
+
+def spawn(func: Callable, *args, op: Optional[str] = None) -> asyncio.Task:
+    """提交到线程池但不等待结果，用于不影响响应的写操作；异常只记日志"""
+    task = asyncio.ensure_future(run(func, *args, op=op))
+    # 事件循环只保留任务的弱引用
+    _background.add(task)
+    task.add_done_callback(_spawned)
+    return task
+
+
+async def exists(path: str) -> bool:
+    return await run(os.path.exists, path)
+
+
+def _exists_many(paths: List[str]) -> List[bool]:
+    return [os.path.exists(it) for it in paths]
+
+
+async def exists_many(paths: List[str]) -> List[bool]:
+    """一次线程池调用检查多个路径"""
+    return await run(_exists_many, paths, op="exists_many")
+
+
+async def isdir(path: str) -> bool:
+    return await run(os.path.isdir, path)
+
+
+async def stat(path: str) -> os.stat_result:
+    return await run(os.stat, path)
+
+
+async def getsize(path: str) -> int:
+    return await run(os.path.getsize, path)
+
+
+async def remove(path: str, missing_ok: bool = False):
+    try:
+        await run(os.remove, path)
+    except FileNotFoundError:
+        if not missing_ok:
+            raise
+
+
+async def rename(src: str, dst: str):
+    await run(os.rename, src, dst)
+
+
+def _makedirs(path: str):
+    os.makedirs(path, exist_ok=True)
+
+
+async def makedirs(path: str):
+    await run(_makedirs, path, op="makedirs")
+
+
+async def copy(src: str, dst: str) -> str:
+    return await run(shutil.copy, src, dst)
+
+
+async def glob(pattern: str) -> List[str]:
+    return await run(_glob.glob, pattern)
+
+
+def setup_fs(app):
+    """从环境变量读取线程池大小，每个 worker 启动时把线程池设为事件循环的默认 executor"""
+    app.config.FS_WORKERS = int(os.environ.get("FS_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+    app.config.FS_SLOW_SECONDS = float(os.environ.get("FS_SLOW_SECONDS", 1.0))
+
+    @app.listener("before_server_start")
+    async def start_executor(app, loop):
+        global executor, slow_seconds
+        executor = FsExecutor(app.config.FS_WORKERS)
+        slow_seconds = app.config.FS_SLOW_SECONDS
+        loop.set_default_executor(executor)
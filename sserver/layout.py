@@ -0,0 +1,78 @@
+"""UPLOAD_DIR 下记录文件的目录布局
+
+levels 为 0 时所有文件平铺在 UPLOAD_DIR/<id>；大于 0 时按 id 的 sha1 取 levels 级、每级 width 个十六进制字符
+作为子目录，例如 levels=2 时为 UPLOAD_DIR/3f/a2/<id>。ulid 前缀是时间戳，直接用 id 前缀分布不均。
+
+切换到分层布局后，旧的平铺文件仍然可以通过回退查找访问，由 python -m sserver.migrate 在线迁移。
+以 . 开头的目录（.blobs / .sessions / .compressed 等）和子目录名不会冲突。
+"""
+import hashlib
+import os
+import re
+from typing import Iterator, Tuple
+
+MAX_LEVELS = 3
+_hex = re.compile(r"^[0-9a-f]+$")
+
+levels = 0
+width = 2
+
+
+def setup_layout(levels_: int = 0, width_: int = 2):
+    global levels, width
+    if not 0 <= levels_ <= MAX_LEVELS or not 1 <= width_ <= 4:
+        raise ValueError(f"invalid upload dir layout: levels={levels_}, width={width_}")
+    levels, width = levels_, width_
+
+
+def shard_path(upload_dir: str, id_: str) -> str:
+    """按当前布局 id 应该在的位置，新文件都写到这里"""
+    if not levels:
+        return os.path.join(upload_dir, id_)
+    key = hashlib.sha1(id_.encode(errors="surrogateescape")).hexdigest()
+    parts = [key[i * width : (i + 1) * width] for i in range(levels)]
+    return os.path.join(upload_dir, *parts, id_)
+
+
+def file_path(upload_dir: str, id_: str) -> str:
+    """id 对应的现有文件，迁移期间回退到平铺位置；都不存在时返回 shard_path
+
+    迁移先建链接再删旧文件，新位置没查到而平铺位置也没有时，文件要么在两次检查之间刚迁到新位置，
+    要么确实不存在，所以直接返回 shard_path，由调用方打开或 stat 时确认，不会错过正在迁移的文件。
+    """
+    path = shard_path(upload_dir, id_)
+    if not levels or os.path.exists(path):
+        return path
+    if os.path.exists(flat := os.path.join(upload_dir, id_)):
+        return flat
+    return path
+
+
+def locate(upload_dir: str, id_: str) -> Tuple[str, os.stat_result]:
+    """file_path 和 stat 在同一次线程池调用里完成，文件不存在时抛 FileNotFoundError"""
+    path = file_path(upload_dir, id_)
+    return path, os.stat(path)
+
+
+def prepare(path: str) -> str:
+    """写入新文件前创建所在的子目录"""
+    if levels:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def _shard_dir(name: str) -> bool:
+    return len(name) == width and bool(_hex.match(name))
+
+
+def iter_files(upload_dir: str) -> Iterator[os.DirEntry]:
+    """UPLOAD_DIR 顶层和各级子目录中的普通文件，包括尚未迁移的平铺文件"""
+    stack = [(upload_dir, 0)]
+    while stack:
+        path, depth = stack.pop()
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    yield entry
+                elif depth < levels and _shard_dir(entry.name) and entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, depth + 1))
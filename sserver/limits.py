@@ -0,0 +1,265 @@
+"""下载 / 上传的带宽整形和并发准入，sserver 和 dserver 共用
+
+令牌桶和并发租约都放在主进程创建的共享内存里，所有 worker 共用同一组限额：
+
+- 全局带宽 RATE_LIMIT 和单 IP 带宽 IP_RATE_LIMIT（字节/秒），在流式收发的循环里按块扣减令牌
+- 全局并发 MAX_STREAMS 和单 IP 并发 IP_MAX_STREAMS，超出时最多排队 QUEUE_TIMEOUT 秒，
+  仍然拿不到就返回 503 和 Retry-After
+
+IP 按哈希落到固定数量的桶里，两个 IP 偶尔共用一个桶只会让限制更严格。
+小文件热点缓存直接整块返回，不经过这里。
+"""
+import asyncio
+import os
+import time
+import zlib
+from contextlib import asynccontextmanager
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+from typing import Optional
+
+from sanic.exceptions import ServiceUnavailable
+from sanic.response import json
+
+UNITS = {"k": 1024, "m": 1024**2, "g": 1024**3}
+# 命令行参数和对应的环境变量
+OPTIONS = {
+    "rate_limit": "RATE_LIMIT",
+    "ip_rate_limit": "IP_RATE_LIMIT",
+    "max_streams": "MAX_STREAMS",
+    "ip_max_streams": "IP_MAX_STREAMS",
+    "queue_timeout": "QUEUE_TIMEOUT",
+}
+
+
+def parse_rate(value) -> int:
+    """10M / 512k / 1048576，单位为字节/秒，0 表示不限制"""
+    value = str(value or 0).strip().lower().rstrip("b").rstrip("i")
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(float(value))
+
+
+def add_arguments(parser):
+    parser.add_argument("--rate-limit", type=str, help="total bandwidth of uploads and downloads, e.g. 100M (bytes/s)")
+    parser.add_argument("--ip-rate-limit", type=str, help="bandwidth per client ip, e.g. 10M (bytes/s)")
+    parser.add_argument("--max-streams", type=int, help="concurrent uploads/downloads")
+    parser.add_argument("--ip-max-streams", type=int, help="concurrent uploads/downloads per client ip")
+    parser.add_argument("--queue-timeout", type=float, help="seconds to wait for a stream slot before 503")
+
+
+def apply_arguments(args):
+    """命令行参数写进环境变量，worker 进程里的 create_app 从环境变量读取"""
+    for name, env in OPTIONS.items():
+        if (value := getattr(args, name, None)) is not None:
+            os.environ[env] = str(value)
+
+
+class Overloaded(ServiceUnavailable):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message, headers={"Retry-After": str(retry_after)})
+        self.retry_after = retry_after
+
+
+def alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Limits:
+    """共享内存里的令牌桶和并发租约表
+
+    buckets 每个桶两个 double：剩余令牌和上次补充时间，0 号是全局桶；
+    leases 每个租约两个整数：持有者 pid 和 IP 桶号，pid 为 0 表示空闲。
+    """
+
+    IP_SLOTS = 4096
+    LEASES = 4096
+
+    def __init__(
+        self,
+        buckets,
+        leases,
+        lock,
+        rate: int = 0,
+        ip_rate: int = 0,
+        max_streams: int = 0,
+        ip_max_streams: int = 0,
+        queue_timeout: float = 0,
+        retry_after: int = 5,
+    ):
+        self.buckets = buckets
+        self.leases = leases
+        self.lock = lock
+        self.rate = rate
+        self.ip_rate = ip_rate
+        self.max_streams = min(max_streams or self.LEASES, self.LEASES)
+        self.ip_max_streams = ip_max_streams
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.counted = bool(max_streams or ip_max_streams)
+
+    @classmethod
+    def create(cls):
+        return RawArray("d", 2 * (cls.IP_SLOTS + 1)), RawArray("q", 2 * cls.LEASES), Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rate or self.ip_rate or self.counted)
+
+    def ip_slot(self, ip: str) -> int:
+        return zlib.crc32(ip.encode()) % self.IP_SLOTS + 1
+
+    def reserve(self, slot: int, n: int, rate: int) -> float:
+        """从桶里取 n 个令牌，不够时记为欠账，返回需要等待的秒数；桶容量为一秒的量"""
+        if not rate:
+            return 0.0
+        i, now = slot * 2, time.monotonic()
+        with self.lock:
+            tokens = min(rate, self.buckets[i] + (now - self.buckets[i + 1]) * rate)
+            self.buckets[i], self.buckets[i + 1] = tokens - n, now
+        return max(0.0, (n - tokens) / rate)
+
+    async def take(self, ip_slot: int, n: int):
+        if wait := max(self.reserve(0, n, self.rate), self.reserve(ip_slot, n, self.ip_rate)):
+            await asyncio.sleep(wait)
+
+    def try_acquire(self, ip_slot: int, pid: int) -> Optional[int]:
+        with self.lock:
+            for reclaim in (False, True):
+                total, per_ip, free = 0, 0, None
+                for i in range(self.LEASES):
+                    owner = self.leases[i * 2]
+                    # 退出的 worker 留下的租约只在满额时检查回收
+                    if owner and reclaim and owner != pid and not alive(owner):
+                        self.leases[i * 2] = owner = 0
+                    if not owner:
+                        free = i if free is None else free
+                        continue
+                    total += 1
+                    per_ip += self.leases[i * 2 + 1] == ip_slot
+                full = total >= self.max_streams or (self.ip_max_streams and per_ip >= self.ip_max_streams)
+                if not full and free is not None:
+                    self.leases[free * 2], self.leases[free * 2 + 1] = pid, ip_slot
+                    return free
+        return None
+
+    def release(self, index: int):
+        with self.lock:
+            self.leases[index * 2] = 0
+
+    async def admit(self, ip: str) -> "Lease":
+        ip_slot = self.ip_slot(ip)
+        if not self.counted:
+            return Lease(self, None, ip_slot)
+        deadline = time.monotonic() + self.queue_timeout
+        delay = 0.02
+        while (index := self.try_acquire(ip_slot, os.getpid())) is None:
+            if (remaining := deadline - time.monotonic()) <= 0:
+                raise Overloaded("too many concurrent transfers, try again later", self.retry_after)
+            # 租约在其他 worker 里释放，没有通知，只能退避轮询
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.5)
+        return Lease(self, index, ip_slot)
+
+
+class Lease:
+    """一次上传或下载占用的并发名额，同时负责按块扣减带宽令牌"""
+
+    def __init__(self, limits: Limits, index: Optional[int], ip_slot: int):
+        self.limits = limits
+        self.index = index
+        self.ip_slot = ip_slot
+
+    async def take(self, n: int):
+        await self.limits.take(self.ip_slot, n)
+
+    def release(self):
+        if self.index is not None:
+            self.limits.release(self.index)
+            self.index = None
+
+
+def client_ip(request) -> str:
+    return request.remote_addr or request.ip or ""
+
+
+@asynccontextmanager
+async def admitted(request):
+    """在 with 块内占用一个并发名额，块内的 sendfile / 分块收发按 request.ctx.lease 限速"""
+    limits = getattr(request.app.ctx, "limits", None)
+    if limits is None:
+        yield None
+        return
+    lease = await limits.admit(client_ip(request))
+    request.ctx.lease = lease
+    try:
+        yield lease
+    finally:
+        lease.release()
+        request.ctx.lease = None
+
+
+async def take(request, n: int):
+    if lease := getattr(request.ctx, "lease", None):
+        await lease.take(n)
+
+
+def shaped(request, send):
+    """给 response.send 加上限速"""
+    if getattr(request.ctx, "lease", None) is None:
+        return send
+
+    async def wrapper(data, *args, **kwargs):
+        await take(request, len(data))
+        await send(data, *args, **kwargs)
+
+    return wrapper
+
+
+async def body_chunks(request):
+    """限速地读取流式请求体"""
+    async for data in request.stream:
+        await take(request, len(data))
+        yield data
+
+
+async def overloaded(request, exception: Overloaded):
+    return json(
+        {"code": -503, "msg": str(exception)}, status=503, headers={"Retry-After": str(exception.retry_after)}
+    )
+
+
+def setup_limits(app):
+    """从环境变量读取限额，注册共享内存和 503 处理"""
+    app.config.RATE_LIMIT = parse_rate(os.environ.get("RATE_LIMIT", 0))
+    app.config.IP_RATE_LIMIT = parse_rate(os.environ.get("IP_RATE_LIMIT", 0))
+    app.config.MAX_STREAMS = int(os.environ.get("MAX_STREAMS", 0))
+    app.config.IP_MAX_STREAMS = int(os.environ.get("IP_MAX_STREAMS", 0))
+    app.config.QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", 10))
+    app.config.RETRY_AFTER = int(os.environ.get("RETRY_AFTER", 5))
+    app.ctx.limits = None
+    app.exception(Overloaded)(overloaded)
+
+    @app.main_process_start
+    async def create_limits(app, loop):
+        app.shared_ctx.limits = Limits.create()
+
+    @app.listener("before_server_start")
+    async def attach_limits(app, loop):
+        shared = getattr(app.shared_ctx, "limits", None) or Limits.create()
+        limits = Limits(
+            *shared,
+            rate=app.config.RATE_LIMIT,
+            ip_rate=app.config.IP_RATE_LIMIT,
+            max_streams=app.config.MAX_STREAMS,
+            ip_max_streams=app.config.IP_MAX_STREAMS,
+            queue_timeout=app.config.QUEUE_TIMEOUT,
+            retry_after=app.config.RETRY_AFTER,
+        )
+        app.ctx.limits = limits if limits.enabled else None
@@ -1,173 +1,712 @@
 from functools import partial
-from glob import glob
-from itertools import chain
+import asyncio
+import hashlib
 import os
 import argparse
-import shutil
-from urllib.parse import unquote
-import aiofiles
+import zlib
+from urllib.parse import quote, unquote
 
 from sanic import Blueprint, Sanic, Request, response, app
-from sanic.response import json, html, file as resp_file, text, file_stream
+from sanic.response import json, html, text
+from sanic.log import logger
 from sanic.worker.loader import AppLoader
 
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
-from sserver.model import get_db, MsgRecord, FileRecord
-from sserver.filters import datetime_format, format_size, register_filters
-from sserver.utils import get_media_type
+from sserver import model
+from sserver.model import get_db, setup_record_cache, MsgRecord, FileRecord
+from sserver.filters import format_size, register_filters
+from sserver.utils import get_media_type, run_sync
+from sserver.stream import WRITE_BUFFER_SIZE, MultipartError, Throughput, save_multipart
+from sserver.session import InsufficientStorage, SessionError, SessionGone, UploadSession
+from sserver.download import file_etag, load_cached, send_archive, send_cached, send_file
+from sserver.archive import FORMATS, Member, create_archive, unique_names
+from sserver.cache import HotFileCache, InvalidationLog
+from sserver.compress import PrecompressedCache, add_vary, compress_response, compressible, request_encoding
+from sserver.metrics import CACHE_STATS, DEDUP_BYTES, DEDUP_FILES, observe_upload, registry, setup_metrics
+from sserver.reconcile import UploadDirWatcher, legacy_chunk, reconcile
+from sserver.maintenance import Maintenance, parse_ttl, record_access
+from sserver.limits import add_arguments, admitted, apply_arguments, body_chunks, setup_limits
+from sserver.events import setup_events, stream_events
+from sserver import blobs, fs
+from sserver.fs import setup_fs
+from sserver.layout import file_path, locate, prepare, setup_layout, shard_path
+from sserver.cluster import PeerError, hopped, setup_cluster
+from sserver.bulk import BulkError, ingest, release_files, remove_files, rename_back, rename_files
+from sserver.stream import TarError
+from sserver.store import SEARCH_MODES
 
 jinja_env = Environment(
     loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), "templates")),
-    auto_reload=True,
+    auto_reload=os.environ.get("DEBUG", "False").lower() == "true",
     autoescape=select_autoescape(["html"]),
 )
 register_filters(jinja_env)
 
+FILE_PAGE_SIZE = 100
+MSG_PAGE_SIZE = 30
+MAX_PAGE_SIZE = 1000
+MAX_ARCHIVE_FILES = 10000
+MAX_SKIPPED_REPORT = 100
+MAX_BATCH_SIZE = 10000
+
+
+def uploaded_response(request: Request, file_record: FileRecord):
+    """上传完成后的响应，浏览器返回插入列表的一行，其他客户端只返回 id"""
+    ua = request.headers.get("User-Agent", "").lower()
+    if "mozilla" in ua:
+        return html(
+            jinja_env.get_template("file_rows.html").render(
+                url_for=request.app.url_for, files=file_items([file_record])
+            )
+        )
+    return text(file_record.id)
+
+
+def file_items(files):
+    # 大小在上传完成时已经写入记录，列表页不访问文件系统
+    return [
+        {
+            "id": file.id,
+            "original_name": file.filename,
+            "created_at": file.created_at,
+            "size": file.size,
+        }
+        for file in files
+    ]
+
+
+def collect_cache_stats(app):
+    caches = {"hot_files": app.ctx.hot_files, "records": model.record_cache}
+    for name, cache in caches.items():
+        if cache is not None:
+            for stat, value in cache.stats().items():
+                # 比例不能跨 worker 相加
+                if stat != "hit_ratio":
+                    CACHE_STATS.set(name, stat, value=value)
+
+
+async def dedup(request: Request, path: str, digest: str = "") -> str:
+    """上传完成的文件纳入 blob 存储，返回内容的 sha256；关闭去重时原样返回 digest"""
+    if not request.app.config.DEDUP:
+        return digest
+    digest, reused = await run_sync(blobs.adopt, request.app.config.UPLOAD_DIR, path, digest or None)
+    if reused:
+        DEDUP_FILES.inc("finalize")
+        DEDUP_BYTES.inc("finalize", value=await fs.getsize(path))
+    return digest
+
+
+async def dedup_later(app, file_record: FileRecord, path: str):
+    """分块上传的文件在后台计算 sha256 并纳入 blob 存储，finalize 请求不用等整个文件重读一遍
+
+    每个 worker 同时只算一个文件；计算期间文件被删除或改名时放弃，记录保持没有 hash。
+    """
+    async with app.ctx.dedup_lock:
+        try:
+            digest = await blobs.hash_file_blocks(path)
+            digest, reused = await run_sync(blobs.adopt, app.config.UPLOAD_DIR, path, digest)
+            if reused:
+                DEDUP_FILES.inc("finalize")
+                DEDUP_BYTES.inc("finalize", value=file_record.size)
+            await file_record.update(hash=digest)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.exception(f"dedup of {file_record.id} failed")
+
+
+def peer_for(request: Request, node: str):
+    """集群模式下 node 是其他节点时返回该节点，请求需要转发过去"""
+    cluster = request.app.ctx.cluster
+    return cluster.remote(request, node) if cluster else None
+
+
+def session_peer(request: Request, sid: str):
+    cluster = request.app.ctx.cluster
+    return cluster.remote(request, cluster.session_node(sid)) if cluster else None
+
+
+def batch_items(request: Request, key: str) -> list:
+    """批量接口的 json 请求体中 key 对应的列表，重复项只保留第一个"""
+    items = (request.json or {}).get(key) if isinstance(request.json, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError(f"{key} is required")
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValueError(f"too many items, max {MAX_BATCH_SIZE}")
+    return items
+
+
+def batch_result(id_: str, code: int = 0, msg: str = "success", **extra) -> dict:
+    return {"id": id_, "code": code, "msg": msg, **extra}
+
+
+async def forward_batch(request: Request, groups: dict, key: str) -> dict:
+    """批量操作中存放在其他节点的部分按节点转发，返回 {id: 结果}"""
+    cluster = request.app.ctx.cluster
+    results = {}
+    for peer, items in groups.items():
+        try:
+            ret = await cluster.call(peer, "POST", request.path, {key: items})
+            results.update((it["id"], it) for it in ret["data"]["results"])
+        except (PeerError, KeyError, TypeError) as e:
+            logger.warning(f"batch forward to {peer.name} failed: {e!r}")
+            for it in items:
+                id_ = it["id"] if isinstance(it, dict) else it
+                results[id_] = batch_result(id_, -502, f"cluster node {peer.name} unavailable")
+    return results
+
+
+def wants_json(request: Request) -> bool:
+    """页面脚本用 fetch 提交时带 Accept: application/json，不再重定向整页刷新"""
+    return "application/json" in request.headers.get("Accept", "")
+
+
+def locate_files(upload_dir: str, files, cache=None):
+    """每个文件的 (路径, stat)，不在本地时再找集群的读穿缓存，都没有时为 None"""
+    ret = []
+    for file in files:
+        try:
+            ret.append(locate(upload_dir, file.id))
+            continue
+        except FileNotFoundError:
+            pass
+        try:
+            path = cache.get(file.id, file.size) if cache else None
+            ret.append((path, os.stat(path)) if path else None)
+        except FileNotFoundError:
+            ret.append(None)
+    return ret
+
+
+def parse_flag(value) -> bool:
+    """0 / 1、true / false 形式的开关参数，其他值抛 ValueError"""
+    if isinstance(value, bool):
+        return value
+    if (text := str(value).strip().lower()) in ("1", "true"):
+        return True
+    if text in ("0", "false", ""):
+        return False
+    raise ValueError(f"invalid flag: {value}")
+
+
+def merge_files(dst: str, srcs) -> tuple:
+    """按固定大小的块把 srcs 依次拼接到 dst，返回 (总大小, sha256)"""
+    digest, size = hashlib.sha256(), 0
+    with open(dst, "wb") as wf:
+        for src in srcs:
+            with open(src, "rb") as rf:
+                while data := rf.read(WRITE_BUFFER_SIZE):
+                    wf.write(data)
+                    digest.update(data)
+                    size += len(data)
+    return size, digest.hexdigest()
+
+
+def next_cursor(records, size: int):
+    return records[-1].cursor if len(records) == size else None
+
 
 def create_bp(prefix: str = "/"):
     bp = Blueprint("app", prefix)
 
     @bp.route("/")
     async def index(request: Request):
-        files = await FileRecord.get_list()
-        msg_list = await MsgRecord.get_list()
-
-        file_list = []
-        for file in files:
-            file_path = os.path.join(request.app.config.UPLOAD_DIR, file.id)
-            exists = os.path.exists(file_path)
-            file_size = -1 if not exists else os.path.getsize(file_path)
-            file_list.append(
-                {
-                    "id": file.id,
-                    "original_name": file.filename,
-                    "created_at": file.created_at,
-                    "size": file_size,
-                }
-            )
+        files = await FileRecord.get_list(size=FILE_PAGE_SIZE)
+        msg_list = await MsgRecord.get_list(size=MSG_PAGE_SIZE)
 
         return html(
             jinja_env.get_template("index.html").render(
                 url_for=request.app.url_for,
-                **{"request": request, "files": file_list, "msgs": msg_list},
+                **{
+                    "request": request,
+                    "files": file_items(files),
+                    "msgs": msg_list,
+                    "files_next": next_cursor(files, FILE_PAGE_SIZE),
+                    "msgs_next": next_cursor(msg_list, MSG_PAGE_SIZE),
+                    # 页面从这个序号之后开始接收推送，渲染和连接之间的变更不会丢
+                    "events_seq": request.app.ctx.events.seq,
+                },
             )
         )
 
-    @bp.route("/upload", methods=["POST", "GET", "PATCH"])
-    async def upload(request: Request):
-        if request.method == "GET":
-            return html(jinja_env.get_template("upload.html").render())
+    @bp.get("/files")
+    async def list_files(request: Request):
+        """文件列表，cursor 为上一页返回的 next，format=html 时返回表格行"""
+        try:
+            size = min(max(int(request.args.get("size", FILE_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+            files = await FileRecord.get_list(size=size, cursor=request.args.get("cursor"))
+        except ValueError as e:
+            return json({"code": -400, "msg": str(e)}, status=400)
+        cursor = next_cursor(files, size)
+        if request.args.get("format") == "html":
+            return html(
+                jinja_env.get_template("file_rows.html").render(url_for=request.app.url_for, files=file_items(files)),
+                headers={"X-Next-Cursor": cursor or ""},
+            )
+        return json({"code": 0, "msg": "success", "data": {"files": [it.json() for it in files], "next": cursor}})
+
+    @bp.get("/msgs")
+    async def list_msgs(request: Request):
+        try:
+            size = min(max(int(request.args.get("size", MSG_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+            msg_list = await MsgRecord.get_list(size=size, cursor=request.args.get("cursor"))
+        except ValueError as e:
+            return json({"code": -400, "msg": str(e)}, status=400)
+        cursor = next_cursor(msg_list, size)
+        if request.args.get("format") == "html":
+            return html(
+                jinja_env.get_template("msg_rows.html").render(url_for=request.app.url_for, msgs=msg_list),
+                headers={"X-Next-Cursor": cursor or ""},
+            )
+        return json({"code": 0, "msg": "success", "data": {"msgs": [it.json() for it in msg_list], "next": cursor}})
 
-        elif request.method == "POST":
+    @bp.get("/search")
+    async def search(request: Request):
+        """按文件名和消息内容搜索，走元数据存储的全文索引
+
+        Args:
+            q (str): 查询内容
+            mode (str): prefix 前缀、substring 子串（默认）、token 按词前缀
+            kind (str): files、msgs，默认两者都查
+            page (int): 页码
+            size (int): 每页条数，format=html 时只返回文件的表格行
+        """
+        query = request.args.get("q", "").strip()
+        mode = request.args.get("mode", "substring")
+        kinds = [request.args.get("kind")] if request.args.get("kind") else ["files", "msgs"]
+        if not query:
+            return json({"code": -400, "msg": "q is required"}, status=400)
+        if mode not in SEARCH_MODES:
+            return json({"code": -400, "msg": f"unsupported mode: {mode}"}, status=400)
+        if not set(kinds) <= {"files", "msgs"}:
+            return json({"code": -400, "msg": f"unsupported kind: {kinds[0]}"}, status=400)
+        try:
+            page = max(int(request.args.get("page", 1)), 1)
+            size = min(max(int(request.args.get("size", FILE_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        except ValueError as e:
+            return json({"code": -400, "msg": str(e)}, status=400)
+        files = await FileRecord.search(query, mode, page, size) if "files" in kinds else []
+        if request.args.get("format") == "html":
+            return html(
+                jinja_env.get_template("file_rows.html").render(url_for=request.app.url_for, files=file_items(files))
+            )
+        data = {"files": [it.json() for it in files]} if "files" in kinds else {}
+        if "msgs" in kinds:
+            data["msgs"] = [it.json() for it in await MsgRecord.search(query, mode, page, size)]
+        return json({"code": 0, "msg": "success", "data": data})
+
+    @bp.post("/upload", stream=True)
+    async def upload_stream(request: Request):
+        """流式接收分块，边解析 multipart 边按固定缓冲区写盘"""
+        async with admitted(request):
             try:
-                chunk = request.files.get("file")
-                save_path = os.path.join(request.app.config.UPLOAD_DIR, chunk.name)
-                async with aiofiles.open(save_path, "wb") as f:
-                    await f.write(chunk.body)
-                return json({"code": 0, "msg": "success"})
+                name, meter = await save_multipart(
+                    request, "file", request.app.config.UPLOAD_DIR, request.app.config.REQUEST_MAX_SIZE
+                )
+            except MultipartError as e:
+                return json({"code": -400, "msg": str(e)}, status=400)
             except Exception as e:
-                if os.path.exists(save_path):
-                    os.remove(save_path)
-                return json({"code": -500, "msg": repr(e)}), 501
+                return json({"code": -500, "msg": repr(e)}, status=501)
+        observe_upload("multipart", meter.bytes, meter.elapsed)
+        logger.info(f"upload {name}: {meter.bytes} bytes in {meter.elapsed:.3f}s, {format_size(int(meter.speed))}/s")
+        return json({"code": 0, "msg": "success", "data": {"name": name, **meter.json()}})
+
+    @bp.route("/upload", methods=["GET", "PATCH"])
+    async def upload(request: Request):
+        if request.method == "GET":
+            return html(jinja_env.get_template("upload.html").render())
 
         elif request.method == "PATCH":
             filename = request.json.get("filename")
             _id = request.json.get("_id")
             chunks = request.json.get("chunks")
-
-            files = glob(os.path.join(request.app.config.UPLOAD_DIR, f"{_id}-*"))
-            if len(files) != chunks:
+            if not isinstance(chunks, int) or isinstance(chunks, bool) or chunks <= 0:
+                return json({"code": -400, "msg": "chunks must be a positive integer"}, status=400)
+
+            # 按序号逐个检查，不在大目录里 glob
+            files = [os.path.join(request.app.config.UPLOAD_DIR, f"{_id}-{i}") for i in range(chunks)]
+            exists = await fs.exists_many(files)
+            pulled = {}
+            if cluster := request.app.ctx.cluster:
+                # 负载均衡把分块分散到了各个节点，缺少的从其他节点拉取
+                for i, path in enumerate(files):
+                    if not exists[i] and (peer := await cluster.pull(os.path.basename(path), path)):
+                        exists[i] = True
+                        pulled.setdefault(peer, []).append(os.path.basename(path))
+            if not all(exists):
                 return json({"error": "chunks and files don't match"}), 400
 
             try:
-                file_record = FileRecord(filename)
-                async with aiofiles.open(os.path.join(request.app.config.UPLOAD_DIR, file_record.id), "wb") as wf:
-                    for i in range(chunks):
-                        async with aiofiles.open(os.path.join(request.app.config.UPLOAD_DIR, f"{_id}-{i}"), "rb") as rf:
-                            await wf.write(await rf.read())
-                        os.remove(os.path.join(request.app.config.UPLOAD_DIR, f"{_id}-{i}"))
+                expires_at = parse_ttl(request.json.get("ttl"), request.app.config.DEFAULT_TTL)
+            except (TypeError, ValueError) as e:
+                return json({"code": -400, "msg": str(e)}, status=400)
+            try:
+                file_record = FileRecord(filename, size=0, expires_at=expires_at)
+                path = await run_sync(prepare, shard_path(request.app.config.UPLOAD_DIR, file_record.id))
+                file_record.size, digest = await run_sync(merge_files, path, files)
+                await run_sync(remove_files, files)
+                if pulled:
+                    await cluster.release_chunks(pulled)
+                file_record.hash = await dedup(request, path, digest)
                 await file_record.save()
 
-                ua = request.headers.get("User-Agent", "").lower()
-                if "mozilla" in ua:
-                    return html(
-                        f"<tr><td><a href='/{file_record.id}' target='_blank'>{file_record.filename}"
-                        f"</a></td><td>{datetime_format(file_record.created_at)}</td>"
-                        f"<td>{format_size(os.path.getsize(os.path.join(request.app.config.UPLOAD_DIR, file_record.id)))}</td>"
-                        f"<td><a href='{request.app.url_for('app.delete',mode='file',id=file_record.id)}'>"
-                        f"<bottom class='btn btn-danger'>删除</bottom></a></td></tr>"
-                    )
-                else:
-                    return text(file_record.id)
+                return uploaded_response(request, file_record)
             except Exception as e:
                 for it in files:
-                    os.remove(it)
+                    await fs.remove(it, missing_ok=True)
                 return json({"code": -501, "msg": repr(e)}), 501
 
+    @bp.post("/upload/chunks/delete")
+    async def delete_chunks(request: Request):
+        """集群内部接口：其他节点拉取并合并了本节点的旧版分块后，通知本节点删除
+
+        Args:
+            names (list[str]): 分块文件名 {uuid}-{i}
+        """
+        if not request.app.ctx.cluster or not hopped(request):
+            return json({"code": -403, "msg": "cluster only"}, status=403)
+        try:
+            names = batch_items(request, "names")
+        except ValueError as e:
+            return json({"code": -400, "msg": str(e)}, status=400)
+        if not all(isinstance(it, str) and legacy_chunk(it) for it in names):
+            return json({"code": -400, "msg": "invalid chunk name"}, status=400)
+        upload_dir = request.app.config.UPLOAD_DIR
+        await run_sync(remove_files, [os.path.join(upload_dir, it) for it in names])
+        return json({"code": 0, "msg": "success", "data": {"removed": len(names)}})
+
+    @bp.post("/upload/session")
+    async def create_session(request: Request):
+        """创建分块上传会话
+
+        Args:
+            filename (str): 文件名
+            size (int): 文件大小
+            chunk_size (int, optional): 分块大小，默认 16MB
+            ttl (float, optional): 文件存活秒数，默认为 DEFAULT_TTL，0 表示不过期
+        """
+        cluster = request.app.ctx.cluster
+        try:
+            session = await UploadSession.create(
+                request.app.config.UPLOAD_DIR,
+                request.json.get("filename"),
+                int(request.json.get("size", -1)),
+                request.json.get("chunk_size"),
+                request.json.get("ttl"),
+                # 会话 id 带上本节点名，后续请求落到其他节点时转发回来
+                cluster.node if cluster else "",
+                request.app.config.REQUEST_MAX_SIZE,
+            )
+        except InsufficientStorage as e:
+            return json({"code": -507, "msg": str(e)}, status=507)
+        except (SessionError, TypeError, ValueError) as e:
+            return json({"code": -400, "msg": str(e)}, status=400)
+        return json({"code": 0, "msg": "success", "data": session.json(list(range(session.chunks)))})
+
+    @bp.get("/upload/session/<sid:str>")
+    async def get_session(request: Request, sid: str):
+        if peer := session_peer(request, sid):
+            return await request.app.ctx.cluster.proxy(request, peer)
+        if not (session := await UploadSession.load(request.app.config.UPLOAD_DIR, sid)):
+            return json({"code": -1, "msg": "session not found"}, status=404)
+        try:
+            missing = await session.missing()
+        except SessionGone:
+            return json({"code": -1, "msg": "session not found"}, status=404)
+        return json({"code": 0, "msg": "success", "data": session.json(missing)})
+
+    @bp.put("/upload/session/<sid:str>/<index:int>", stream=True)
+    async def put_chunk(request: Request, sid: str, index: int):
+        """分块按偏移写入预分配文件，分块之间互不依赖，可并发、乱序、重传"""
+        if peer := session_peer(request, sid):
+            return await request.app.ctx.cluster.proxy(request, peer)
+        if not (session := await UploadSession.load(request.app.config.UPLOAD_DIR, sid)):
+            return json({"code": -1, "msg": "session not found"}, status=404)
+        meter = Throughput()
+        async with admitted(request):
+            try:
+                meter.add(await session.write_chunk(index, body_chunks(request)))
+            except SessionGone as e:
+                return json({"code": -1, "msg": str(e)}, status=404)
+            except SessionError as e:
+                return json({"code": -400, "msg": str(e)}, status=400)
+        observe_upload("session_chunk", meter.bytes, meter.elapsed)
+        return json({"code": 0, "msg": "success", "data": {"index": index, **meter.json()}})
+
+    @bp.post("/upload/session/<sid:str>/finalize")
+    async def finalize_session(request: Request, sid: str):
+        if peer := session_peer(request, sid):
+            return await request.app.ctx.cluster.proxy(request, peer)
+        if not (session := await UploadSession.load(request.app.config.UPLOAD_DIR, sid)):
+            return json({"code": -1, "msg": "session not found"}, status=404)
+        try:
+            path = await session.finalize()
+        except SessionGone as e:
+            # 并发的 finalize 已经完成或会话被取消
+            return json({"code": -1, "msg": str(e)}, status=404)
+        except SessionError as e:
+            try:
+                missing = await session.missing()
+            except SessionGone:
+                return json({"code": -1, "msg": "session not found"}, status=404)
+            return json({"code": -2, "msg": str(e), "data": missing}, status=409)
+        file_record = FileRecord(
+            session.filename,
+            session.file_id,
+            size=session.size,
+            expires_at=parse_ttl(session.ttl, request.app.config.DEFAULT_TTL),
+        )
+        await file_record.save()
+        # 分块可能乱序、重复写入，内容摘要只能在合并后按最终文件计算，放到后台进行
+        if request.app.config.DEDUP:
+            request.app.add_task(dedup_later(request.app, file_record, path))
+        return uploaded_response(request, file_record)
+
+    @bp.route("/upload/blob/<digest:str>", methods=["GET", "HEAD", "POST"])
+    async def upload_blob(request: Request, digest: str):
+        """秒传：客户端先算出 sha256，服务端已有相同内容时不用再传数据
+
+        GET / HEAD 只查询是否存在，POST 直接生成文件记录，不存在时返回 404，客户端再走分块上传。
+
+        Args:
+            size (int): 文件大小，必须与已有内容一致
+            filename (str): POST 时必填，文件名
+            ttl (float, optional): POST 时可选，文件存活秒数
+        """
+        body = (request.json if request.method == "POST" else None) or {}
+        try:
+            size = int(body.get("size", request.args.get("size", -1)))
+            expires_at = parse_ttl(body.get("ttl"), request.app.config.DEFAULT_TTL)
+        except (TypeError, ValueError) as e:
+            return json({"code": -400, "msg": str(e)}, status=400)
+        upload_dir = request.app.config.UPLOAD_DIR
+        if not request.app.config.DEDUP or not await run_sync(blobs.find, upload_dir, digest.lower(), size):
+            return json({"code": -1, "msg": "blob not found"}, status=404)
+        if request.method != "POST":
+            return json({"code": 0, "msg": "success", "data": {"hash": digest.lower(), "size": size}})
+        if not (filename := body.get("filename")):
+            return json({"code": -400, "msg": "filename is required"}, status=400)
+
+        file_record = FileRecord(filename, size=size, hash=digest.lower(), expires_at=expires_at)
+        dst = await run_sync(prepare, shard_path(upload_dir, file_record.id))
+        if not await run_sync(blobs.link, upload_dir, file_record.hash, size, dst):
+            return json({"code": -1, "msg": "blob not found"}, status=404)
+        await file_record.save()
+        DEDUP_FILES.inc("precheck")
+        DEDUP_BYTES.inc("precheck", value=size)
+        return uploaded_response(request, file_record)
+
+    @bp.delete("/upload/session/<sid:str>")
+    async def abort_session(request: Request, sid: str):
+        if peer := session_peer(request, sid):
+            return await request.app.ctx.cluster.proxy(request, peer)
+        if session := await UploadSession.load(request.app.config.UPLOAD_DIR, sid):
+            await session.abort()
+        return json({"code": 0, "msg": "success"})
+
+    @bp.post("/upload/bulk", stream=True)
+    async def upload_bulk(request: Request):
+        """批量上传：请求体为 tar 流（可以 gzip 压缩）或带多个文件字段的 multipart，所有文件一次登记
+
+        Args:
+            ttl (float, optional): 所有文件的存活秒数，默认为 DEFAULT_TTL，0 表示不过期
+        """
+        try:
+            expires_at = parse_ttl(request.args.get("ttl"), request.app.config.DEFAULT_TTL)
+        except (TypeError, ValueError) as e:
+            return json({"code": -400, "msg": str(e)}, status=400)
+        upload_dir = request.app.config.UPLOAD_DIR
+        async with admitted(request):
+            try:
+                items, skipped, meter = await ingest(
+                    request, upload_dir, request.app.config.REQUEST_MAX_SIZE, request.app.config.BULK_MAX_FILES
+                )
+            except (MultipartError, TarError, BulkError, zlib.error) as e:
+                return json({"code": -400, "msg": str(e)}, status=400)
+        records = [it.record for it in items]
+        try:
+            for it in items:
+                it.record.hash = await dedup(request, it.path, it.record.hash)
+                it.record.expires_at = expires_at
+            await FileRecord.save_many(records)
+        except Exception as e:
+            await run_sync(remove_files, [it.path for it in items])
+            return json({"code": -500, "msg": repr(e)}, status=500)
+        observe_upload("bulk", meter.bytes, meter.elapsed)
+        logger.info(f"bulk upload {len(records)} files: {meter.bytes} bytes in {meter.elapsed:.3f}s")
+        results = [{"name": it.name, "code": 0, "msg": "success", "file": it.record.json()} for it in items]
+        results += [{"name": name, "code": -1, "msg": "unsupported entry type"} for name in skipped]
+        return json({"code": 0, "msg": "success", "data": {"results": results, **meter.json()}})
+
     @bp.route("/msg", methods=["GET", "POST"])
     async def msg(request: Request):
         if request.method == "GET":
             msg_list = await MsgRecord.get_list()
-            return html(jinja_env.get_template("message.html".render(**{"msgs": msg_list})))
+            return html(jinja_env.get_template("message.html").render(url_for=request.app.url_for, msgs=msg_list))
         else:
-            await MsgRecord(content=request.form.get("content")).save()
+            await (record := MsgRecord(content=request.form.get("content"))).save()
+            if wants_json(request):
+                return json({"code": 0, "msg": "success", "data": record.json()})
             return response.redirect(request.app.url_for("app.index"))
 
     @bp.route("/delete/<mode:str>/<id:str>", methods=["GET"])
     async def delete(request: Request, mode: str, id: str):
         model = None
         if mode == "file":
+            request.app.ctx.hot_files.invalidate(id)
             model = await FileRecord.get(id)
-            path = os.path.join(request.app.config.UPLOAD_DIR, model.id)
-            if os.path.exists(path):
-                os.remove(path)
+            if (cluster := request.app.ctx.cluster) and cluster.cache:
+                await run_sync(cluster.cache.discard, id)
+            if model and (peer := peer_for(request, model.node)):
+                return await request.app.ctx.cluster.proxy(request, peer)
         elif mode == "msg":
             model = await MsgRecord.get(id)
         if model and not model.protected:
+            if mode == "file":
+                # 同一内容的最后一个引用删除时才真正释放 blob
+                upload_dir = request.app.config.UPLOAD_DIR
+                path = await run_sync(file_path, upload_dir, model.id)
+                await run_sync(blobs.release, upload_dir, path, model.hash)
             await model.delete()
+        if wants_json(request):
+            if not model:
+                return json({"code": -1, "msg": "not found"}, status=404)
+            return json({"code": -2, "msg": "protected"} if model.protected else {"code": 0, "msg": "success"})
         return response.redirect(request.app.url_for("app.index"))
 
     @bp.route("/<fid:path>")
     async def download(request: Request, fid: str):
+        hot_files = request.app.ctx.hot_files
+        mimetype = request.args.get("mimetype")
+        # 同一文件返回哪个压缩版本只取决于客户端接受的编码
+        cache_key = (fid, request.args.get("static"), mimetype, request_encoding(request))
+        if cached := await hot_files.get(cache_key):
+            if request.app.config.QUOTA_BYTES:
+                record_access(cached.path)
+            return send_cached(request, cached)
+
         file = None
-        file_path = ""
         if request.args.get("static") == "1":
             fid = unquote(fid, encoding="utf-8")
-            file_path = os.path.join(request.app.config.UPLOAD_DIR, fid)
-            file = FileRecord(fid)
+            file = FileRecord(fid, fid)
         else:
             file = await FileRecord.get(fid)
             if not file:
                 return json({"code": -1, "msg": "file not found.", "data": None})
-            file_path = os.path.join(request.app.config.UPLOAD_DIR, file.id)
+            if file.expired:
+                return json({"code": -3, "msg": "file expired.", "data": None}, status=410)
+
+        try:
+            path, st = await run_sync(locate, request.app.config.UPLOAD_DIR, file.id)
+        except FileNotFoundError:
+            if not (cluster := request.app.ctx.cluster):
+                return json({"code": -2, "msg": "file not exists", "data": None}, status=400)
+            # 文件在其他节点：优先用本地读穿缓存，否则从对端转发
+            if not (cached := cluster.cache and await run_sync(cluster.cache.get, file.id, file.size)):
+                if await cluster.download(request, file):
+                    return
+                return json({"code": -2, "msg": "file not exists", "data": None}, status=400)
+            path, st = cached, await fs.stat(cached)
+        if request.app.config.QUOTA_BYTES:
+            record_access(path)
 
-        if not os.path.exists(file_path):
-            return json({"code": -2, "msg": "file not exists", "data": None}), 400
-
-        mimetype = request.args.get("mimetype")
         m, download = get_media_type(file.filename.rsplit(".", 1)[-1])
         mimetype = mimetype or m
+        filename = file.filename if download else None
+
+        headers, variant = {}, None
+        if compressible(mimetype):
+            add_vary(headers)
+            encoding = request_encoding(request, mimetype)
+            if encoding and (variant := await request.app.ctx.precompressed.variant(path, st, encoding)):
+                headers["Content-Encoding"] = encoding
+
+        if st.st_size <= hot_files.max_item_bytes:
+            cached = await load_cached(file.id, path, st, mimetype, filename, headers, variant)
+            if file.expires_at:
+                cached.expires_at = file.expires_at.timestamp()
+            hot_files.put_file(cache_key, cached)
+            return send_cached(request, cached)
+
+        async with admitted(request):
+            return await send_file(
+                request,
+                variant or path,
+                mimetype,
+                filename=filename,
+                headers=headers,
+                size=await fs.getsize(variant) if variant else st.st_size,
+                etag=file_etag(file.id, st, headers.get("Content-Encoding")),
+                mtime=st.st_mtime,
+            )
 
-        return await file_stream(
-            file_path,
-            chunk_size=1024 * 1024 * 4,
-            filename=file.filename if download else None,
-            mime_type=mimetype,
-            headers={"Content-Length": str(os.path.getsize(file_path))},
+    @bp.route("/archive", methods=["GET", "HEAD", "POST"])
+    async def archive(request: Request):
+        """把多个文件打包成一个 zip / tar 流式下载
+
+        Args:
+            ids (str): 逗号分隔的文件 id，POST 时也可以放在 json 的 ids 列表里
+            format (str, optional): zip（默认）或 tar
+            deflate (bool, optional): zip 是否压缩，默认只存储，存储模式支持断点续传
+
+        不存在、已过期或存放在其他节点上的文件跳过，数量和 id（最多 MAX_SKIPPED_REPORT 个，URL 编码）
+        分别放在 X-Archive-Skipped-Count、X-Archive-Skipped 响应头里；全部跳过时返回 404。
+        """
+        body = (request.json if request.method == "POST" else None) or {}
+        ids = body.get("ids") or [it for it in request.args.get("ids", "").split(",") if it]
+        fmt = body.get("format") or request.args.get("format", "zip")
+        try:
+            deflate = parse_flag(body.get("deflate", request.args.get("deflate", "0")))
+        except ValueError as e:
+            return json({"code": -1, "msg": str(e), "data": None}, status=400)
+        if not ids:
+            return json({"code": -1, "msg": "ids is required", "data": None}, status=400)
+        if not isinstance(ids, list) or not all(isinstance(it, str) for it in ids):
+            return json({"code": -1, "msg": "ids must be a list of strings", "data": None}, status=400)
+        if len(ids) > MAX_ARCHIVE_FILES:
+            return json({"code": -1, "msg": f"too many files, max {MAX_ARCHIVE_FILES}", "data": None}, status=400)
+        if not isinstance(fmt, str) or fmt not in FORMATS:
+            return json({"code": -1, "msg": f"unsupported format: {fmt}", "data": None}, status=400)
+
+        ids = list(dict.fromkeys(ids))
+        records = {it.id: it for it in await FileRecord.get_many(ids)}
+        # 与单个下载一致：过期的文件不打包
+        files = [records[it] for it in ids if it in records and not records[it].expired]
+        cluster = request.app.ctx.cluster
+        located = await run_sync(
+            locate_files, request.app.config.UPLOAD_DIR, files, cluster.cache if cluster else None
         )
+        files = [(file, it) for file, it in zip(files, located) if it]
+        # 不存在、已过期或者在其他节点上（本地没有缓存）的文件不打包，在响应头里列出
+        included = {file.id for file, _ in files}
+        skipped = [it for it in ids if it not in included]
+        if not files:
+            return json({"code": -1, "msg": "files not found", "data": {"skipped": skipped}}, status=404)
+        names = unique_names([file.filename for file, _ in files])
+        members = [
+            Member(name, path, st.st_size, st.st_mtime) for name, (file, (path, st)) in zip(names, files)
+        ]
+        headers = {}
+        if skipped:
+            headers["X-Archive-Skipped-Count"] = str(len(skipped))
+            headers["X-Archive-Skipped"] = ",".join(quote(it, safe="") for it in skipped[:MAX_SKIPPED_REPORT])
+        async with admitted(request):
+            return await send_archive(request, create_archive(members, fmt, deflate), f"files.{fmt}", headers)
+
+    # 文件和消息的新增 / 删除事件，页面据此增量更新列表
+    bp.add_route(stream_events, "/events", methods=["GET"], name="events")
+
+    @bp.get("/stats")
+    async def stats(request: Request):
+        data = {"hot_files": request.app.ctx.hot_files.stats()}
+        if model.record_cache is not None:
+            data["records"] = model.record_cache.stats()
+        return json({"code": 0, "msg": "success", "data": data})
 
     @bp.get("/make")
     async def make_record(request: Request):
-        newfiles = []
-        for f in glob(request.app.config.UPLOAD_DIR + "/*"):
-            if not os.path.isfile(f):
-                continue
-            basename = os.path.basename(f)
-            if not await FileRecord.get(basename) and not await FileRecord.get_by_filename(basename):
-                newfiles.append((newf := FileRecord(basename)))
-                await newf.save()
-                os.rename(f, os.path.join(os.path.dirname(f), newf.id))
+        newfiles = await reconcile(request.app.config.UPLOAD_DIR)
         return json({"code": 0, "msg": "success", "data": [it.filename for it in newfiles]})
 
     @bp.get("/alias")
@@ -184,14 +723,134 @@ def create_bp(prefix: str = "/"):
         protected = bool(int(request.args.get("protect", "0")))
         if not (file := await FileRecord.get(id)):
             return json({"code": -1, "msg": "file not exists"})
+        if peer := peer_for(request, file.node):
+            return await request.app.ctx.cluster.proxy(request, peer)
         if await FileRecord.get(alias):
             return json({"code": -2, "msg": "alias already exists"})
 
         await file.delete()
-        await (alias_file := FileRecord(file.filename, alias, protected)).save()
-        os.rename(os.path.join(request.app.config.UPLOAD_DIR, id), os.path.join(request.app.config.UPLOAD_DIR, alias))
+        request.app.ctx.hot_files.invalidate(id)
+        alias_file = FileRecord(
+            file.filename, alias, protected, size=file.size, hash=file.hash, expires_at=file.expires_at
+        )
+        await alias_file.save()
+        upload_dir = request.app.config.UPLOAD_DIR
+        src = await run_sync(file_path, upload_dir, id)
+        await fs.rename(src, await run_sync(prepare, shard_path(upload_dir, alias)))
         return json(alias_file.json())
 
+    @bp.post("/files/get")
+    async def batch_get(request: Request):
+        """按 id 列表批量获取文件信息
+
+        Args:
+            ids (list): 文件 id 列表，结果按请求顺序逐条返回
+        """
+        try:
+            ids = list(dict.fromkeys(map(str, batch_items(request, "ids"))))
+        except ValueError as e:
+            return json({"code": -400, "msg": str(e)}, status=400)
+        records = {it.id: it for it in await FileRecord.get_many(ids)}
+        results = [
+            batch_result(id_, file=records[id_].json()) if id_ in records else batch_result(id_, -1, "file not exists")
+            for id_ in ids
+        ]
+        return json({"code": 0, "msg": "success", "data": {"results": results}})
+
+    @bp.post("/files/delete")
+    async def batch_delete(request: Request):
+        """按 id 列表批量删除文件，受保护的文件不删除
+
+        Args:
+            ids (list): 文件 id 列表，结果按请求顺序逐条返回
+        """
+        try:
+            ids = list(dict.fromkeys(map(str, batch_items(request, "ids"))))
+        except ValueError as e:
+            return json({"code": -400, "msg": str(e)}, status=400)
+        cluster = request.app.ctx.cluster
+        records = {it.id: it for it in await FileRecord.get_many(ids)}
+        results, local, remote = {}, [], {}
+        for id_ in ids:
+            request.app.ctx.hot_files.invalidate(id_)
+            if not (record := records.get(id_)):
+                results[id_] = batch_result(id_, -1, "file not exists")
+            elif record.protected:
+                results[id_] = batch_result(id_, -2, "protected")
+            elif peer := peer_for(request, record.node):
+                remote.setdefault(peer, []).append(id_)
+            else:
+                local.append(record)
+        if cluster and cluster.cache:
+            await run_sync(cluster.cache.discard, *ids)
+        # 同一内容的最后一个引用删除时才真正释放 blob
+        await run_sync(release_files, request.app.config.UPLOAD_DIR, local)
+        await FileRecord.delete_many(local)
+        results.update((it.id, batch_result(it.id)) for it in local)
+        results.update(await forward_batch(request, remote, "ids"))
+        return json({"code": 0, "msg": "success", "data": {"results": [results[it] for it in ids]}})
+
+    @bp.post("/files/alias")
+    async def batch_alias(request: Request):
+        """批量把文件的 id 改成指定的 alias
+
+        Args:
+            items (list): [{"id": 原始 id, "alias": 新 id, "protect": 0 或 1}]，结果按请求顺序逐条返回
+        """
+        try:
+            items = batch_items(request, "items")
+            items = [
+                {"id": str(it["id"]), "alias": str(it["alias"]), "protect": int(it.get("protect", 0))} for it in items
+            ]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return json({"code": -400, "msg": str(e) or "invalid items"}, status=400)
+        upload_dir = request.app.config.UPLOAD_DIR
+        records = {it.id: it for it in await FileRecord.get_many([it["id"] for it in items])}
+        taken = {it.id for it in await FileRecord.get_many([it["alias"] for it in items])}
+        results, local, remote = {}, [], {}
+        for it in items:
+            id_, alias = it["id"], it["alias"]
+            if id_ in results:
+                continue
+            if not (record := records.get(id_)):
+                results[id_] = batch_result(id_, -1, "file not exists")
+            elif not alias or alias in taken:
+                results[id_] = batch_result(id_, -2, "alias already exists")
+            elif peer := peer_for(request, record.node):
+                remote.setdefault(peer, []).append(it)
+                results[id_] = None
+            else:
+                local.append((record, alias, bool(it["protect"])))
+                results[id_] = None
+            taken.add(alias)
+
+        pairs = [(record.id, alias) for record, alias, _ in local]
+        errors = await run_sync(rename_files, upload_dir, pairs)
+        renamed = [(item, pair) for item, pair, error in zip(local, pairs, errors) if error is None]
+        for (record, _, _), error in zip(local, errors):
+            if error is not None:
+                results[record.id] = batch_result(record.id, -500, error)
+        old = [record for (record, _, _), _ in renamed]
+        new = [
+            FileRecord(
+                record.filename, alias, protected, size=record.size, hash=record.hash, expires_at=record.expires_at
+            )
+            for (record, alias, protected), _ in renamed
+        ]
+        try:
+            # 先登记新 id，失败时改回文件名，旧记录保持不变
+            await FileRecord.save_many(new)
+        except Exception:
+            await rename_back(upload_dir, [pair for _, pair in renamed])
+            raise
+        await FileRecord.delete_many(old)
+        for record, alias_file in zip(old, new):
+            request.app.ctx.hot_files.invalidate(record.id)
+            results[record.id] = batch_result(record.id, file=alias_file.json())
+        results.update(await forward_batch(request, remote, "items"))
+        ids = dict.fromkeys(it["id"] for it in items)
+        return json({"code": 0, "msg": "success", "data": {"results": [results[it] for it in ids]}})
+
     return bp
 
 
@@ -199,24 +858,126 @@ def create_app(prefix: str = "/"):
     bp = create_bp(prefix)
     app = Sanic(f"sserver")
     app.config.UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join(os.getcwd(), "upload"))
+    # 文件按 id 的哈希分到 UPLOAD_SHARD_LEVELS 级子目录，0 为平铺；改动后用 python -m sserver.migrate 迁移旧文件
+    app.config.UPLOAD_SHARD_LEVELS = int(os.environ.get("UPLOAD_SHARD_LEVELS", 0))
+    app.config.UPLOAD_SHARD_WIDTH = int(os.environ.get("UPLOAD_SHARD_WIDTH", 2))
+    setup_layout(app.config.UPLOAD_SHARD_LEVELS, app.config.UPLOAD_SHARD_WIDTH)
+    # 阻塞的文件系统调用都在 FS_WORKERS 个线程里排队，要先于其他启动回调注册
+    setup_fs(app)
     app.config.REQUEST_MAX_SIZE = int(os.environ.get("REQUEST_MAX_SIZE", 10 * 1024 * 1024 * 1024))
+    # 一次批量上传最多包含的文件数
+    app.config.BULK_MAX_FILES = int(os.environ.get("BULK_MAX_FILES", 10000))
+    app.config.SENDFILE = os.environ.get("SENDFILE", "True").lower() == "true"
+    app.config.HOT_CACHE_SIZE = int(os.environ.get("HOT_CACHE_SIZE", 64 * 1024 * 1024))
+    app.config.HOT_CACHE_ITEM_SIZE = int(os.environ.get("HOT_CACHE_ITEM_SIZE", 1024 * 1024))
+    app.ctx.hot_files = HotFileCache(app.config.HOT_CACHE_SIZE, app.config.HOT_CACHE_ITEM_SIZE)
+    app.config.RECORD_CACHE_SIZE = int(os.environ.get("RECORD_CACHE_SIZE", 10000))
+    app.config.RECORD_CACHE_TTL = float(os.environ.get("RECORD_CACHE_TTL", 60))
+    app.config.RECORD_CACHE_NEGATIVE_TTL = float(os.environ.get("RECORD_CACHE_NEGATIVE_TTL", 5))
+    # 后台自动登记直接放进 UPLOAD_DIR 的文件，效果等同于自动调用 /make
+    app.config.WATCH_UPLOAD_DIR = os.environ.get("WATCH_UPLOAD_DIR", "False").lower() == "true"
+    app.config.WATCH_SETTLE = float(os.environ.get("WATCH_SETTLE", 2))
+    # 后台维护：过期文件、失效记录、废弃分块和配额淘汰，GC_INTERVAL 为 0 时关闭
+    app.config.GC_INTERVAL = float(os.environ.get("GC_INTERVAL", 600))
+    app.config.GC_BATCH = int(os.environ.get("GC_BATCH", 500))
+    app.config.GC_PAUSE = float(os.environ.get("GC_PAUSE", 0.2))
+    app.config.ORPHAN_AGE = float(os.environ.get("ORPHAN_AGE", 24 * 3600))
+    app.config.DEFAULT_TTL = float(os.environ.get("DEFAULT_TTL", 0))
+    app.config.QUOTA_BYTES = int(os.environ.get("QUOTA_BYTES", 0))
+    app.config.QUOTA_LOW_WATERMARK = float(os.environ.get("QUOTA_LOW_WATERMARK", 0.9))
+    app.config.EVICTION_POLICY = os.environ.get("EVICTION_POLICY", "lru").lower()
+    # 压缩版本缓存和集群读穿缓存中超过这个秒数没有访问的文件由后台维护删除
+    app.config.CACHE_MAX_AGE = float(os.environ.get("CACHE_MAX_AGE", 7 * 24 * 3600))
+    # 文本类文件和页面按 Accept-Encoding 压缩，文件的压缩版本缓存在 COMPRESS_CACHE_DIR
+    app.config.COMPRESS = os.environ.get("COMPRESS", "True").lower() == "true"
+    app.config.COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+    app.config.COMPRESS_MAX_SIZE = int(os.environ.get("COMPRESS_MAX_SIZE", 64 * 1024 * 1024))
+    app.config.COMPRESS_CACHE_DIR = os.environ.get(
+        "COMPRESS_CACHE_DIR", os.path.join(app.config.UPLOAD_DIR, ".compressed")
+    )
+    # 压缩版本缓存的总大小上限，0 表示只按 CACHE_MAX_AGE 清理
+    app.config.COMPRESS_CACHE_BYTES = int(os.environ.get("COMPRESS_CACHE_BYTES", 0))
+    app.ctx.precompressed = PrecompressedCache(
+        app.config.COMPRESS_CACHE_DIR,
+        app.config.COMPRESS_LEVEL,
+        app.config.COMPRESS_MAX_SIZE,
+        app.config.COMPRESS_CACHE_BYTES or float("inf"),
+    )
+    app.register_middleware(compress_response, "response")
+    setup_metrics(app)
+    setup_limits(app)
+    setup_cluster(app)
+    model.local_node = app.config.CLUSTER_NODE
+    # 相同内容只存一份，上传完成后按 sha256 链接到 UPLOAD_DIR/.blobs 下的 blob
+    app.config.DEDUP = os.environ.get("DEDUP", "True").lower() == "true"
+    # 事件推送的轮询间隔，本 worker 发布的事件立即分发，其他 worker 的最多延迟这么久
+    app.config.EVENTS_POLL_INTERVAL = float(os.environ.get("EVENTS_POLL_INTERVAL", 0.2))
+    setup_events(app, {"file": FileRecord, "msg": MsgRecord})
+    registry.add_collector(partial(collect_cache_stats, app))
     app.blueprint(bp)
 
+    @app.main_process_start
+    async def create_shared(app, loop):
+        # 记录缓存的失效广播，所有 worker 共享
+        app.shared_ctx.record_log = InvalidationLog.create()
+
     @app.listener("before_server_start")
     async def setup(app, loop):
         await get_db()
+        app.ctx.dedup_lock = asyncio.Lock()
+        record_log = getattr(app.shared_ctx, "record_log", None)
+        setup_record_cache(
+            app.config.RECORD_CACHE_SIZE,
+            app.config.RECORD_CACHE_TTL,
+            app.config.RECORD_CACHE_NEGATIVE_TTL,
+            InvalidationLog(*record_log) if record_log else None,
+        )
+        # 预编译模板，生产模式下渲染时不再检查模板文件
+        for name in jinja_env.list_templates():
+            jinja_env.get_template(name)
 
         static_files = ["favicon.ico", "*.js", "*.css"]
-        if not os.path.exists(app.config.UPLOAD_DIR):
-            os.makedirs(app.config.UPLOAD_DIR)
+        await fs.makedirs(app.config.UPLOAD_DIR)
         src_path = os.path.join(os.path.dirname(__file__), "upload")
-        files = chain(*[glob(os.path.join(src_path, it)) for it in static_files])
-        for file in files:
-            filename = os.path.basename(file)
-            if not await FileRecord.get(filename):
-                await FileRecord(filename, filename, True).save()
-            if not os.path.exists((dst_file := (app.config.UPLOAD_DIR + f"/{filename}"))):
-                shutil.copy(file, dst_file)
+        for pattern in static_files:
+            for file in await fs.glob(os.path.join(src_path, pattern)):
+                filename = os.path.basename(file)
+                if not await FileRecord.get(filename):
+                    await FileRecord(filename, filename, True, size=await fs.getsize(file)).save()
+                dst = await run_sync(file_path, app.config.UPLOAD_DIR, filename)
+                if not await fs.exists(dst):
+                    await fs.copy(file, await run_sync(prepare, dst))
+        await FileRecord.backfill_size(app.config.UPLOAD_DIR)
+
+    @app.listener("after_server_start")
+    async def start_watcher(app, loop):
+        if app.config.WATCH_UPLOAD_DIR:
+            # 多个 worker 都会启动，只有拿到文件锁的那个真正监听
+            watcher = UploadDirWatcher(app.config.UPLOAD_DIR, settle=app.config.WATCH_SETTLE)
+            app.add_task(watcher.run(), name="upload_dir_watcher")
+
+    @app.listener("after_server_start")
+    async def start_maintenance(app, loop):
+        if app.config.GC_INTERVAL > 0:
+            # 同样只有拿到文件锁的 worker 执行
+            caches = [app.ctx.precompressed]
+            if (cluster := app.ctx.cluster) and cluster.cache:
+                caches.append(cluster.cache)
+            maintenance = Maintenance(
+                app.config.UPLOAD_DIR,
+                interval=app.config.GC_INTERVAL,
+                quota=app.config.QUOTA_BYTES,
+                low_watermark=app.config.QUOTA_LOW_WATERMARK,
+                policy=app.config.EVICTION_POLICY,
+                orphan_age=app.config.ORPHAN_AGE,
+                batch=app.config.GC_BATCH,
+                pause=app.config.GC_PAUSE,
+                on_delete=app.ctx.hot_files.invalidate,
+                node=app.config.CLUSTER_NODE or None,
+                caches=caches,
+                cache_age=app.config.CACHE_MAX_AGE,
+            )
+            app.add_task(maintenance.run(), name="upload_dir_maintenance")
 
     return app
 
@@ -226,11 +987,13 @@ def parseargs():
     parser.add_argument("--host", "-H", type=str, default="0.0.0.0", help="host")
     parser.add_argument("--port", "-p", type=int, default=3001, help="port")
     parser.add_argument("--prefix", "-a", type=str, default="/", help="prefix")
+    add_arguments(parser)
     return parser.parse_args()
 
 
 def main():
     args = parseargs()
+    apply_arguments(args)
     loader = AppLoader(factory=partial(create_app, args.prefix))
     app = loader.load()
     ssl = {
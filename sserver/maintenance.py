@@ -0,0 +1,322 @@
+"""UPLOAD_DIR 的后台维护
+
+由一个 worker（文件锁选出）定期执行：
+
+- 清理超过 orphan_age 没有写入的分块上传会话、旧版分块文件 {uuid}-{i} 和没有记录引用的 blob
+- 删除已过期（expires_at）的文件和记录，以及文件已经不存在的记录
+- 清理压缩版本缓存（.compressed）和集群读穿缓存（.peer-cache）中超过 cache_age 没有访问的文件，
+  以及各自的大小上限之外的部分
+- 配置了配额时，两个缓存也计入占用；超过 quota 先缩减缓存，再按最近访问时间（lru）或写入时间（oldest）
+  淘汰非 protected 的文件，直到降到 quota * low_watermark
+
+记录按 id 分批遍历，文件系统操作放在线程池里，每批之间 sleep，不影响请求处理。
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sanic.log import logger
+
+from sserver import fs
+from sserver.blobs import orphan_blobs, release
+from sserver.bulk import BULK_DIR
+from sserver.layout import file_path, iter_files
+from sserver.metrics import GC_BYTES, GC_FILES, STORAGE_BYTES
+from sserver.model import FileRecord
+from sserver.reconcile import ignored, legacy_chunk
+from sserver.session import SESSION_DIR
+from sserver.utils import run_sync, try_lock
+
+POLICIES = ("lru", "oldest")
+# 记录创建后一段时间内文件可能还没落盘，不当作失效记录
+DANGLING_GRACE = 300
+# 下载时最多按这个间隔刷新一次文件的 atime，供 lru 淘汰使用
+ACCESS_RESOLUTION = 3600
+MAX_ACCESS_ENTRIES = 100000
+
+_accessed: Dict[str, float] = {}
+
+
+def parse_ttl(value, default: float = 0) -> Optional[datetime]:
+    """上传时指定的存活秒数，转成过期时间；0 或不指定且没有默认值时永不过期"""
+    ttl = float(value) if value not in (None, "") else default
+    if ttl < 0:
+        raise ValueError(f"invalid ttl: {value}")
+    return datetime.now() + timedelta(seconds=ttl) if ttl else None
+
+
+def record_access(path: str):
+    """显式刷新 atime，不依赖 relatime / noatime 挂载选项；同一文件在本进程内每 ACCESS_RESOLUTION 秒最多一次
+
+    stat 和 utime 交给文件系统线程池，不等待结果。
+    """
+    now = time.time()
+    if now - _accessed.get(path, 0) < ACCESS_RESOLUTION:
+        return
+    if len(_accessed) >= MAX_ACCESS_ENTRIES:
+        _accessed.clear()
+    _accessed[path] = now
+    fs.spawn(touch_atime, path)
+
+
+def touch_atime(path: str):
+    try:
+        st = os.stat(path)
+        if time.time() - st.st_atime >= ACCESS_RESOLUTION:
+            os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+    except OSError:
+        pass
+
+
+def find_orphans(upload_dir: str, max_age: float) -> List[Tuple[str, int]]:
+    """超过 max_age 没有写入的旧版分块文件、上传会话和批量上传的临时文件，以及同样久没有引用的 blob，返回 (路径, 大小)"""
+    deadline = time.time() - max_age
+    orphans = []
+    with os.scandir(upload_dir) as it:
+        for entry in it:
+            if legacy_chunk(entry.name) and entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                if st.st_mtime < deadline:
+                    orphans.append((entry.path, st.st_size))
+
+    session_dir = os.path.join(upload_dir, SESSION_DIR)
+    sessions: Dict[str, List[Tuple[str, os.stat_result]]] = {}
+    try:
+        with os.scandir(session_dir) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    sid = entry.name.split(".", 1)[0]
+                    sessions.setdefault(sid, []).append((entry.path, entry.stat(follow_symlinks=False)))
+    except FileNotFoundError:
+        pass
+    for files in sessions.values():
+        # 任何一个分块还在写入，整个会话都保留
+        if max(st.st_mtime for _, st in files) < deadline:
+            # 预分配的文件按实际占用的块计算
+            orphans += [(path, st.st_blocks * 512) for path, st in files]
+
+    try:
+        with os.scandir(os.path.join(upload_dir, BULK_DIR)) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    if st.st_mtime < deadline:
+                        orphans.append((entry.path, st.st_size))
+    except FileNotFoundError:
+        pass
+    return orphans + orphan_blobs(upload_dir, deadline)
+
+
+def stat_files(upload_dir: str, names: List[str]) -> Dict[str, Optional[int]]:
+    """文件大小，不存在时为 None"""
+    sizes = {}
+    for name in names:
+        try:
+            sizes[name] = os.stat(file_path(upload_dir, name)).st_size
+        except FileNotFoundError:
+            sizes[name] = None
+    return sizes
+
+
+def disk_usage(upload_dir: str, policy: str) -> Tuple[int, List[Tuple[float, str, int]]]:
+    """UPLOAD_DIR 中的文件、blob 和上传会话的总占用，以及可淘汰文件 (排序键, 文件名, 大小)，按淘汰顺序排列
+
+    链接到同一个 blob 的文件只算一次。
+    """
+    total, files, seen = 0, [], set()
+    for entry in iter_files(upload_dir):
+        st = entry.stat(follow_symlinks=False)
+        if st.st_ino not in seen:
+            total += st.st_size
+            seen.add(st.st_ino)
+        if not ignored(entry.name):
+            files.append((st.st_atime if policy == "lru" else st.st_mtime, entry.name, st.st_size))
+    try:
+        with os.scandir(os.path.join(upload_dir, SESSION_DIR)) as it:
+            total += sum(entry.stat(follow_symlinks=False).st_blocks * 512 for entry in it)
+    except FileNotFoundError:
+        pass
+    # 只剩 blob 自己引用的内容
+    total += sum(size for _, size in orphan_blobs(upload_dir, float("inf")))
+    files.sort()
+    return total, files
+
+
+def dir_usage(path: str) -> int:
+    """目录下所有普通文件的大小之和，目录不存在时为 0"""
+    total, stack = 0, [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except FileNotFoundError:
+                        pass
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class Maintenance:
+    """定期回收 UPLOAD_DIR 空间的后台任务，quota 为 0 时不做配额淘汰
+
+    集群模式下 node 为本节点名，记录表是共享的，只处理存放在本节点的记录。
+    caches 是可以随时重建的磁盘缓存（PrecompressedCache / PeerCache），需要有 cache_dir 和 prune(max_age, max_bytes)。
+    """
+
+    def __init__(
+        self,
+        upload_dir: str,
+        interval: float = 600,
+        quota: int = 0,
+        low_watermark: float = 0.9,
+        policy: str = "lru",
+        orphan_age: float = 86400,
+        batch: int = 500,
+        pause: float = 0.2,
+        on_delete: Optional[Callable[[str], None]] = None,
+        node: Optional[str] = None,
+        caches: Sequence = (),
+        cache_age: float = 7 * 86400,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown eviction policy: {policy}")
+        self.upload_dir = upload_dir
+        self.interval = interval
+        self.quota = quota
+        self.low_watermark = low_watermark
+        self.policy = policy
+        self.orphan_age = orphan_age
+        self.batch = batch
+        self.pause = pause
+        self.on_delete = on_delete
+        self.node = node
+        self.caches = list(caches)
+        self.cache_age = cache_age
+
+    async def run(self):
+        if (fd := try_lock(os.path.join(self.upload_dir, ".maintenance.lock"))) is None:
+            return
+        try:
+            while True:
+                try:
+                    await self.collect()
+                except Exception:
+                    logger.exception("upload dir maintenance failed")
+                await asyncio.sleep(self.interval)
+        finally:
+            os.close(fd)
+
+    async def collect(self) -> Dict[str, Tuple[int, int]]:
+        """执行一轮维护，返回 {原因: (删除数, 字节数)}"""
+        start = time.perf_counter()
+        stats: Dict[str, Tuple[int, int]] = {}
+        for reason, (count, size) in (
+            ("orphan", await self.purge_orphans()),
+            ("cache", await self.purge_caches()),
+            *(await self.purge_records()).items(),
+            ("quota", await self.enforce_quota()),
+        ):
+            stats[reason] = (count, size)
+            GC_FILES.inc(reason, value=count)
+            GC_BYTES.inc(reason, value=size)
+        if any(count for count, _ in stats.values()):
+            summary = ", ".join(f"{k}={n} ({size} bytes)" for k, (n, size) in stats.items() if n)
+            logger.info(f"upload dir maintenance in {time.perf_counter() - start:.2f}s: {summary}")
+        return stats
+
+    async def purge_orphans(self) -> Tuple[int, int]:
+        orphans = await run_sync(find_orphans, self.upload_dir, self.orphan_age)
+        for i in range(0, len(orphans), self.batch):
+            await run_sync(remove_files, [path for path, _ in orphans[i : i + self.batch]])
+            await asyncio.sleep(self.pause)
+        return len(orphans), sum(size for _, size in orphans)
+
+    async def purge_caches(self) -> Tuple[int, int]:
+        removed = []
+        for cache in self.caches:
+            removed += await run_sync(cache.prune, self.cache_age)
+        return len(removed), sum(size for _, size in removed)
+
+    async def purge_records(self) -> Dict[str, Tuple[int, int]]:
+        """遍历全部记录：删除过期的文件和记录，以及文件不存在的记录"""
+        expired, dangling = [0, 0], [0, 0]
+        after = None
+        while records := await FileRecord.scan(after, self.batch):
+            after = records[-1].id
+            records = [it for it in records if not it.protected]
+            sizes = await run_sync(stat_files, self.upload_dir, [it.id for it in records])
+            grace = datetime.now() - timedelta(seconds=DANGLING_GRACE)
+            for record in records:
+                # 其他节点的文件本地不存在，不能当成失效记录；没有节点信息的旧记录以本地是否有文件为准
+                if self.node is not None and record.node != self.node and (record.node or sizes[record.id] is None):
+                    continue
+                if record.expired:
+                    expired[0] += 1
+                    expired[1] += await self.remove(record)
+                elif sizes[record.id] is None and record.created_at < grace:
+                    await self.remove(record)
+                    dangling[0] += 1
+            await asyncio.sleep(self.pause)
+        return {"expired": tuple(expired), "dangling": tuple(dangling)}
+
+    async def enforce_quota(self) -> Tuple[int, int]:
+        if self.quota <= 0:
+            return 0, 0
+        total, files = await run_sync(disk_usage, self.upload_dir, self.policy)
+        cache_sizes = [await run_sync(dir_usage, cache.cache_dir) for cache in self.caches]
+        total += sum(cache_sizes)
+        STORAGE_BYTES.set("used", value=total)
+        STORAGE_BYTES.set("quota", value=self.quota)
+        if total <= self.quota:
+            return 0, 0
+
+        target = self.quota * self.low_watermark
+        count, freed = 0, 0
+        # 缓存可以重建，先于文件淘汰
+        for cache, size in zip(self.caches, cache_sizes):
+            if total - freed <= target:
+                break
+            removed = await run_sync(cache.prune, self.cache_age, max(0, size - (total - freed - target)))
+            count, freed = count + len(removed), freed + sum(n for _, n in removed)
+        for i in range(0, len(files), self.batch):
+            if total - freed <= target:
+                break
+            batch = files[i : i + self.batch]
+            records = {it.id: it for it in await FileRecord.get_many([name for _, name, _ in batch])}
+            for _, name, _ in batch:
+                # 没有记录的文件不归服务管理，不删
+                if (record := records.get(name)) is None or record.protected:
+                    continue
+                # 与其他记录共享 blob 的文件删除后不释放空间
+                count, freed = count + 1, freed + await self.remove(record)
+                if total - freed <= target:
+                    break
+            await asyncio.sleep(self.pause)
+        if total - freed > target:
+            logger.warning(f"{self.upload_dir} still uses {total - freed} bytes, quota {self.quota}")
+        STORAGE_BYTES.set("used", value=total - freed)
+        return count, freed
+
+    async def remove(self, record: FileRecord) -> int:
+        """先删文件再删记录，中途失败只会留下失效记录，下一轮清理；返回释放的字节数"""
+        path = await run_sync(file_path, self.upload_dir, record.id)
+        freed = await run_sync(release, self.upload_dir, path, record.hash)
+        await record.delete()
+        if self.on_delete:
+            self.on_delete(record.id)
+        return freed
@@ -0,0 +1,372 @@
+"""Prometheus 格式的指标
+
+每个 worker 在进程内累加，定时把快照写到主进程创建的共享内存槽位里，
+/metrics 读取所有槽位合并后输出。计数器和直方图会合并已退出 worker 的数据，
+新 worker 接手旧槽位时从旧值继续累加，保证单调；仪表盘只统计存活的 worker。
+"""
+import asyncio
+import json
+import os
+import time
+import weakref
+from bisect import bisect_left
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sanic.log import logger
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help_: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], object] = {}
+
+    def dump(self):
+        return {
+            "type": self.type,
+            "help": self.help,
+            "labels": self.labels,
+            "values": [[list(k), v] for k, v in self.values.items()],
+        }
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, value: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, *labels, value: float):
+        self.values[labels] = value
+
+    def inc(self, *labels, value: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def dec(self, *labels, value: float = 1):
+        self.inc(*labels, value=-value)
+
+
+class Histogram(Metric):
+    """values 为 [各桶计数..., +Inf 桶计数, sum]，桶计数不累积"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help_: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        if (item := self.values.get(labels)) is None:
+            item = self.values[labels] = [0] * (len(self.buckets) + 2)
+        item[bisect_left(self.buckets, value)] += 1
+        item[-1] += value
+
+    def dump(self):
+        return {**super().dump(), "buckets": self.buckets}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_, labels))
+
+    def gauge(self, name: str, help_: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_, labels))
+
+    def histogram(self, name: str, help_: str, labels: Sequence[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_, labels, buckets))
+
+    def add_collector(self, func: Callable[[], None]):
+        """导出前调用，用来把缓存统计之类的现成数据写进仪表盘"""
+        self.collectors.append(func)
+
+    def dump(self) -> dict:
+        for func in self.collectors:
+            func()
+        return {name: metric.dump() for name, metric in self.metrics.items()}
+
+    def restore(self, snapshot: dict):
+        """接手已退出 worker 的槽位时继承它的计数器和直方图"""
+        for name, data in snapshot.items():
+            metric = self.metrics.get(name)
+            if metric is None or metric.type == "gauge" or data["type"] != metric.type:
+                continue
+            for labels, value in data["values"]:
+                key = tuple(labels)
+                if metric.type == "counter":
+                    metric.values[key] = metric.values.get(key, 0) + value
+                elif len(value) == len(metric.buckets) + 2:
+                    current = metric.values.setdefault(key, [0] * len(value))
+                    for i, v in enumerate(value):
+                        current[i] += v
+
+
+class MetricsBoard:
+    """共享内存里的快照槽位，每个 worker 一个"""
+
+    SLOTS = 64
+    SLOT_SIZE = 256 * 1024
+
+    def __init__(self, pids, lengths, data, lock):
+        self.pids = pids
+        self.lengths = lengths
+        self.data = data
+        self.lock = lock
+        self.slot: Optional[int] = None
+
+    @classmethod
+    def create(cls):
+        return RawArray("i", cls.SLOTS), RawArray("i", cls.SLOTS), RawArray("c", cls.SLOTS * cls.SLOT_SIZE), Lock()
+
+    @staticmethod
+    def alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def read(self, slot: int) -> Optional[dict]:
+        n = self.lengths[slot]
+        if not n:
+            return None
+        try:
+            return json.loads(self.data[slot * self.SLOT_SIZE : slot * self.SLOT_SIZE + n])
+        except ValueError:
+            return None
+
+    def claim(self, pid: int) -> Optional[dict]:
+        """占用一个空闲槽位，返回槽位里已退出 worker 留下的快照"""
+        with self.lock:
+            free = [i for i in range(self.SLOTS) if not self.pids[i]]
+            dead = [i for i in range(self.SLOTS) if self.pids[i] and not self.alive(self.pids[i])]
+            if not free and not dead:
+                return None
+            self.slot = free[0] if free else dead[0]
+            self.pids[self.slot] = pid
+            return self.read(self.slot)
+
+    def publish(self, snapshot: dict) -> bool:
+        if self.slot is None:
+            return False
+        payload = json.dumps(snapshot, separators=(",", ":")).encode()
+        if len(payload) > self.SLOT_SIZE:
+            logger.warning(f"metrics snapshot too large: {len(payload)} bytes")
+            return False
+        start = self.slot * self.SLOT_SIZE
+        with self.lock:
+            self.data[start : start + len(payload)] = payload
+            self.lengths[self.slot] = len(payload)
+        return True
+
+    def collect(self) -> List[Tuple[bool, dict]]:
+        """返回 (worker 是否存活, 快照)"""
+        ret = []
+        with self.lock:
+            slots = [(i, self.pids[i]) for i in range(self.SLOTS) if self.pids[i]]
+            snapshots = [(pid, self.read(i)) for i, pid in slots]
+        for pid, snapshot in snapshots:
+            if snapshot:
+                ret.append((self.alive(pid), snapshot))
+        return ret
+
+
+def merge(snapshots: List[Tuple[bool, dict]]) -> dict:
+    merged: Dict[str, dict] = {}
+    for alive, snapshot in snapshots:
+        for name, data in snapshot.items():
+            if data["type"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, {**data, "values": {}})
+            for labels, value in data["values"]:
+                key = tuple(labels)
+                if data["type"] == "histogram":
+                    current = target["values"].setdefault(key, [0] * len(value))
+                    for i, v in enumerate(value):
+                        current[i] += v
+                else:
+                    target["values"][key] = target["values"].get(key, 0) + value
+    return merged
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    items = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(merged: dict) -> str:
+    """Prometheus 文本格式"""
+    lines = []
+    for name, data in sorted(merged.items()):
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['type']}")
+        for key, value in sorted(data["values"].items()):
+            if data["type"] != "histogram":
+                lines.append(f"{name}{_labels(data['labels'], key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(data["buckets"]) + ["+Inf"], value[:-1]):
+                cumulative += count
+                le = 'le="%s"' % (bound if bound == "+Inf" else _number(bound))
+                lines.append(f"{name}_bucket{_labels(data['labels'], key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(data['labels'], key)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(data['labels'], key)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "请求处理耗时，流式响应包含传输时间", ("route", "method", "status")
+)
+REQUESTS_IN_PROGRESS = registry.gauge("http_requests_in_progress", "正在处理的请求，包括进行中的上传和下载", ("route",))
+BYTES_IN = registry.counter("http_request_bytes_total", "请求体字节数", ("route",))
+BYTES_OUT = registry.counter("http_response_bytes_total", "响应体字节数（按 Content-Length）", ("route",))
+UPLOAD_BYTES = registry.counter("upload_bytes_total", "上传写盘的字节数", ("kind",))
+UPLOAD_SECONDS = registry.histogram("upload_chunk_duration_seconds", "单次上传或单个分块的接收耗时", ("kind",))
+UPLOAD_SPEED = registry.histogram(
+    "upload_chunk_bytes_per_second",
+    "单次上传或单个分块的接收速率",
+    ("kind",),
+    buckets=tuple(2**i * 1024 * 1024 for i in range(-4, 11)),
+)
+CACHE_STATS = registry.gauge("cache_stats", "进程内缓存统计：条目数、命中、未命中、淘汰等", ("cache", "stat"))
+STORE_SECONDS = registry.histogram("metastore_query_duration_seconds", "元数据存储操作耗时", ("op", "table"))
+GC_FILES = registry.counter("gc_reclaimed_files_total", "后台维护删除的文件和记录数", ("reason",))
+GC_BYTES = registry.counter("gc_reclaimed_bytes_total", "后台维护释放的字节数", ("reason",))
+STORAGE_BYTES = registry.gauge("upload_dir_bytes", "最近一次维护时 UPLOAD_DIR 的占用和配额", ("kind",))
+DEDUP_FILES = registry.counter("dedup_files_total", "复用已有 blob 的上传数，precheck 为秒传，finalize 为上传后去重", ("kind",))
+DEDUP_BYTES = registry.counter("dedup_bytes_total", "去重节省的磁盘字节数", ("kind",))
+
+active = weakref.WeakSet()
+
+
+def route_name(request) -> str:
+    route = getattr(request, "route", None)
+    return route.name.rsplit(".", 1)[-1] if route else "unknown"
+
+
+def observe_upload(kind: str, nbytes: int, seconds: float):
+    UPLOAD_BYTES.inc(kind, value=nbytes)
+    UPLOAD_SECONDS.observe(seconds, kind)
+    UPLOAD_SPEED.observe(nbytes / max(seconds, 1e-6), kind)
+
+
+def _collect_active():
+    REQUESTS_IN_PROGRESS.values.clear()
+    for request in list(active):
+        REQUESTS_IN_PROGRESS.inc(route_name(request))
+
+
+registry.add_collector(_collect_active)
+
+
+async def request_started(request):
+    request.ctx.metrics_start = time.perf_counter()
+    active.add(request)
+
+
+async def request_finished(request, response):
+    # 客户端中途断开的请求不会走到这里，对象回收后自动从 active 中消失
+    if (start := getattr(request.ctx, "metrics_start", None)) is None:
+        return
+    active.discard(request)
+    route = route_name(request)
+    REQUEST_SECONDS.observe(time.perf_counter() - start, route, request.method, str(response.status))
+    BYTES_IN.inc(route, value=int(request.headers.get("content-length") or 0))
+    length = response.headers.get("content-length")
+    BYTES_OUT.inc(route, value=int(length) if length else len(getattr(response, "body", None) or b""))
+
+
+class InstrumentedStore:
+    """记录每次元数据操作耗时的代理"""
+
+    OPS = (
+        "get", "get_many", "list", "find", "search", "scan",
+        "insert", "insert_many", "update", "delete", "delete_many", "clear",
+    )
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getattr__(self, name):
+        attr = getattr(self.store, name)
+        if name not in self.OPS:
+            return attr
+
+        async def timed(table, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await attr(table, *args, **kwargs)
+            finally:
+                STORE_SECONDS.observe(time.perf_counter() - start, name, table)
+
+        setattr(self, name, timed)
+        return timed
+
+
+async def publish_loop(board: MetricsBoard, interval: float = 1.0):
+    while True:
+        board.publish(registry.dump())
+        await asyncio.sleep(interval)
+
+
+def setup_metrics(app, interval: float = 1.0):
+    """注册中间件、共享槽位和 /metrics 路由，sserver 和 dserver 共用"""
+    from sanic.response import text
+
+    app.register_middleware(request_started, "request")
+    # 响应中间件在流式响应开始时就执行了，结束时间要等处理函数返回后的 response 信号
+    app.signal("http.lifecycle.response")(request_finished)
+
+    @app.main_process_start
+    async def create_board(app, loop):
+        app.shared_ctx.metrics_board = MetricsBoard.create()
+
+    @app.listener("after_server_start")
+    async def start_publish(app, loop):
+        shared = getattr(app.shared_ctx, "metrics_board", None)
+        app.ctx.metrics_board = board = MetricsBoard(*shared) if shared else None
+        if board is not None:
+            if previous := board.claim(os.getpid()):
+                registry.restore(previous)
+            app.add_task(publish_loop(board, interval), name="metrics_publish")
+
+    @app.get("/metrics")
+    async def metrics(request):
+        board = request.app.ctx.metrics_board
+        if board is not None and board.publish(registry.dump()):
+            merged = merge(board.collect())
+        else:
+            merged = merge([(True, registry.dump())])
+        return text(render(merged), content_type="text/plain; version=0.0.4; charset=utf-8")
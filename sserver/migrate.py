@@ -0,0 +1,107 @@
+"""把平铺在 UPLOAD_DIR 顶层的记录文件在线迁移到分层布局
+
+    UPLOAD_SHARD_LEVELS=2 python -m sserver.migrate --upload-dir /data/upload
+
+先把服务的 UPLOAD_SHARD_LEVELS / UPLOAD_SHARD_WIDTH 改成目标布局并重启，再执行迁移，服务不用停：
+每个文件先硬链接到新位置再删除旧位置，服务按新位置、旧位置依次查找，任何时刻都能找到。
+只移动有记录的文件（按 id 分批查询），还没登记的文件留在顶层由对账处理。
+迁移没有额外状态，中断后重新执行即从剩下的平铺文件继续；同一时间只允许一个迁移进程。
+"""
+import argparse
+import asyncio
+import errno
+import os
+import sys
+import time
+from typing import Dict, Iterator, List
+
+from sserver.layout import prepare, setup_layout, shard_path
+from sserver.model import FileRecord, get_db
+from sserver.reconcile import ignored
+from sserver.utils import try_lock
+
+
+def flat_names(upload_dir: str, batch: int) -> Iterator[List[str]]:
+    names = []
+    with os.scandir(upload_dir) as it:
+        for entry in it:
+            if not ignored(entry.name) and entry.is_file(follow_symlinks=False):
+                names.append(entry.name)
+                if len(names) >= batch:
+                    yield names
+                    names = []
+    if names:
+        yield names
+
+
+def move(upload_dir: str, id_: str) -> str:
+    """迁移一个文件，返回 moved / conflict / gone"""
+    src, dst = os.path.join(upload_dir, id_), prepare(shard_path(upload_dir, id_))
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        return "gone"
+    except FileExistsError:
+        # 上次迁移在建链接之后中断
+        if not os.path.samefile(src, dst):
+            return "conflict"
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.ENOTSUP):
+            raise
+        # 不支持硬链接时只能直接改名，极短的窗口内查找可能落空
+        os.rename(src, dst)
+        return "moved"
+    os.remove(src)
+    return "moved"
+
+
+async def migrate(upload_dir: str, batch: int = 1000, pause: float = 0.05, dry_run: bool = False) -> Dict[str, int]:
+    stats = {"passes": 0, "scanned": 0, "moved": 0, "unknown": 0, "conflict": 0, "gone": 0}
+    start = time.perf_counter()
+    # 边遍历边删除时 readdir 可能漏掉条目，重复扫描直到一轮没有可移动的文件
+    while True:
+        moved = stats["moved"]
+        stats["passes"] += 1
+        # 留在原处的文件每一轮都会再扫到，只算最后一轮的
+        stats["unknown"] = stats["conflict"] = 0
+        for names in flat_names(upload_dir, batch):
+            known = {it.id for it in await FileRecord.get_many(names)}
+            stats["scanned"] += len(names)
+            stats["unknown"] += len(names) - len(known)
+            for name in names:
+                if name in known:
+                    stats["moved" if dry_run else move(upload_dir, name)] += 1
+            print(f"{time.perf_counter() - start:8.1f}s " + " ".join(f"{k}={v}" for k, v in stats.items()), flush=True)
+            # 给在线服务让出磁盘
+            await asyncio.sleep(pause)
+        if dry_run or stats["moved"] == moved:
+            return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="move flat UPLOAD_DIR files into the sharded layout")
+    parser.add_argument("--upload-dir", default=os.environ.get("UPLOAD_DIR", os.path.join(os.getcwd(), "upload")))
+    parser.add_argument("--levels", type=int, default=int(os.environ.get("UPLOAD_SHARD_LEVELS", 2)))
+    parser.add_argument("--width", type=int, default=int(os.environ.get("UPLOAD_SHARD_WIDTH", 2)))
+    parser.add_argument("--batch", type=int, default=1000, help="files per metadata query")
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="only count files to move")
+    args = parser.parse_args()
+
+    if args.levels <= 0:
+        sys.exit("--levels must be greater than 0")
+    setup_layout(args.levels, args.width)
+    if (fd := try_lock(os.path.join(args.upload_dir, ".migrate.lock"))) is None:
+        sys.exit("another migration is running")
+    db = await get_db()
+    try:
+        stats = await migrate(args.upload_dir, args.batch, args.pause, args.dry_run)
+    finally:
+        await db.close()
+        os.close(fd)
+    if stats["conflict"]:
+        print(f"{stats['conflict']} files left in place: a different file already exists at the target path")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
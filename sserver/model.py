@@ -1,94 +1,188 @@
 import ulid
 from datetime import datetime
-from dataclasses import dataclass, field
-import os
+from dataclasses import dataclass, field, replace
+from typing import Optional
 
-from motor.motor_asyncio import AsyncIOMotorClient
+from sserver.cache import MISSING, InvalidationLog, RecordCache
+from sserver.events import publish
+from sserver.layout import locate
+from sserver.metrics import InstrumentedStore
+from sserver.store import MetaStore, create_store
+from sserver.utils import run_sync
 
+CURSOR_TIME_FORMAT = "%Y%m%d%H%M%S%f"
 
-@dataclass
-class FileRecord:
-    filename: str
-    id: str = field(default_factory=lambda: str(ulid.new()))
-    protected: bool = False
-    created_at: datetime = field(default_factory=datetime.now)
 
-    @classmethod
-    def get_col(cls):
-        return db["files"]
+class Record:
+    """FileRecord / MsgRecord 共用的读写方法，实际存储由 store 决定"""
+
+    table = ""
+    # 建全文索引、供 search 查询的字段
+    text_field = ""
+    # 推送事件的类型前缀，file.created / msg.deleted
+    kind = ""
 
     @classmethod
     async def get(cls, id_: str):
-        ret = await cls.get_col().find_one({"id": id_}, {"_id": 0})
+        ret = await db.get(cls.table, id_)
         if ret:
             return cls(**ret)
         return None
 
     @classmethod
-    async def get_list(cls, page: int = 1, size: int = 100):
-        ret = cls.get_col().find({}, {"_id": 0}).sort({"created_at": -1}).skip((page - 1) * size).limit(size)
-        return [cls(**r) async for r in ret]
+    async def get_list(cls, page: int = 1, size: int = 100, cursor: Optional[str] = None):
+        """游标分页：有 cursor 时按索引定位到上一页末尾继续取，深翻页不再 skip 扫描"""
+        ret = await db.list(cls.table, page, size, parse_cursor(cursor) if cursor else None)
+        return [cls(**r) for r in ret]
 
     @classmethod
-    async def get_by_filename(cls, filename: str, page: int = 1, size: int = 100):
-        ret = (
-            cls.get_col()
-            .find({"filename": filename}, {"_id": 0})
-            .sort({"created_at": -1})
-            .skip((page - 1) * size)
-            .limit(size)
-        )
-        return [cls(**r) async for r in ret]
+    async def search(cls, query: str, mode: str = "substring", page: int = 1, size: int = 100):
+        return [cls(**r) for r in await db.search(cls.table, query, mode, page, size)]
+
+    @property
+    def cursor(self):
+        return make_cursor(self)
 
     async def save(self):
-        await self.get_col().insert_one(self.__dict__)
-        self.__dict__.pop("_id", None)
+        await db.insert(self.table, self.__dict__)
+        publish(f"{self.kind}.created", self.json())
 
     async def delete(self):
-        await self.get_col().delete_one({"id": self.id})
+        await db.delete(self.table, self.id)
+        publish(f"{self.kind}.deleted", {"id": self.id})
+
+    @classmethod
+    async def delete_many(cls, records):
+        await db.delete_many(cls.table, [it.id for it in records])
+        for it in records:
+            publish(f"{cls.kind}.deleted", {"id": it.id})
+
+    async def update(self, **fields):
+        self.__dict__.update(fields)
+        await db.update(self.table, self.id, fields)
 
     def json(self):
-        data = self.__dict__
-        data["created_at"] = data["created_at"].strftime("%Y-%m-%d %H:%M:%S")
-        return data
+        return {k: v.strftime("%Y-%m-%d %H:%M:%S") if isinstance(v, datetime) else v for k, v in self.__dict__.items()}
 
 
 @dataclass
-class MsgRecord:
-    content: str
+class FileRecord(Record):
+    """文件记录，get 走进程内缓存，save/delete/update 时广播失效"""
+
+    filename: str
     id: str = field(default_factory=lambda: str(ulid.new()))
     protected: bool = False
     created_at: datetime = field(default_factory=datetime.now)
+    size: int = -1
+    hash: str = ""
+    # 到期后不再提供下载，由后台维护任务删除
+    expires_at: Optional[datetime] = None
+    # 集群模式下文件所在的节点，保存时默认为本节点
+    node: Optional[str] = ""
 
-    @classmethod
-    def get_col(cls):
-        return db["msg"]
+    table = "files"
+    text_field = "filename"
+    kind = "file"
 
     @classmethod
     async def get(cls, id_: str):
-        ret = await cls.get_col().find_one({"id": id_}, {"_id": 0})
-        if ret:
-            return cls(**ret)
-        return None
-
-    @classmethod
-    async def get_list(cls, page: int = 1, size: int = 30):
-        ret = cls.get_col().find({}, {"_id": 0}).sort({"created_at": -1}).skip((page - 1) * size).limit(size)
-        return [cls(**r) async for r in ret]
+        if record_cache is None:
+            return await super().get(id_)
+        if (cached := record_cache.lookup(id_)) is not MISSING:
+            return replace(cached) if cached else None
+        version = record_cache.version
+        record = await super().get(id_)
+        record_cache.store(id_, replace(record) if record else None, version)
+        return record
 
     async def save(self):
-        await self.get_col().insert_one(self.__dict__)
+        self.node = self.node or local_node
+        await super().save()
+        invalidate(self.id)
 
     async def delete(self):
-        await self.get_col().delete_one({"id": self.id})
+        await super().delete()
+        invalidate(self.id)
 
-    def json(self):
-        data = self.__dict__
-        data["created_at"] = data["created_at"].strftime("%Y-%m-%d %H:%M:%S")
-        return data
+    @classmethod
+    async def delete_many(cls, records):
+        await super().delete_many(records)
+        for it in records:
+            invalidate(it.id)
+
+    async def update(self, **fields):
+        await super().update(**fields)
+        invalidate(self.id)
+
+    @classmethod
+    async def get_many(cls, ids, field: str = "id"):
+        return [cls(**r) for r in await db.get_many(cls.table, ids, field)]
+
+    @classmethod
+    async def save_many(cls, records):
+        for it in records:
+            it.node = it.node or local_node
+        await db.insert_many(cls.table, [it.__dict__ for it in records])
+        for it in records:
+            invalidate(it.id)
+            publish(f"{cls.kind}.created", it.json())
+
+    @classmethod
+    async def scan(cls, after: Optional[str] = None, size: int = 1000):
+        return [cls(**r) for r in await db.scan(cls.table, after, size)]
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= datetime.now()
+
+    @classmethod
+    async def get_by_filename(cls, filename: str, page: int = 1, size: int = 100):
+        return [cls(**r) for r in await db.find(cls.table, {"filename": filename}, page, size)]
+
+    @classmethod
+    async def backfill_size(cls, upload_dir: str):
+        """给旧记录补上文件大小，之后列表页只读元数据"""
+        while missing := await db.find(cls.table, {"size": None}, size=1000):
+            for r in missing:
+                try:
+                    size = (await run_sync(locate, upload_dir, r["id"]))[1].st_size
+                except FileNotFoundError:
+                    size = -1
+                await db.update(cls.table, r["id"], {"size": size, "hash": r.get("hash") or ""})
+                invalidate(r["id"])
+
+
+@dataclass
+class MsgRecord(Record):
+    content: str
+    id: str = field(default_factory=lambda: str(ulid.new()))
+    protected: bool = False
+    created_at: datetime = field(default_factory=datetime.now)
+
+    table = "msg"
+    text_field = "content"
+    kind = "msg"
+
+    @classmethod
+    async def get_list(cls, page: int = 1, size: int = 30, cursor: Optional[str] = None):
+        return await super().get_list(page, size, cursor)
 
 
-db = None
+db: Optional[MetaStore] = None
+# 集群模式下本节点的名字，单机时为空
+local_node = ""
+record_cache: Optional[RecordCache] = None
+
+
+def setup_record_cache(max_items: int, ttl: float, negative_ttl: float, log: Optional[InvalidationLog] = None):
+    global record_cache
+    record_cache = RecordCache(max_items, ttl, negative_ttl, log) if max_items > 0 else None
+    return record_cache
+
+
+def invalidate(id_: str):
+    if record_cache is not None:
+        record_cache.invalidate(id_)
 
 
 async def get_db():
@@ -96,12 +190,19 @@ async def get_db():
     if db:
         return db
 
-    client = AsyncIOMotorClient(os.environ.get("MONGOURI", "mongodb://localhost:27017/"))
-    db = client["sserver"]
-    await create_indexes(db)
+    store = create_store()
+    for cls in (FileRecord, MsgRecord):
+        store.register(cls.table, cls)
+    await store.connect()
+    db = InstrumentedStore(store)
     return db
 
 
-async def create_indexes(db):
-    db["files"].create_index([("id", 1)])
-    db["msg"].create_index([("id", 1)])
+def make_cursor(record) -> str:
+    """下一页的游标：最后一条记录的 created_at 和 id"""
+    return f"{record.created_at.strftime(CURSOR_TIME_FORMAT)}.{record.id}"
+
+
+def parse_cursor(cursor: str):
+    created_at, _, id_ = cursor.partition(".")
+    return datetime.strptime(created_at, CURSOR_TIME_FORMAT), id_
@@ -0,0 +1,216 @@
+"""UPLOAD_DIR 与元数据的对账
+
+把直接放进 UPLOAD_DIR 顶层、还没有记录的文件登记为 FileRecord 并按目录布局改名为新 id。
+扫描在线程里用 os.scandir 完成，已知 id / 文件名按批用 $in 查询，新记录批量插入。
+可选的后台监听模式只处理新放入的文件，Linux 上用 inotify，其他平台按目录 mtime 轮询。
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import re
+import stat
+import struct
+from typing import Iterable, List, Optional, Tuple
+
+from sanic.log import logger
+
+from sserver.layout import prepare, shard_path
+from sserver.model import FileRecord
+from sserver.utils import run_sync, try_lock
+
+BATCH_SIZE = 1000
+
+# 旧版分块上传的临时文件 {uuid4}-{i}
+_chunk_name = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}-\d+$")
+_ulid_name = re.compile(r"^[0-9A-HJKMNP-TV-Z]{26}$")
+
+
+def legacy_chunk(name: str) -> bool:
+    return bool(_chunk_name.match(name))
+
+
+def ignored(name: str) -> bool:
+    return name.startswith(".") or legacy_chunk(name)
+
+
+def scan(upload_dir: str, names: Optional[Iterable[str]] = None) -> List[Tuple[str, int]]:
+    """返回 (文件名, 大小)，names 为空时扫描整个目录"""
+    entries = []
+    if names is None:
+        with os.scandir(upload_dir) as it:
+            for entry in it:
+                if not ignored(entry.name) and entry.is_file(follow_symlinks=False):
+                    entries.append((entry.name, entry.stat(follow_symlinks=False).st_size))
+        return entries
+    for name in names:
+        try:
+            st = os.lstat(os.path.join(upload_dir, name))
+        except FileNotFoundError:
+            continue
+        if not ignored(name) and stat.S_ISREG(st.st_mode):
+            entries.append((name, st.st_size))
+    return entries
+
+
+def rename_all(upload_dir: str, records: List[FileRecord]) -> List[FileRecord]:
+    renamed = []
+    for record in records:
+        try:
+            os.rename(os.path.join(upload_dir, record.filename), prepare(shard_path(upload_dir, record.id)))
+        except FileNotFoundError:
+            continue
+        renamed.append(record)
+    return renamed
+
+
+def rename_back(upload_dir: str, records: List[FileRecord]):
+    for record in records:
+        os.rename(shard_path(upload_dir, record.id), os.path.join(upload_dir, record.filename))
+
+
+async def reconcile(upload_dir: str, names: Optional[Iterable[str]] = None, batch: int = BATCH_SIZE):
+    """登记 upload_dir 中没有记录的文件，返回新建的 FileRecord 列表"""
+    entries = await run_sync(scan, upload_dir, list(names) if names is not None else None)
+    created = []
+    for i in range(0, len(entries), batch):
+        chunk = entries[i : i + batch]
+        names = [name for name, _ in chunk]
+        known = {it.id for it in await FileRecord.get_many(names)}
+        rest = [name for name in names if name not in known]
+        if rest:
+            known.update(it.filename for it in await FileRecord.get_many(rest, "filename"))
+        records = [FileRecord(name, size=size) for name, size in chunk if name not in known]
+        if not records:
+            continue
+
+        records = await run_sync(rename_all, upload_dir, records)
+        try:
+            await FileRecord.save_many(records)
+        except Exception:
+            await run_sync(rename_back, upload_dir, records)
+            raise
+        created += records
+    return created
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_event = struct.Struct("iIII")
+
+
+class Inotify:
+    """最小化的 inotify 封装，只监听单个目录"""
+
+    def __init__(self, path: str, mask: int = IN_CLOSE_WRITE | IN_MOVED_TO):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, path.encode(), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+
+    def read(self) -> Tuple[List[str], bool]:
+        """读出当前所有事件，返回 (文件名列表, 是否溢出)"""
+        names, overflow = [], False
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return names, overflow
+            pos = 0
+            while pos < len(buf):
+                _, mask, _, length = _event.unpack_from(buf, pos)
+                pos += _event.size
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif length:
+                    names.append(buf[pos : pos + length].rstrip(b"\x00").decode(errors="surrogateescape"))
+                pos += length
+
+    def close(self):
+        os.close(self.fd)
+
+
+class UploadDirWatcher:
+    """后台登记新放入 UPLOAD_DIR 的文件
+
+    多个 worker 通过文件锁选出一个执行。事件攒 settle 秒后批量对账，避免文件还在写入。
+    服务自己产生的文件（ulid 命名、旧版分块）不处理。
+    """
+
+    def __init__(self, upload_dir: str, settle: float = 2.0, poll_interval: float = 30.0):
+        self.upload_dir = upload_dir
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.pending = set()
+        self.rescan = False
+        self.lock_fd = None
+
+    def acquire(self) -> bool:
+        self.lock_fd = try_lock(os.path.join(self.upload_dir, ".watcher.lock"))
+        return self.lock_fd is not None
+
+    def release(self):
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    async def run(self):
+        if not self.acquire():
+            return
+        try:
+            try:
+                inotify = Inotify(self.upload_dir)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify unavailable ({e!r}), polling {self.upload_dir}")
+                await self.poll()
+            else:
+                await self.watch(inotify)
+        finally:
+            self.release()
+
+    async def watch(self, inotify: Inotify):
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        loop.add_reader(inotify.fd, ready.set)
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                names, overflow = inotify.read()
+                self.rescan |= overflow
+                self.pending.update(it for it in names if not _ulid_name.match(it))
+                # 等写入稳定后再处理
+                await asyncio.sleep(self.settle)
+                await self.flush()
+        finally:
+            loop.remove_reader(inotify.fd)
+            inotify.close()
+
+    async def poll(self):
+        mtime = None
+        while True:
+            st = await run_sync(os.stat, self.upload_dir)
+            if st.st_mtime_ns != mtime:
+                mtime, self.rescan = st.st_mtime_ns, True
+                await asyncio.sleep(self.settle)
+                await self.flush()
+            await asyncio.sleep(self.poll_interval)
+
+    async def flush(self):
+        names, self.pending = self.pending, set()
+        rescan, self.rescan = self.rescan, False
+        if not names and not rescan:
+            return
+        try:
+            created = await reconcile(self.upload_dir, None if rescan else names)
+        except Exception as e:
+            logger.exception(f"reconcile {self.upload_dir} failed: {e!r}")
+            return
+        if created:
+            logger.info(f"registered {len(created)} files in {self.upload_dir}")
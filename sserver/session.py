@@ -0,0 +1,240 @@
+import errno
+import json
+import math
+import os
+import re
+import time
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+import ulid
+
+from sserver.layout import prepare, shard_path
+from sserver.stream import WRITE_BUFFER_SIZE
+from sserver.utils import run_sync
+
+SESSION_DIR = ".sessions"
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+MAX_CHUNK_SIZE = 256 * 1024 * 1024
+
+# 集群模式下带上创建节点的后缀 {ulid}.{node}
+_session_id = re.compile(r"^[0-9A-Za-z]{26}(\.[0-9A-Za-z_-]{1,64})?$")
+
+
+class SessionError(ValueError):
+    pass
+
+
+class SessionGone(SessionError):
+    """会话已经完成或被取消，文件已不存在"""
+
+
+class InsufficientStorage(SessionError):
+    pass
+
+
+def preallocate(fd: int, size: int):
+    if size <= 0:
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except AttributeError:
+        os.ftruncate(fd, size)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise InsufficientStorage(f"not enough disk space for {size} bytes")
+        if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+            raise
+        # 文件系统不支持 fallocate 时退化为稀疏文件
+        os.ftruncate(fd, size)
+
+
+def read_json(path: str):
+    with open(path) as f:
+        return json.load(f)
+
+
+@dataclass
+class UploadSession:
+    """分块上传会话
+
+    目标文件在 UPLOAD_DIR/.sessions 下预分配，每个分块按偏移直接写入，
+    已完成的分块记录在位图文件中（一个分块一个字节），多个 worker 之间共享，
+    因此分块可以并发、乱序、断点续传，完成时只需要 rename 到 UPLOAD_DIR 中按布局对应的位置。
+    """
+
+    upload_dir: str
+    filename: str
+    size: int
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    id: str = field(default_factory=lambda: str(ulid.new()))
+    created_at: float = field(default_factory=time.time)
+    # 完成后文件的存活秒数，None 表示使用服务端默认值
+    ttl: Optional[float] = None
+
+    @property
+    def chunks(self) -> int:
+        return math.ceil(self.size / self.chunk_size)
+
+    @property
+    def file_id(self) -> str:
+        """完成后文件记录的 id，不带节点后缀"""
+        return self.id.partition(".")[0]
+
+    @property
+    def session_dir(self):
+        return os.path.join(self.upload_dir, SESSION_DIR)
+
+    @property
+    def part_path(self):
+        return os.path.join(self.session_dir, f"{self.id}.part")
+
+    @property
+    def bitmap_path(self):
+        return os.path.join(self.session_dir, f"{self.id}.chunks")
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.session_dir, f"{self.id}.json")
+
+    @classmethod
+    async def create(
+        cls,
+        upload_dir: str,
+        filename: str,
+        size: int,
+        chunk_size: Optional[int] = None,
+        ttl: Optional[float] = None,
+        node: str = "",
+        max_size: float = float("inf"),
+    ):
+        if not filename or size < 0:
+            raise SessionError("filename and size are required")
+        if size > max_size:
+            raise SessionError(f"size exceeds the limit of {int(max_size)} bytes")
+        chunk_size = int(chunk_size or DEFAULT_CHUNK_SIZE)
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise SessionError(f"chunk_size must be in (0, {MAX_CHUNK_SIZE}]")
+        if ttl is not None and float(ttl) < 0:
+            raise SessionError(f"invalid ttl: {ttl}")
+        session = cls(upload_dir, filename, size, chunk_size, ttl=float(ttl) if ttl is not None else None)
+        if node:
+            session.id = f"{session.id}.{node}"
+        await run_sync(session._create)
+        return session
+
+    def _create(self):
+        os.makedirs(self.session_dir, exist_ok=True)
+        fd = os.open(self.part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            preallocate(fd, self.size)
+        except BaseException:
+            os.close(fd)
+            os.remove(self.part_path)
+            raise
+        os.close(fd)
+        with open(self.bitmap_path, "wb") as f:
+            f.write(b"\x00" * self.chunks)
+        # 元数据最后写，存在即代表会话可用
+        data = asdict(self)
+        data.pop("upload_dir")
+        with open(self.meta_path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    @classmethod
+    async def load(cls, upload_dir: str, id_: str):
+        if not _session_id.match(id_ or ""):
+            return None
+        try:
+            data = await run_sync(read_json, os.path.join(upload_dir, SESSION_DIR, f"{id_}.json"))
+        except FileNotFoundError:
+            return None
+        return cls(upload_dir, **data)
+
+    def chunk_range(self, index: int):
+        if not 0 <= index < self.chunks:
+            raise SessionError(f"chunk index out of range: {index}")
+        offset = index * self.chunk_size
+        return offset, min(self.chunk_size, self.size - offset)
+
+    async def write_chunk(self, index: int, stream) -> int:
+        """把请求体按偏移写入目标文件，成功后在位图中标记该分块"""
+        offset, length = self.chunk_range(index)
+        try:
+            fd = await run_sync(os.open, self.part_path, os.O_WRONLY)
+        except FileNotFoundError:
+            raise SessionGone("session not found")
+        written, buffer = 0, bytearray()
+        try:
+            async for data in stream:
+                if written + len(buffer) + len(data) > length:
+                    raise SessionError(f"chunk {index} larger than {length} bytes")
+                buffer += data
+                if len(buffer) >= WRITE_BUFFER_SIZE:
+                    await run_sync(os.pwrite, fd, bytes(buffer), offset + written)
+                    written += len(buffer)
+                    buffer.clear()
+            if buffer:
+                await run_sync(os.pwrite, fd, bytes(buffer), offset + written)
+                written += len(buffer)
+        finally:
+            await run_sync(os.close, fd)
+        if written != length:
+            raise SessionError(f"chunk {index} expects {length} bytes, got {written}")
+        await run_sync(self._mark, index)
+        return written
+
+    def _mark(self, index: int):
+        fd = os.open(self.bitmap_path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, b"\x01", index)
+        finally:
+            os.close(fd)
+
+    async def missing(self) -> List[int]:
+        try:
+            bitmap = await run_sync(self._read_bitmap)
+        except FileNotFoundError:
+            raise SessionGone("session not found")
+        return [i for i in range(self.chunks) if i >= len(bitmap) or not bitmap[i]]
+
+    def _read_bitmap(self) -> bytes:
+        with open(self.bitmap_path, "rb") as f:
+            return f.read()
+
+    async def finalize(self) -> str:
+        """所有分块到齐后把预分配文件原地改名为最终文件，不做任何拷贝
+
+        并发的 finalize 中只有第一个 rename 成功，其余的得到 SessionGone。
+        """
+        if missing := await self.missing():
+            raise SessionError(f"{len(missing)} chunks missing")
+        dst = await run_sync(prepare, shard_path(self.upload_dir, self.file_id))
+        try:
+            await run_sync(os.rename, self.part_path, dst)
+        except FileNotFoundError:
+            raise SessionGone("session already finalized")
+        await self.abort()
+        return dst
+
+    async def abort(self):
+        await run_sync(self._cleanup)
+
+    def _cleanup(self):
+        for path in (self.meta_path, self.bitmap_path, self.part_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def json(self, missing: Optional[List[int]] = None):
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "chunks": self.chunks,
+            "ttl": self.ttl,
+            "missing": missing,
+        }
@@ -0,0 +1,473 @@
+"""元数据存储后端
+
+FileRecord / MsgRecord 只通过这里的接口读写，后端由环境变量 META_STORE 选择：
+
+- mongo（默认）：MONGOURI 指定的 MongoDB
+- sqlite：SQLITE_PATH 指定的本地 SQLite 文件（WAL 模式），单机部署不需要额外服务
+
+记录类的 text_field 字段建全文索引，search 支持三种匹配：prefix 前缀、substring 子串、
+token 按词前缀（每个查询词都要匹配某个词的开头），都不区分大小写。
+"""
+import dataclasses
+import os
+import re
+import typing
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+
+# 列表按 (created_at, id) 倒序，别名记录的 id 不是 ulid，单用 id 无法保证时间顺序
+LIST_SORT = [("created_at", -1), ("id", -1)]
+SEARCH_MODES = ("prefix", "substring", "token")
+
+
+def query_tokens(query: str) -> List[str]:
+    """查询拆成词，下划线、标点和空白都是分隔符"""
+    return re.findall(r"[^\W_]+", query.lower())
+
+
+def trigrams(text: str) -> set:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class MetaStore:
+    """元数据存储接口，所有文档都是 dict，键为记录类的字段名"""
+
+    def __init__(self):
+        self.tables: Dict[str, Type] = {}
+        # 建全文索引的字段，取自记录类的 text_field
+        self.text_fields: Dict[str, str] = {}
+
+    def register(self, table: str, cls: Type):
+        self.tables[table] = cls
+        if field := getattr(cls, "text_field", ""):
+            self.text_fields[table] = field
+
+    async def connect(self):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def get(self, table: str, id_: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def get_many(self, table: str, values: Sequence[Any], field: str = "id") -> List[dict]:
+        """批量按字段取值查询（$in）"""
+        raise NotImplementedError
+
+    async def list(
+        self, table: str, page: int = 1, size: int = 100, cursor: Optional[Tuple[datetime, str]] = None
+    ) -> List[dict]:
+        raise NotImplementedError
+
+    async def find(self, table: str, filters: Dict[str, Any], page: int = 1, size: int = 100) -> List[dict]:
+        """按字段相等条件查询，值为 None 时匹配缺失或空值"""
+        raise NotImplementedError
+
+    async def scan(self, table: str, after: Optional[str] = None, size: int = 1000) -> List[dict]:
+        """按 id 升序遍历全表，after 为上一批最后一条的 id"""
+        raise NotImplementedError
+
+    async def search(
+        self, table: str, query: str, mode: str = "substring", page: int = 1, size: int = 100
+    ) -> List[dict]:
+        """在 text_field 上按 mode 匹配 query"""
+        raise NotImplementedError
+
+    async def insert(self, table: str, doc: dict):
+        raise NotImplementedError
+
+    async def insert_many(self, table: str, docs: Sequence[dict]):
+        raise NotImplementedError
+
+    async def update(self, table: str, id_: str, fields: dict):
+        raise NotImplementedError
+
+    async def delete(self, table: str, id_: str):
+        raise NotImplementedError
+
+    async def delete_many(self, table: str, ids: Sequence[str]):
+        """批量按 id 删除（$in）"""
+        raise NotImplementedError
+
+    async def clear(self, table: str):
+        raise NotImplementedError
+
+
+# MongoDB 文档里为搜索派生的字段：小写全文、词列表和 trigram 列表，读出时去掉
+SEARCH_KEYS = ("_text", "_words", "_grams")
+PROJECTION = {"_id": 0, **{it: 0 for it in SEARCH_KEYS}}
+
+
+def search_keys(value: Optional[str]) -> dict:
+    text = (value or "").lower()
+    return {"_text": text, "_words": sorted(set(query_tokens(text))), "_grams": sorted(trigrams(text))}
+
+
+class MongoStore(MetaStore):
+    """MongoDB 后端
+
+    text_field 的小写副本、词列表和 trigram 列表随文档一起写入并建索引，搜索都是锚定开头、区分大小写的正则，
+    可以按索引范围扫描：prefix 查小写副本，token 查词列表，substring 先用 trigram 列表缩小范围再匹配。
+    """
+
+    def __init__(self, uri: str, database: str = "sserver"):
+        super().__init__()
+        self.uri = uri
+        self.database = database
+        self.client = None
+        self.db = None
+
+    async def connect(self):
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        self.client = AsyncIOMotorClient(self.uri)
+        self.db = self.client[self.database]
+        await self.create_indexes()
+
+    async def close(self):
+        if self.client:
+            self.client.close()
+
+    async def create_indexes(self):
+        for name in self.tables:
+            col = self.db[name]
+            # 旧版本建过同名的非唯一索引，需要先删掉才能建唯一索引
+            info = await col.index_information()
+            if "id_1" in info and not info["id_1"].get("unique"):
+                await col.drop_index("id_1")
+            await col.create_index([("id", 1)], unique=True)
+            await col.create_index(LIST_SORT)
+        if "files" in self.tables:
+            await self.db["files"].create_index([("filename", 1), ("created_at", -1)])
+        for name, field in self.text_fields.items():
+            col = self.db[name]
+            # 早先版本的 token 搜索用过文本索引
+            if f"{field}_text" in await col.index_information():
+                await col.drop_index(f"{field}_text")
+            for key in SEARCH_KEYS:
+                await col.create_index([(key, 1)])
+            await self.backfill_search(name, field)
+
+    async def backfill_search(self, table: str, field: str):
+        """给建索引之前的文档补上搜索字段"""
+        from pymongo import UpdateOne
+
+        col, ops = self.db[table], []
+        async for doc in col.find({"_text": {"$exists": False}}, {"_id": 1, field: 1}):
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": search_keys(doc.get(field))}))
+            if len(ops) >= 1000:
+                await col.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            await col.bulk_write(ops, ordered=False)
+
+    def with_search_keys(self, table: str, doc: dict) -> dict:
+        field = self.text_fields.get(table)
+        return {**doc, **search_keys(doc.get(field))} if field and field in doc else dict(doc)
+
+    async def get(self, table, id_):
+        return await self.db[table].find_one({"id": id_}, PROJECTION)
+
+    async def get_many(self, table, values, field="id"):
+        return [r async for r in self.db[table].find({field: {"$in": list(values)}}, PROJECTION)]
+
+    async def list(self, table, page=1, size=100, cursor=None):
+        if cursor:
+            created_at, id_ = cursor
+            query = {"$or": [{"created_at": {"$lt": created_at}}, {"created_at": created_at, "id": {"$lt": id_}}]}
+            ret = self.db[table].find(query, PROJECTION).sort(LIST_SORT).limit(size)
+        else:
+            ret = self.db[table].find({}, PROJECTION).sort(LIST_SORT).skip((page - 1) * size).limit(size)
+        return [r async for r in ret]
+
+    async def find(self, table, filters, page=1, size=100):
+        ret = self.db[table].find(filters, PROJECTION).sort(LIST_SORT).skip((page - 1) * size).limit(size)
+        return [r async for r in ret]
+
+    async def search(self, table, query, mode="substring", page=1, size=100):
+        query = query.lower()
+        if mode == "token":
+            if not (tokens := query_tokens(query)):
+                return []
+            # 每个词都要是某个词的前缀，多键索引上的锚定正则
+            filters = {"$and": [{"_words": {"$regex": f"^{re.escape(it)}"}} for it in tokens]}
+        elif mode == "prefix":
+            filters = {"_text": {"$regex": f"^{re.escape(query)}"}}
+        else:
+            filters = {"_text": {"$regex": re.escape(query)}}
+            # 不足三个字符时没有 trigram 可用，和 SQLite 一样退化为扫描
+            if grams := trigrams(query):
+                filters["_grams"] = {"$all": sorted(grams)}
+        return await self.find(table, filters, page, size)
+
+    async def scan(self, table, after=None, size=1000):
+        query = {"id": {"$gt": after}} if after else {}
+        return [r async for r in self.db[table].find(query, PROJECTION).sort("id", 1).limit(size)]
+
+    async def insert(self, table, doc):
+        await self.db[table].insert_one(self.with_search_keys(table, doc))
+
+    async def insert_many(self, table, docs):
+        if docs:
+            await self.db[table].insert_many([self.with_search_keys(table, it) for it in docs])
+
+    async def update(self, table, id_, fields):
+        await self.db[table].update_one({"id": id_}, {"$set": self.with_search_keys(table, fields)})
+
+    async def delete(self, table, id_):
+        await self.db[table].delete_one({"id": id_})
+
+    async def delete_many(self, table, ids):
+        if ids:
+            await self.db[table].delete_many({"id": {"$in": list(ids)}})
+
+    async def clear(self, table):
+        await self.db[table].delete_many({})
+
+
+class SQLiteStore(MetaStore):
+    """SQLite 后端，WAL 模式，表结构由记录类的 dataclass 字段生成
+
+    SQL 语句按表预先拼好，sqlite3 会缓存编译后的语句，执行时只绑定参数。
+    """
+
+    COLUMN_TYPES = {str: "TEXT", int: "INTEGER", bool: "INTEGER", datetime: "TEXT", float: "REAL"}
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.conn = None
+        self.columns: Dict[str, Dict[str, type]] = {}
+        self.sql: Dict[Tuple[str, str], str] = {}
+
+    async def connect(self):
+        import aiosqlite
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = await aiosqlite.connect(self.path, cached_statements=256)
+        await self.conn.execute("PRAGMA journal_mode=WAL")
+        await self.conn.execute("PRAGMA synchronous=NORMAL")
+        # 多个 worker 进程共享同一个库，写锁冲突时等待而不是直接报错
+        await self.conn.execute("PRAGMA busy_timeout=5000")
+        for table, cls in self.tables.items():
+            await self.create_table(table, cls)
+        await self.conn.commit()
+
+    async def close(self):
+        if self.conn:
+            await self.conn.close()
+
+    @staticmethod
+    def column_type(t) -> type:
+        # Optional[X] 按 X 存储
+        if typing.get_origin(t) is typing.Union:
+            t = next((it for it in typing.get_args(t) if it is not type(None)), str)
+        return t if isinstance(t, type) else str
+
+    async def create_table(self, table: str, cls: Type):
+        columns = {f.name: self.column_type(f.type) for f in dataclasses.fields(cls)}
+        self.columns[table] = columns
+        defs = ", ".join(
+            f"{name} {self.COLUMN_TYPES.get(t, 'TEXT')}{' PRIMARY KEY' if name == 'id' else ''}"
+            for name, t in columns.items()
+        )
+        await self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({defs})")
+        # 记录类新增字段时自动补列
+        existing = {row[1] async for row in await self.conn.execute(f"PRAGMA table_info({table})")}
+        for name, t in columns.items():
+            if name not in existing:
+                await self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {self.COLUMN_TYPES.get(t, 'TEXT')}")
+        await self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_created_at ON {table} (created_at DESC, id DESC)")
+        if "filename" in columns:
+            await self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_filename ON {table} (filename, created_at)")
+        if field := self.text_fields.get(table):
+            await self.create_fts(table, field)
+
+        names = ", ".join(columns)
+        order = "ORDER BY created_at DESC, id DESC"
+        self.sql[(table, "get")] = f"SELECT {names} FROM {table} WHERE id = ?"
+        self.sql[(table, "list")] = f"SELECT {names} FROM {table} {order} LIMIT ? OFFSET ?"
+        self.sql[(table, "cursor")] = f"SELECT {names} FROM {table} WHERE (created_at, id) < (?, ?) {order} LIMIT ?"
+        self.sql[(table, "insert")] = (
+            f"INSERT INTO {table} ({names}) VALUES ({', '.join(':' + it for it in columns)})"
+        )
+        self.sql[(table, "delete")] = f"DELETE FROM {table} WHERE id = ?"
+        self.sql[(table, "scan")] = f"SELECT {names} FROM {table} WHERE id > ? ORDER BY id LIMIT ?"
+
+    async def create_fts(self, table: str, field: str):
+        """field 的全文索引：trigram 分词的 {table}_fts 用于前缀和子串，unicode61 分词的 {table}_words 用于词前缀
+
+        都是外部内容表，只存索引不存原文，由触发器和主表按 rowid 同步。
+        主表没有 INTEGER PRIMARY KEY，VACUUM 后 rowid 可能变化，因此每次打开时核对两边的条数和最大 rowid，
+        不一致就 rebuild。
+        """
+        for fts, tokenize in ((f"{table}_fts", "trigram"), (f"{table}_words", "unicode61 remove_diacritics 2")):
+            async with self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)) as cur:
+                created = await cur.fetchone() is None
+            await self.conn.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} "
+                f"USING fts5({field}, content='{table}', tokenize='{tokenize}')"
+            )
+            insert = f"INSERT INTO {fts} (rowid, {field}) VALUES (new.rowid, new.{field});"
+            delete = f"INSERT INTO {fts} ({fts}, rowid, {field}) VALUES ('delete', old.rowid, old.{field});"
+            await self.conn.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert} END")
+            await self.conn.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END")
+            await self.conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {field} ON {table} BEGIN {delete} {insert} END"
+            )
+            # 新建的索引补上已有的记录，已有的索引和主表对不上时重建
+            if created or await self.fts_stale(table, fts):
+                await self.conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+    async def fts_stale(self, table: str, fts: str) -> bool:
+        # _docsize 是 FTS5 的影子表，每条被索引的记录一行，id 即主表 rowid
+        async with self.conn.execute(f"SELECT count(*), coalesce(max(rowid), 0) FROM {table}") as cur:
+            expected = tuple(await cur.fetchone())
+        async with self.conn.execute(f"SELECT count(*), coalesce(max(id), 0) FROM {fts}_docsize") as cur:
+            return tuple(await cur.fetchone()) != expected
+
+    def dump(self, table: str, doc: dict) -> dict:
+        row = {}
+        for name, t in self.columns[table].items():
+            value = doc.get(name)
+            if isinstance(value, datetime):
+                value = value.isoformat(sep=" ", timespec="microseconds")
+            elif isinstance(value, bool):
+                value = int(value)
+            row[name] = value
+        return row
+
+    def load(self, table: str, row) -> dict:
+        doc = {}
+        for (name, t), value in zip(self.columns[table].items(), row):
+            if value is not None and t is datetime:
+                value = datetime.fromisoformat(value)
+            elif value is not None and t is bool:
+                value = bool(value)
+            doc[name] = value
+        return doc
+
+    def where(self, table: str, filters: Dict[str, Any]):
+        clauses, params = [], []
+        for name, value in filters.items():
+            if name not in self.columns[table]:
+                raise KeyError(name)
+            if value is None:
+                clauses.append(f"{name} IS NULL")
+            else:
+                clauses.append(f"{name} = ?")
+                params.append(self.dump(table, {name: value})[name])
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    async def fetch(self, table: str, sql: str, params) -> List[dict]:
+        async with self.conn.execute(sql, params) as cur:
+            return [self.load(table, row) for row in await cur.fetchall()]
+
+    async def get(self, table, id_):
+        ret = await self.fetch(table, self.sql[(table, "get")], (id_,))
+        return ret[0] if ret else None
+
+    async def get_many(self, table, values, field="id"):
+        if field not in self.columns[table]:
+            raise KeyError(field)
+        values = [self.dump(table, {field: it})[field] for it in values]
+        ret = []
+        # SQLite 单条语句的参数个数有上限，分批查询
+        for i in range(0, len(values), 500):
+            batch = values[i : i + 500]
+            sql = (
+                f"SELECT {', '.join(self.columns[table])} FROM {table} "
+                f"WHERE {field} IN ({', '.join('?' * len(batch))})"
+            )
+            ret += await self.fetch(table, sql, batch)
+        return ret
+
+    async def list(self, table, page=1, size=100, cursor=None):
+        if cursor:
+            created_at, id_ = cursor
+            params = (self.dump(table, {"created_at": created_at})["created_at"], id_, size)
+            return await self.fetch(table, self.sql[(table, "cursor")], params)
+        return await self.fetch(table, self.sql[(table, "list")], (size, (page - 1) * size))
+
+    async def find(self, table, filters, page=1, size=100):
+        where, params = self.where(table, filters)
+        sql = (
+            f"SELECT {', '.join(self.columns[table])} FROM {table}{where} "
+            f"ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?"
+        )
+        return await self.fetch(table, sql, params + [size, (page - 1) * size])
+
+    async def search(self, table, query, mode="substring", page=1, size=100):
+        field = self.text_fields[table]
+        names = ", ".join(f"t.{it}" for it in self.columns[table])
+        # 结果按写入顺序倒序，FTS5 可以直接按 rowid 倒序遍历，不需要对全部命中排序
+        limit = "LIMIT ? OFFSET ?"
+        if mode == "token":
+            tokens = query_tokens(query)
+            if not tokens:
+                return []
+            sql = (
+                f"SELECT {names} FROM {table}_words f JOIN {table} t ON t.rowid = f.rowid "
+                f"WHERE {table}_words MATCH ? ORDER BY f.rowid DESC {limit}"
+            )
+            params = [" ".join(f'"{it}"*' for it in tokens)]
+        else:
+            escaped = re.sub(r"([\\%_])", r"\\\1", query)
+            params = [f"{escaped}%" if mode == "prefix" else f"%{escaped}%"]
+            like = f"t.{field} LIKE ? ESCAPE '\\'"
+            if len(query) < 3:
+                # trigram 索引匹配不了不足三个字符的查询，按 rowid 倒序扫描主表，命中够一页就停
+                sql = f"SELECT {names} FROM {table} t WHERE {like} ORDER BY t.rowid DESC {limit}"
+            else:
+                # 带引号的短语在 trigram 索引上就是子串匹配，前缀再用 LIKE 过滤候选
+                sql = (
+                    f"SELECT {names} FROM {table}_fts f JOIN {table} t ON t.rowid = f.rowid "
+                    f"WHERE {table}_fts MATCH ? AND {like} ORDER BY f.rowid DESC {limit}"
+                )
+                params.insert(0, '"{}"'.format(query.replace('"', '""')))
+        return await self.fetch(table, sql, params + [size, (page - 1) * size])
+
+    async def scan(self, table, after=None, size=1000):
+        return await self.fetch(table, self.sql[(table, "scan")], (after or "", size))
+
+    async def insert(self, table, doc):
+        await self.conn.execute(self.sql[(table, "insert")], self.dump(table, doc))
+        await self.conn.commit()
+
+    async def insert_many(self, table, docs):
+        if docs:
+            await self.conn.executemany(self.sql[(table, "insert")], [self.dump(table, it) for it in docs])
+            await self.conn.commit()
+
+    async def update(self, table, id_, fields):
+        row = self.dump(table, fields)
+        names = [it for it in fields if it in row]
+        sql = f"UPDATE {table} SET {', '.join(f'{it} = :{it}' for it in names)} WHERE id = :__id"
+        await self.conn.execute(sql, {**{it: row[it] for it in names}, "__id": id_})
+        await self.conn.commit()
+
+    async def delete(self, table, id_):
+        await self.conn.execute(self.sql[(table, "delete")], (id_,))
+        await self.conn.commit()
+
+    async def delete_many(self, table, ids):
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            batch = ids[i : i + 500]
+            await self.conn.execute(f"DELETE FROM {table} WHERE id IN ({', '.join('?' * len(batch))})", batch)
+        await self.conn.commit()
+
+    async def clear(self, table):
+        await self.conn.execute(f"DELETE FROM {table}")
+        await self.conn.commit()
+
+
+def create_store(kind: Optional[str] = None) -> MetaStore:
+    kind = (kind or os.environ.get("META_STORE", "mongo")).lower()
+    if kind == "sqlite":
+        return SQLiteStore(os.environ.get("SQLITE_PATH", os.path.join(os.getcwd(), "sserver.db")))
+    if kind == "mongo":
+        return MongoStore(os.environ.get("MONGOURI", "mongodb://localhost:27017/"))
+    raise ValueError(f"unknown META_STORE: {kind}")
@@ -0,0 +1,363 @@
+import os
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+import aiofiles
+from sanic.headers import parse_content_header
+
+from sserver import fs
+from sserver.limits import body_chunks
+from sserver.utils import run_sync
+
+# 写盘缓冲区大小，请求体按这个粒度落盘，内存占用与请求体大小无关
+WRITE_BUFFER_SIZE = 1024 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+# tar 的 GNU 长文件名和 pax 扩展头要整个放进内存
+MAX_TAR_META_SIZE = 1024 * 1024
+
+PART, DATA, END = "part", "data", "end"
+
+
+class MultipartError(ValueError):
+    pass
+
+
+class MultipartParser:
+    """增量解析 multipart/form-data 请求体
+
+    每次 feed 一段字节，产出 (PART, headers) / (DATA, bytes) / (END, None) 事件，
+    只在内部保留不足一个分隔符长度的尾巴。
+    """
+
+    def __init__(self, boundary: str):
+        self.delimiter = b"\r\n--" + boundary.encode("latin-1")
+        # 第一个 boundary 前没有 CRLF，补上以便统一匹配
+        self.buffer = bytearray(b"\r\n")
+        self.state = "preamble"
+
+    @classmethod
+    def from_content_type(cls, content_type: str):
+        value, options = parse_content_header(content_type or "")
+        boundary = options.get("boundary")
+        if value != "multipart/form-data" or not boundary:
+            raise MultipartError("not a multipart/form-data request")
+        return cls(str(boundary))
+
+    def feed(self, data: bytes) -> Iterator[Tuple[str, Optional[object]]]:
+        self.buffer += data
+        buf, delimiter = self.buffer, self.delimiter
+        keep = len(delimiter) - 1
+        while True:
+            if self.state in ("preamble", "body"):
+                pos = buf.find(delimiter)
+                if pos == -1:
+                    if self.state == "body" and len(buf) > keep:
+                        yield DATA, bytes(buf[:-keep])
+                        del buf[:-keep]
+                    elif self.state == "preamble" and len(buf) > keep:
+                        del buf[:-keep]
+                    return
+                if self.state == "body":
+                    if pos:
+                        yield DATA, bytes(buf[:pos])
+                    yield END, None
+                del buf[: pos + len(delimiter)]
+                self.state = "boundary"
+            elif self.state == "boundary":
+                if len(buf) < 2:
+                    return
+                if buf[:2] == b"--":
+                    self.state = "done"
+                    buf.clear()
+                    return
+                pos = buf.find(b"\r\n")
+                if pos == -1:
+                    return
+                del buf[: pos + 2]
+                self.state = "headers"
+            elif self.state == "headers":
+                pos = buf.find(b"\r\n\r\n")
+                if pos == -1:
+                    if len(buf) > MAX_HEADER_SIZE:
+                        raise MultipartError("multipart part headers too large")
+                    return
+                headers = self.parse_headers(bytes(buf[:pos]))
+                del buf[: pos + 4]
+                self.state = "body"
+                yield PART, headers
+            else:
+                buf.clear()
+                return
+
+    def close(self):
+        if self.state != "done":
+            raise MultipartError("multipart body ended unexpectedly")
+
+    @staticmethod
+    def parse_headers(raw: bytes) -> Dict[str, str]:
+        headers = {}
+        for line in raw.decode("utf-8", "replace").split("\r\n"):
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        return headers
+
+
+class TarError(ValueError):
+    pass
+
+
+class TarParser:
+    """增量解析 tar 流（ustar / GNU / pax），事件与 MultipartParser 相同
+
+    PART 的值为 {"name", "size"}，只产出普通文件，目录、链接等条目跳过并记在 skipped 里；
+    支持 GNU 长文件名和 pax 扩展头的 path、size，其余 pax 字段忽略。
+    """
+
+    BLOCK = 512
+    FILE_TYPES = (b"0", b"\0", b"7")
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.state = "header"
+        # 当前条目剩余的数据和填充字节数
+        self.remaining = 0
+        self.padding = 0
+        self.emit = False
+        self.meta = None
+        self.long_name = None
+        self.pax_path = None
+        self.pax_size = None
+        self.skipped = []
+
+    @staticmethod
+    def number(field: bytes) -> int:
+        if field[:1] and field[0] & 0x80:
+            # GNU base-256，超过 8GB 的文件
+            return int.from_bytes(bytes([field[0] & 0x7F]) + field[1:], "big")
+        field = field.split(b"\0", 1)[0].strip()
+        return int(field, 8) if field else 0
+
+    @staticmethod
+    def text(field: bytes) -> str:
+        return field.split(b"\0", 1)[0].decode("utf-8", "surrogateescape")
+
+    def parse_header(self, block: bytes):
+        try:
+            checksum = self.number(block[148:156])
+        except ValueError:
+            raise TarError("invalid tar header")
+        if checksum != sum(block[:148]) + 8 * 32 + sum(block[156:]):
+            raise TarError("invalid tar header checksum")
+        name = self.text(block[0:100])
+        if block[257:262] == b"ustar" and (prefix := self.text(block[345:500])):
+            name = f"{prefix}/{name}"
+        return name, block[156:157], self.number(block[124:136])
+
+    def feed(self, data: bytes) -> Iterator[Tuple[str, Optional[object]]]:
+        self.buffer += data
+        buf = self.buffer
+        while True:
+            if self.state == "header":
+                if len(buf) < self.BLOCK:
+                    return
+                block = bytes(buf[: self.BLOCK])
+                del buf[: self.BLOCK]
+                if block == bytes(self.BLOCK):
+                    # 结尾的两个全零块之后的内容忽略
+                    self.state = "done"
+                    continue
+                name, type_, size = self.parse_header(block)
+                if type_ in (b"L", b"x"):
+                    if size > MAX_TAR_META_SIZE:
+                        raise TarError("tar extended header too large")
+                    self.meta, self.emit = (type_, bytearray()), False
+                elif type_ in self.FILE_TYPES:
+                    name = self.pax_path or self.long_name or name
+                    # pax 的 size 覆盖 ustar 头里的大小，数据和填充都按它计算
+                    size = size if self.pax_size is None else self.pax_size
+                    self.long_name = self.pax_path = self.pax_size = None
+                    self.meta, self.emit = None, True
+                    yield PART, {"name": name, "size": size}
+                else:
+                    if type_ not in (b"5", b"g"):
+                        self.skipped.append(self.pax_path or self.long_name or name)
+                    if type_ != b"g":
+                        size = size if self.pax_size is None else self.pax_size
+                        self.long_name = self.pax_path = self.pax_size = None
+                    self.meta, self.emit = None, False
+                self.remaining, self.padding = size, -size % self.BLOCK
+                self.state = "body"
+            elif self.state == "body":
+                if self.remaining:
+                    if not buf:
+                        return
+                    chunk = bytes(buf[: self.remaining])
+                    del buf[: len(chunk)]
+                    self.remaining -= len(chunk)
+                    if self.emit:
+                        yield DATA, chunk
+                    elif self.meta:
+                        self.meta[1].extend(chunk)
+                    continue
+                if self.padding:
+                    n = min(self.padding, len(buf))
+                    del buf[:n]
+                    self.padding -= n
+                    if self.padding:
+                        return
+                if self.emit:
+                    yield END, None
+                elif self.meta:
+                    self.apply_meta(*self.meta)
+                self.meta, self.emit = None, False
+                self.state = "header"
+            else:
+                buf.clear()
+                return
+
+    def apply_meta(self, type_: bytes, data: bytearray):
+        if type_ == b"L":
+            self.long_name = self.text(bytes(data))
+            return
+        # pax 记录：“长度 key=value\n”
+        pos = 0
+        while pos < len(data):
+            space = data.find(b" ", pos)
+            if space == -1:
+                break
+            try:
+                end = pos + int(data[pos:space])
+            except ValueError:
+                raise TarError("invalid pax header")
+            # 长度包含自身和结尾的换行，不合法的长度会让解析原地打转或越界
+            if end <= space or end > len(data):
+                raise TarError("invalid pax record length")
+            key, _, value = bytes(data[space + 1 : end - 1]).partition(b"=")
+            if key == b"path":
+                self.pax_path = value.decode("utf-8", "surrogateescape")
+            elif key == b"size":
+                try:
+                    self.pax_size = int(value)
+                except ValueError:
+                    raise TarError("invalid pax size")
+                if self.pax_size < 0:
+                    raise TarError("invalid pax size")
+            pos = end
+
+    def close(self):
+        # 有些打包工具省略结尾的全零块，只要停在条目边界上就算完整
+        if self.state == "body" or self.buffer:
+            raise TarError("tar stream ended unexpectedly")
+
+
+class BufferedFileWriter:
+    """按固定大小攒批写盘的异步文件写入器"""
+
+    def __init__(self, path: str, buffer_size: int = WRITE_BUFFER_SIZE):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.size = 0
+        self.f = None
+
+    async def open(self):
+        self.f = await aiofiles.open(self.path, "wb")
+        return self
+
+    async def close(self, flush: bool = True):
+        try:
+            if flush:
+                await self.flush()
+        finally:
+            await self.f.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close(flush=exc_type is None)
+
+    async def write(self, data: bytes):
+        self.buffer += data
+        self.size += len(data)
+        if len(self.buffer) >= self.buffer_size:
+            await self.flush()
+
+    async def flush(self):
+        if self.buffer:
+            await self.f.write(bytes(self.buffer))
+            self.buffer.clear()
+
+
+class HashingWriter(BufferedFileWriter):
+    """写盘的同时计算摘要，摘要和写盘都在线程池里按缓冲区粒度进行"""
+
+    def __init__(self, path: str, hasher=None):
+        super().__init__(path)
+        self.hasher = hasher
+
+    async def flush(self):
+        if self.buffer and self.hasher:
+            await run_sync(self.hasher.update, bytes(self.buffer))
+        await super().flush()
+
+
+class Throughput:
+    """统计单次传输的字节数和速率"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.bytes = 0
+
+    def add(self, n: int):
+        self.bytes += n
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    @property
+    def speed(self) -> float:
+        return self.bytes / max(self.elapsed, 1e-6)
+
+    def json(self):
+        return {"bytes": self.bytes, "elapsed": round(self.elapsed, 3), "speed": round(self.speed, 2)}
+
+
+def part_filename(headers: Dict[str, str]) -> Tuple[str, str]:
+    _, options = parse_content_header(headers.get("content-disposition", ""))
+    return str(options.get("name", "")), os.path.basename(str(options.get("filename", "")))
+
+
+async def save_multipart(request, field: str, save_dir: str, max_size: float = float("inf")):
+    """把请求体中名为 field 的文件字段流式写入 save_dir，返回 (文件名, Throughput)"""
+    parser = MultipartParser.from_content_type(request.headers.get("content-type"))
+    meter = Throughput()
+    saved, writer = None, None
+    try:
+        async for data in body_chunks(request):
+            meter.add(len(data))
+            if meter.bytes > max_size:
+                raise MultipartError("request body too large")
+            for event, value in parser.feed(data):
+                if event == PART:
+                    name, filename = part_filename(value)
+                    if name == field and filename and saved is None:
+                        saved = os.path.join(save_dir, filename)
+                        writer = await BufferedFileWriter(saved).open()
+                elif event == DATA and writer:
+                    await writer.write(value)
+                elif event == END and writer:
+                    await writer.close()
+                    writer = None
+        parser.close()
+        if saved is None:
+            raise MultipartError(f"missing file field: {field}")
+    except BaseException:
+        if writer:
+            await writer.close(flush=False)
+        if saved:
+            await fs.remove(saved, missing_ok=True)
+        raise
+    return os.path.basename(saved), meter
@@ -1,3 +1,26 @@
+import fcntl
+import os
+from typing import Optional
+
+from sserver import fs
+
+
+async def run_sync(func, *args):
+    """在文件系统线程池里执行阻塞调用，按函数名记录耗时"""
+    return await fs.run(func, *args)
+
+
+def try_lock(path: str) -> Optional[int]:
+    """非阻塞地获取文件锁，拿到时返回 fd，关闭 fd 或进程退出即释放；多个 worker 中只有一个能拿到"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
 def get_media_type(file_extension: str, direct_download: str = "") -> str:
     # pylint: disable=too-many-return-statements
     if direct_download == "1":
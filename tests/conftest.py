@@ -0,0 +1,208 @@
+import asyncio
+import json as jsonlib
+import os
+import sys
+from typing import Dict, Iterable, Optional
+
+import pytest
+
+# 直接运行 pytest 时也能导入仓库里的 sserver / dserver
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Response:
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return jsonlib.loads(self.body)
+
+
+class AsgiClient:
+    """不监听端口，按 ASGI 协议直接调用 app；启动回调、请求和后台任务都在同一个事件循环里执行"""
+
+    def __init__(self, app):
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        self.lifespan = asyncio.Queue()
+        self.lifespan_task = None
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def start(self):
+        async def start():
+            started = self.loop.create_future()
+
+            async def send(message):
+                if not started.done():
+                    started.set_result(message)
+
+            await self.lifespan.put({"type": "lifespan.startup"})
+            scope = {"type": "lifespan", "asgi": {"version": "3.0"}}
+            self.lifespan_task = asyncio.ensure_future(self.app(scope, self.lifespan.get, send))
+            assert (await started)["type"] == "lifespan.startup.complete"
+
+        self.run(start())
+
+    def close(self):
+        from sserver import model
+
+        async def close():
+            await self.lifespan.put({"type": "lifespan.shutdown"})
+            await asyncio.wait_for(self.lifespan_task, 5)
+            if model.db is not None:
+                await model.db.close()
+                model.db = None
+            for task in asyncio.all_tasks() - {asyncio.current_task()}:
+                task.cancel()
+
+        self.run(close())
+        self.loop.close()
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes = b"",
+        headers: Optional[Dict[str, str]] = None,
+        json=None,
+        chunks: Optional[Iterable[bytes]] = None,
+    ) -> Response:
+        headers = dict(headers or {})
+        if json is not None:
+            body = jsonlib.dumps(json).encode()
+            headers.setdefault("content-type", "application/json")
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(k.lower().encode(), str(v).encode()) for k, v in headers.items()],
+            "client": ("127.0.0.1", 12345),
+            "server": ("127.0.0.1", 80),
+        }
+        parts = list(chunks) if chunks is not None else [body]
+        messages = [{"type": "http.request", "body": it, "more_body": True} for it in parts]
+        messages.append({"type": "http.request", "body": b"", "more_body": False})
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        self.run(self.app(scope, receive, send))
+        start = next(it for it in sent if it["type"] == "http.response.start")
+        body = b"".join(it.get("body", b"") for it in sent if it["type"] == "http.response.body")
+        return Response(start["status"], {k.decode().lower(): v.decode() for k, v in start["headers"]}, body)
+
+    def get(self, path: str, **kwargs) -> Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> Response:
+        return self.request("POST", path, **kwargs)
+
+    def settle(self, seconds: float = 0.05):
+        """让后台任务跑一会儿"""
+        self.run(asyncio.sleep(seconds))
+
+
+@pytest.fixture
+def make_client(tmp_path, monkeypatch):
+    """按环境变量创建 sserver 的 app 并启动，返回 AsgiClient；默认使用临时目录下的 SQLite 和 UPLOAD_DIR"""
+    from sanic import Sanic
+
+    from sserver import model
+
+    Sanic.test_mode = True
+    clients = []
+
+    def make(**env):
+        env = {
+            "UPLOAD_DIR": str(tmp_path / "upload"),
+            "META_STORE": "sqlite",
+            "SQLITE_PATH": str(tmp_path / "meta.db"),
+            "GC_INTERVAL": "0",
+            **{k: str(v) for k, v in env.items()},
+        }
+        for k, v in env.items():
+            monkeypatch.setenv(k, v)
+        from sserver.main import create_app
+
+        model.db = None
+        client = AsgiClient(create_app())
+        client.start()
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
+
+
+@pytest.fixture
+def make_dserver(tmp_path, monkeypatch):
+    """创建 dserver 的 app 并启动，共享目录为 tmp_path/root，各种缓存目录都放在临时目录下"""
+    from sanic import Sanic
+
+    Sanic.test_mode = True
+    root = tmp_path / "root"
+    root.mkdir(exist_ok=True)
+    clients = []
+
+    def make(**env):
+        env = {
+            "DIGEST_CACHE_DIR": str(tmp_path / "digests"),
+            "SEARCH_INDEX_DIR": str(tmp_path / "search"),
+            "COMPRESS_CACHE_DIR": str(tmp_path / "compressed"),
+            **{k: str(v) for k, v in env.items()},
+        }
+        for k, v in env.items():
+            monkeypatch.setenv(k, v)
+        from dserver.main import create_app
+
+        client = AsgiClient(create_app(upload_dir=str(root)))
+        client.start()
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
+
+
+@pytest.fixture
+def run_with_db(tmp_path, monkeypatch):
+    """在临时目录下的 SQLite 库上执行 async 函数，model.db 指向该库，不启用记录缓存和事件推送"""
+    from sserver import events, model
+    from sserver.store import SQLiteStore
+
+    monkeypatch.setattr(model, "record_cache", None)
+    monkeypatch.setattr(model, "local_node", "")
+    monkeypatch.setattr(events, "hub", None)
+
+    def run(func, *args):
+        async def main():
+            store = SQLiteStore(str(tmp_path / "meta.db"))
+            for cls in (model.FileRecord, model.MsgRecord):
+                store.register(cls.table, cls)
+            await store.connect()
+            monkeypatch.setattr(model, "db", store)
+            try:
+                return await func(*args)
+            finally:
+                await store.close()
+
+        return asyncio.run(main())
+
+    return run
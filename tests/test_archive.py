@@ -0,0 +1,129 @@
+import asyncio
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from sserver.archive import READ_SIZE, create_archive, unique_names, walk
+
+FILES = {
+    "a.txt": b"hello world",
+    "empty.bin": b"",
+    "sub/big.bin": os.urandom(READ_SIZE * 2 + 123),
+    "sub/deep/中文名.txt": "你好".encode() * 1000,
+    "sub/deep/" + "x" * 150 + ".txt": b"long name",
+}
+
+
+@pytest.fixture
+def members(tmp_path):
+    for name, data in FILES.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    (tmp_path / "emptydir").mkdir()
+    return walk(str(tmp_path), "root")
+
+
+def render(archive, offset=0, count=None, sendfile=False) -> bytes:
+    chunks = []
+
+    async def send(data):
+        chunks.append(bytes(data))
+
+    async def send_file(fd, offset, count):
+        chunks.append(os.pread(fd, count, offset))
+
+    asyncio.run(archive.write(send, offset, count, send_file if sendfile else None))
+    return b"".join(chunks)
+
+
+def expected_names():
+    dirs = {"root/", "root/emptydir/", "root/sub/", "root/sub/deep/"}
+    return dirs | {f"root/{name}" for name in FILES}
+
+
+@pytest.mark.parametrize("deflate", [False, True])
+def test_zip_round_trip(members, deflate):
+    archive = create_archive(members, "zip", deflate)
+    data = render(archive)
+    if not deflate:
+        assert archive.size == len(data)
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert set(zf.namelist()) == expected_names()
+        for name, content in FILES.items():
+            info = zf.getinfo(f"root/{name}")
+            assert info.compress_type == (zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED)
+            assert zf.read(info) == content
+        assert zf.getinfo("root/emptydir/").is_dir()
+
+
+@pytest.mark.parametrize("sendfile", [False, True])
+def test_tar_round_trip(members, sendfile):
+    archive = create_archive(members, "tar")
+    data = render(archive, sendfile=sendfile)
+    assert archive.size == len(data)
+    with tarfile.open(fileobj=io.BytesIO(data)) as tf:
+        assert set(it.name + ("/" if it.isdir() else "") for it in tf.getmembers()) == expected_names()
+        for name, content in FILES.items():
+            assert tf.extractfile(f"root/{name}").read() == content
+        assert tf.getmember("root/emptydir").isdir()
+
+
+@pytest.mark.parametrize("fmt", ["zip", "tar"])
+def test_resume(members, fmt):
+    """从任意偏移续传的内容与完整输出的对应部分一致，ZIP 的 CRC 在续传时补算"""
+    full = render(create_archive(members, fmt))
+    size = len(full)
+    for offset, count in [(0, 100), (37, 1000), (1000, READ_SIZE + 17), (size // 2, None), (size - 1, 1)]:
+        part = render(create_archive(members, fmt), offset, count)
+        assert part == full[offset : None if count is None else offset + count]
+
+
+def test_etag(members):
+    assert create_archive(members, "zip").etag == create_archive(members, "zip").etag
+    assert create_archive(members, "zip").etag != create_archive(members, "tar").etag
+    assert create_archive(members, "zip").etag != create_archive(members[1:], "zip").etag
+
+
+def test_unsupported_format(members):
+    with pytest.raises(ValueError):
+        create_archive(members, "rar")
+
+
+def test_unique_names():
+    assert unique_names(["a.txt", "b", "a.txt", "a.txt", "b"]) == ["a.txt", "b", "a (1).txt", "a (2).txt", "b (1)"]
+
+
+def test_parse_flag():
+    from sserver.main import parse_flag
+
+    assert all(parse_flag(it) for it in (True, 1, "1", "true", "TRUE"))
+    assert not any(parse_flag(it) for it in (False, 0, "0", "false", ""))
+    for value in ("yes", "2", [1], None):
+        with pytest.raises(ValueError):
+            parse_flag(value)
+
+
+def test_locate_files(tmp_path):
+    from types import SimpleNamespace
+
+    from sserver.cluster import PeerCache
+    from sserver.main import locate_files
+
+    upload_dir = tmp_path / "upload"
+    upload_dir.mkdir()
+    (upload_dir / "local").write_bytes(b"abc")
+    cache = PeerCache(str(tmp_path / "cache"), 1 << 20)
+    tmp = cache.temp_path()
+    open(tmp, "wb").write(b"remote")
+    cache.commit(tmp, "remote")
+    files = [SimpleNamespace(id=it, size=size) for it, size in [("local", 3), ("remote", 6), ("stale", 1), ("gone", 0)]]
+    located = locate_files(str(upload_dir), files, cache)
+    assert located[0][0] == str(upload_dir / "local") and located[1][0] == cache.path("remote")
+    assert located[2:] == [None, None]
+    assert located[1][1].st_size == 6
+    assert locate_files(str(upload_dir), files)[1:] == [None, None, None]
@@ -0,0 +1,43 @@
+import asyncio
+import hashlib
+import os
+
+from sserver import blobs
+
+DATA = os.urandom(blobs.READ_SIZE * 2 + 100)
+
+
+def test_hash_file_blocks(tmp_path):
+    path = tmp_path / "a"
+    path.write_bytes(DATA)
+    assert asyncio.run(blobs.hash_file_blocks(str(path))) == hashlib.sha256(DATA).hexdigest()
+    path.write_bytes(b"")
+    assert asyncio.run(blobs.hash_file_blocks(str(path))) == hashlib.sha256(b"").hexdigest()
+
+
+def test_adopt_and_release(tmp_path):
+    upload_dir = str(tmp_path)
+    a, b = tmp_path / "a", tmp_path / "b"
+    a.write_bytes(DATA)
+    b.write_bytes(DATA)
+    digest, reused = blobs.adopt(upload_dir, str(a))
+    assert digest == hashlib.sha256(DATA).hexdigest() and not reused
+    assert blobs.adopt(upload_dir, str(b), digest) == (digest, True)
+    blob = blobs.blob_path(upload_dir, digest)
+    assert os.stat(blob).st_nlink == 3 and os.stat(b).st_ino == os.stat(blob).st_ino
+    assert blobs.find(upload_dir, digest, len(DATA)) and not blobs.find(upload_dir, digest, 1)
+
+    # 还有其他引用时不释放空间，最后一个引用连同 blob 一起删除
+    assert blobs.release(upload_dir, str(a), digest) == 0
+    assert blobs.release(upload_dir, str(b), digest) == len(DATA)
+    assert not os.path.exists(blob)
+
+
+def test_orphan_blobs(tmp_path):
+    a = tmp_path / "a"
+    a.write_bytes(b"x" * 10)
+    digest, _ = blobs.adopt(str(tmp_path), str(a))
+    assert blobs.orphan_blobs(str(tmp_path), float("inf")) == []
+    os.remove(a)
+    assert blobs.orphan_blobs(str(tmp_path), float("inf")) == [(blobs.blob_path(str(tmp_path), digest), 10)]
+    assert blobs.orphan_blobs(str(tmp_path), 0) == []
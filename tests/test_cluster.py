@@ -0,0 +1,124 @@
+import asyncio
+import json
+import uuid
+
+from sserver.cluster import HOP_HEADER, NODE_HEADER, Cluster
+
+
+class FakePeer:
+    """测试用的对端节点，记录收到的每个请求
+
+    GET /{name}?static=1 返回 files 中的内容，POST /upload/chunks/delete 删除 files 中的项，
+    /upload/session/ 下的请求原样回显方法、路径和请求体。
+    """
+
+    def __init__(self, files):
+        self.files = dict(files)
+        self.requests = []
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def handle(self, reader, writer):
+        head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        method, target, _ = head[0].split(" ")
+        headers = dict((k.strip().lower(), v.strip()) for k, _, v in (it.partition(":") for it in head[1:] if it))
+        if headers.get("transfer-encoding") == "chunked":
+            body = b""
+            while size := int((await reader.readline()).strip(), 16):
+                body += await reader.readexactly(size + 2)
+                body = body[:-2]
+            await reader.readline()
+        else:
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+        self.requests.append((method, target, headers, body))
+        if method == "GET" and (name := target[1:].partition("?")[0]) in self.files:
+            status, payload = 200, self.files[name]
+        elif method == "POST" and target == "/upload/chunks/delete":
+            for name in json.loads(body)["names"]:
+                self.files.pop(name, None)
+            status, payload = 200, b'{"code": 0, "msg": "success"}'
+        elif target.startswith("/upload/session/"):
+            status, payload = 200, json.dumps({"method": method, "target": target, "body": body.decode()}).encode()
+        else:
+            status, payload = 404, b"{}"
+        writer.write(b"HTTP/1.1 %d X\r\nContent-Length: %d\r\n\r\n%s" % (status, len(payload), payload))
+        await writer.drain()
+        writer.close()
+
+
+def test_patch_releases_pulled_chunks(tmp_path, make_client):
+    """旧版 PATCH 合并时从对端拉取的分块，合并成功后通知对端删除"""
+    upload_id = str(uuid.uuid4())
+    peer = FakePeer({f"{upload_id}-1": b"world"})
+    upload_dir = tmp_path / "upload"
+    upload_dir.mkdir()
+    (upload_dir / f"{upload_id}-0").write_bytes(b"hello ")
+    client = make_client(CLUSTER_NODE="n1", CLUSTER_PEERS="n2=http://127.0.0.1:9")
+    client.app.ctx.cluster.peers["n2"].port = int(client.run(peer.start()).rsplit(":", 1)[1])
+
+    res = client.request("PATCH", "/upload", json={"filename": "a.txt", "_id": upload_id, "chunks": 2})
+    assert res.status == 200, res.body
+    file_id = res.body.decode()
+    assert client.get(f"/{file_id}").body == b"hello world"
+    assert [(m, t) for m, t, _, _ in peer.requests] == [
+        ("GET", f"/{upload_id}-1?static=1"),
+        ("POST", "/upload/chunks/delete"),
+    ]
+    assert all(h[HOP_HEADER.lower()] == "n1" for _, _, h, _ in peer.requests)
+    assert peer.files == {}
+    assert not any((upload_dir / f"{upload_id}-{i}").exists() for i in range(2))
+
+
+def test_delete_chunks_route(tmp_path, make_client):
+    client = make_client(CLUSTER_NODE="n2", CLUSTER_PEERS="n1=http://127.0.0.1:9")
+    chunk = f"{uuid.uuid4()}-0"
+    (tmp_path / "upload" / chunk).write_bytes(b"x")
+    (tmp_path / "upload" / "keep").write_bytes(b"x")
+    hop = {HOP_HEADER: "n1"}
+
+    # 只接受其他节点转发来的请求，只删除旧版分块
+    assert client.post("/upload/chunks/delete", json={"names": [chunk]}).status == 403
+    assert client.post("/upload/chunks/delete", json={"names": ["keep"]}, headers=hop).status == 400
+    assert client.post("/upload/chunks/delete", json={"names": ["../x"]}, headers=hop).status == 400
+    res = client.post("/upload/chunks/delete", json={"names": [chunk, f"{uuid.uuid4()}-1"]}, headers=hop)
+    assert res.json() == {"code": 0, "msg": "success", "data": {"removed": 2}}
+    assert not (tmp_path / "upload" / chunk).exists() and (tmp_path / "upload" / "keep").exists()
+
+
+def test_session_node():
+    assert Cluster.session_node("01ABC.n2") == "n2"
+    assert Cluster.session_node("01ABC") is None
+    assert Cluster.session_node("01ABC.") is None
+
+
+def test_session_routed_to_owner_node(make_client):
+    """{ulid}.{node} 形式的会话 id，后续请求转发给创建会话的节点"""
+    peer = FakePeer({})
+    client = make_client(CLUSTER_NODE="n1", CLUSTER_PEERS="n2=http://127.0.0.1:9")
+    client.app.ctx.cluster.peers["n2"].port = int(client.run(peer.start()).rsplit(":", 1)[1])
+
+    res = client.post("/upload/session", json={"filename": "a.txt", "size": 5})
+    local = res.json()["data"]["id"]
+    assert local.endswith(".n1")
+    assert client.get(f"/upload/session/{local}").json()["data"]["id"] == local
+    assert peer.requests == []
+
+    remote = local.replace(".n1", ".n2")
+    res = client.get(f"/upload/session/{remote}")
+    assert res.json() == {"method": "GET", "target": f"/upload/session/{remote}", "body": ""}
+    assert res.headers[NODE_HEADER.lower()] == "n1"
+    res = client.request("PUT", f"/upload/session/{remote}/0", chunks=[b"hel", b"lo"])
+    assert res.json()["body"] == "hello"
+    res = client.post(f"/upload/session/{remote}/finalize")
+    assert res.json()["target"] == f"/upload/session/{remote}/finalize"
+    assert client.request("DELETE", f"/upload/session/{remote}").json()["method"] == "DELETE"
+    assert all(h[HOP_HEADER.lower()] == "n1" for _, _, h, _ in peer.requests)
+
+    # 已经转发过的请求和未知节点的会话只在本地查找，不会来回转发
+    count = len(peer.requests)
+    assert client.get(f"/upload/session/{remote}", headers={HOP_HEADER: "n2"}).status == 404
+    assert client.get(f"/upload/session/{local.replace('.n1', '.n9')}").status == 404
+    assert len(peer.requests) == count
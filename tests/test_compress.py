@@ -0,0 +1,91 @@
+import asyncio
+import gzip
+import os
+import time
+
+from sserver import compress
+from sserver.compress import PrecompressedCache, negotiate
+
+DATA = b"".join(b"line %d of a compressible text file\n" % i for i in range(20000))
+
+
+def test_negotiate():
+    assert negotiate("gzip;q=0.5, identity") == "gzip"
+    assert negotiate("gzip;q=0") is None
+    assert negotiate("deflate") is None
+    assert negotiate(None) is None
+
+
+def test_concurrent_variant(tmp_path, monkeypatch):
+    """同一版本的并发请求只压缩一次，并拿到完整的压缩文件"""
+    src = tmp_path / "a.txt"
+    src.write_bytes(DATA)
+    cache = PrecompressedCache(str(tmp_path / ".compressed"))
+    builds = []
+    build = cache._build
+
+    def counted(*args):
+        builds.append(args)
+        time.sleep(0.05)
+        build(*args)
+
+    monkeypatch.setattr(cache, "_build", counted)
+
+    async def run():
+        st = os.stat(src)
+        return await asyncio.gather(*[cache.variant(str(src), st, "gzip") for _ in range(10)])
+
+    paths = asyncio.run(run())
+    assert len(builds) == 1 and len(set(paths)) == 1
+    assert gzip.decompress(open(paths[0], "rb").read()) == DATA
+    assert not cache.building
+    assert os.listdir(os.path.dirname(paths[0])) == [os.path.basename(paths[0])]
+
+
+def test_rebuild_removes_old_version(tmp_path):
+    src = tmp_path / "a.txt"
+    src.write_bytes(DATA)
+    cache = PrecompressedCache(str(tmp_path / ".compressed"))
+    old = asyncio.run(cache.variant(str(src), os.stat(src), "gzip"))
+    src.write_bytes(DATA * 2)
+    new = asyncio.run(cache.variant(str(src), os.stat(src), "gzip"))
+    assert new != old and not os.path.exists(old)
+    assert gzip.decompress(open(new, "rb").read()) == DATA * 2
+
+
+def test_small_file_not_compressed(tmp_path):
+    src = tmp_path / "a.txt"
+    src.write_bytes(b"x" * 10)
+    cache = PrecompressedCache(str(tmp_path / ".compressed"))
+    assert asyncio.run(cache.variant(str(src), os.stat(src), "gzip")) is None
+
+
+def test_prune(tmp_path):
+    cache = PrecompressedCache(str(tmp_path / ".compressed"))
+    paths = []
+    for i in range(4):
+        src = tmp_path / f"{i}.txt"
+        src.write_bytes(DATA + bytes([i]))
+        paths.append(asyncio.run(cache.variant(str(src), os.stat(src), "gzip")))
+    size = os.path.getsize(paths[0])
+    now = time.time()
+    # 0 很久没有访问，1 比 2、3 访问得早
+    for path, age in zip(paths, [10000, 300, 200, 100]):
+        os.utime(path, (now - age, now - age))
+    stale_tmp = os.path.join(os.path.dirname(paths[0]), ".x.tmp")
+    open(stale_tmp, "wb").close()
+    os.utime(stale_tmp, (now - 10000, now - 10000))
+
+    removed = cache.prune(3600, max_bytes=size * 2.5)
+    assert sorted(path for path, _ in removed) == sorted([paths[0], paths[1], stale_tmp])
+    assert [os.path.exists(it) for it in paths] == [False, False, True, True]
+    assert cache.prune(3600) == []
+
+
+def test_touch(tmp_path):
+    path = tmp_path / "a"
+    assert not compress.touch(str(path))
+    path.write_bytes(b"x")
+    os.utime(path, (1000, 1000))
+    assert compress.touch(str(path))
+    assert os.stat(path).st_atime > 1000 and os.stat(path).st_mtime == 1000
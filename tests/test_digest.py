@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import os
+import threading
+
+import pytest
+
+from dserver import digest as digest_module
+from dserver.digest import DigestCache, DigestService, hash_file
+
+DATA = os.urandom(10_000)
+
+
+@pytest.fixture
+def no_xattr(monkeypatch):
+    def setxattr(*args):
+        raise OSError(95, "Operation not supported")
+
+    def getxattr(*args):
+        raise OSError(61, "No data available")
+
+    monkeypatch.setattr(digest_module.os, "setxattr", setxattr)
+    monkeypatch.setattr(digest_module.os, "getxattr", getxattr)
+
+
+def test_hash_file_in_blocks(tmp_path, monkeypatch):
+    path = tmp_path / "a"
+    path.write_bytes(DATA)
+    monkeypatch.setattr(digest_module, "BLOCK_SIZE", 4096)
+    assert hash_file(str(path), "md5") == hashlib.md5(DATA).hexdigest()
+    assert hash_file(str(path), "blake2s") == hashlib.blake2s(DATA).hexdigest()
+
+
+def test_sidecar_cache(tmp_path, no_xattr):
+    """不支持 xattr 时写 sidecar，文件变化后旧摘要失效"""
+    path = tmp_path / "a"
+    path.write_bytes(DATA)
+    cache = DigestCache(str(tmp_path / "cache"))
+    st = os.stat(path)
+    assert cache.get(str(path), st, "md5") is None
+    cache.put(str(path), st, "md5", "m")
+    cache.put(str(path), st, "sha1", "s")
+    assert (cache.get(str(path), st, "md5"), cache.get(str(path), st, "sha1")) == ("m", "s")
+    assert os.listdir(tmp_path / "cache") == [os.path.basename(cache.sidecar(st))]
+
+    path.write_bytes(DATA + b"x")
+    st = os.stat(path)
+    assert cache.get(str(path), st, "md5") is None
+    cache.put(str(path), st, "sha256", "h")
+    assert cache.get(str(path), st, "sha1") is None and cache.get(str(path), st, "sha256") == "h"
+
+
+def test_digest_service(tmp_path, no_xattr):
+    path = tmp_path / "a"
+    path.write_bytes(DATA)
+    service = DigestService(str(tmp_path / "cache"))
+    with pytest.raises(ValueError):
+        asyncio.run(service.digest(str(path), "crc32"))
+    assert asyncio.run(service.digest(str(path), "sha256")) == hashlib.sha256(DATA).hexdigest()
+    # 第二次从缓存读取，不再计算
+    service.compute = None
+    assert asyncio.run(service.digest(str(path), "sha256")) == hashlib.sha256(DATA).hexdigest()
+    service.close()
+
+
+def test_concurrent_requests_share_computation(tmp_path, no_xattr):
+    """同一文件的并发请求共用一次计算，其中一个请求取消不影响其他请求"""
+    path = tmp_path / "a"
+    path.write_bytes(DATA)
+    service = DigestService(str(tmp_path / "cache"))
+    compute, calls, gate = service.compute, [], threading.Event()
+
+    def slow(*args):
+        calls.append(args)
+        gate.wait(5)
+        return compute(*args)
+
+    service.compute = slow
+
+    async def main():
+        tasks = [asyncio.ensure_future(service.digest(str(path))) for _ in range(3)]
+        while not calls:
+            await asyncio.sleep(0.01)
+        tasks[0].cancel()
+        gate.set()
+        done = await asyncio.gather(*tasks, return_exceptions=True)
+        assert isinstance(done[0], asyncio.CancelledError)
+        assert done[1:] == [hashlib.md5(DATA).hexdigest()] * 2
+        assert service.inflight == {}
+
+    asyncio.run(main())
+    assert len(calls) == 1
+    service.close()
+
+
+def test_md5_route(make_dserver, tmp_path):
+    (tmp_path / "root" / "sub").mkdir()
+    (tmp_path / "root" / "sub" / "a.txt").write_bytes(DATA)
+    client = make_dserver()
+    assert client.get("/md5/sub/a.txt").body.decode() == hashlib.md5(DATA).hexdigest()
+    assert client.get("/md5/sub/a.txt?algo=SHA1").body.decode() == hashlib.sha1(DATA).hexdigest()
+    assert client.get("/md5/sub/a.txt?algo=crc32").status == 400
+    assert client.get("/md5/sub/missing").status == 404
+    assert client.get("/md5/sub").body == b"is a directory"
@@ -0,0 +1,58 @@
+import asyncio
+import socket
+from types import SimpleNamespace
+
+from sanic.http.http1 import Http
+
+from sserver import download
+
+
+def test_sanic_internals():
+    """sendfile 依赖的 sanic 内部字段在当前版本中存在；升级 sanic 后这里失败说明需要重新验证"""
+    assert download.sanic_internals_supported()
+    assert "response_bytes_left" in Http.__slots__
+
+
+class Protocol(asyncio.Protocol):
+    """与 sanic 的 SanicProtocol 相同的流控处理"""
+
+    def __init__(self):
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+
+    def pause_writing(self):
+        self._can_write.clear()
+
+    def resume_writing(self):
+        self._can_write.set()
+
+
+def test_drain():
+    async def run():
+        loop = asyncio.get_running_loop()
+        a, b = socket.socketpair()
+        b.setblocking(False)
+        protocol = Protocol()
+        transport, _ = await loop.create_connection(lambda: protocol, sock=a)
+        transport.set_write_buffer_limits(low=16384, high=65536)
+        request = SimpleNamespace(transport=transport, stream=SimpleNamespace(protocol=protocol))
+
+        await asyncio.wait_for(download.drain(request), 1)
+        data = b"x" * (8 * 1024 * 1024)
+        transport.write(data)
+        assert transport.get_write_buffer_size()
+        task = asyncio.ensure_future(download.drain(request))
+        await asyncio.sleep(0.05)
+        assert not task.done()
+
+        received = 0
+        while received < len(data):
+            received += len(await loop.sock_recv(b, 1 << 20))
+        await asyncio.wait_for(task, 1)
+        assert transport.get_write_buffer_size() == 0
+        # 水位恢复原值
+        assert transport.get_write_buffer_limits() == (16384, 65536)
+        transport.close()
+        b.close()
+
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+import errno
+import hashlib
+import os
+
+import pytest
+
+from dserver import upload as upload_module
+from dserver.upload import TMP_PREFIX, ChecksumError, parse_checksum, place, resolve_dir
+
+HEADERS = {"content-type": "multipart/form-data; boundary=b"}
+
+
+def multipart(data: bytes, filename: str = "a.txt", name: str = "file") -> bytes:
+    return (
+        b"--b\r\nContent-Disposition: form-data; name=note\r\n\r\nignored\r\n"
+        + f"--b\r\nContent-Disposition: form-data; name={name}; filename={filename}\r\n\r\n".encode()
+        + data
+        + b"\r\n--b--\r\n"
+    )
+
+
+def test_parse_checksum():
+    assert parse_checksum(None) == (None, None)
+    assert parse_checksum("SHA256:ABC") == ("sha256", "abc")
+    for value in ("crc32:abc", "md5:", "md5"):
+        with pytest.raises(ChecksumError):
+            parse_checksum(value)
+
+
+def test_resolve_dir(tmp_path):
+    (tmp_path / "sub").mkdir()
+    os.symlink("/", tmp_path / "escape")
+    root = os.path.realpath(tmp_path)
+    assert resolve_dir(str(tmp_path), None) == root
+    assert resolve_dir(str(tmp_path), "/sub") == os.path.join(root, "sub")
+    for subdir in ("../x", "sub/../../x", "escape"):
+        with pytest.raises(ValueError):
+            resolve_dir(str(tmp_path), subdir)
+
+
+def test_place_does_not_overwrite(tmp_path, monkeypatch):
+    for name in ("tmp1", "tmp2", "tmp3"):
+        (tmp_path / name).write_bytes(name.encode())
+    assert place(str(tmp_path / "tmp1"), str(tmp_path / "dst"))
+    assert not place(str(tmp_path / "tmp2"), str(tmp_path / "dst"))
+    assert (tmp_path / "dst").read_bytes() == b"tmp1" and not (tmp_path / "tmp1").exists()
+
+    # 不支持硬链接时改名
+    def link(*args):
+        raise OSError(errno.EPERM, "Operation not permitted")
+
+    monkeypatch.setattr(upload_module.os, "link", link)
+    assert not place(str(tmp_path / "tmp2"), str(tmp_path / "dst"))
+    assert place(str(tmp_path / "tmp3"), str(tmp_path / "other"))
+    assert (tmp_path / "other").read_bytes() == b"tmp3" and not (tmp_path / "tmp3").exists()
+
+
+def test_upload_route(make_dserver, tmp_path):
+    root = tmp_path / "root"
+    (root / "sub").mkdir()
+    client = make_dserver()
+    client.settle()
+    data = os.urandom(100_000)
+    digest = hashlib.sha256(data).hexdigest()
+
+    res = client.post(f"/upload?dir=sub&checksum=sha256:{digest}", body=multipart(data), headers=HEADERS)
+    assert (res.status, res.body) == (200, b"a.txt")
+    assert (root / "sub" / "a.txt").read_bytes() == data
+    # 上传时算好的摘要直接进缓存，新文件马上能搜到
+    assert client.get("/md5/sub/a.txt?algo=sha256").body.decode() == digest
+    found = client.get("/search?q=a.txt&format=json").json()["data"]["entries"]
+    assert found == [{"path": "/sub/a.txt", "is_dir": False}]
+
+    # 同名文件不覆盖
+    res = client.post("/upload?dir=sub", body=multipart(b"other", name="uploaded_file"), headers=HEADERS)
+    assert res.status == 200 and (root / "sub" / "a.txt").read_bytes() == data
+
+    res = client.post("/upload?checksum=md5:0000", body=multipart(data, "b.txt"), headers=HEADERS)
+    assert res.status == 400 and not (root / "b.txt").exists()
+    assert client.post("/upload", body=multipart(data, name="other"), headers=HEADERS).status == 400
+    assert client.post("/upload?dir=../x", body=multipart(data), headers=HEADERS).status == 400
+    assert client.post("/upload?dir=missing", body=multipart(data), headers=HEADERS).status == 404
+    # 失败的上传不留下临时文件
+    assert not [it for _, _, files in os.walk(root) for it in files if it.startswith(TMP_PREFIX)]
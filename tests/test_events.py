@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+from sserver.events import QUEUE_SIZE, RESET, EventHub, EventLog
+
+FORM = {"content-type": "application/x-www-form-urlencoded"}
+
+
+def test_msg_page(make_client):
+    client = make_client()
+    assert client.post("/msg", body=b"content=hello+%3Cb%3E", headers=FORM).status == 302
+    res = client.get("/msg")
+    assert res.status == 200
+    assert b"hello &lt;b&gt;" in res.body and b'action="/msg"' in res.body
+
+
+def parse_events(body: bytes):
+    """SSE 响应体解析成 (id, event, data) 列表"""
+    events = []
+    for block in body.decode().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n") if ": " in line and not line.startswith(":"))
+        if "event" in fields:
+            events.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def stream(client, headers=None, path="/events"):
+    """读取事件流，hub 关闭时结束"""
+    client.loop.call_later(0.2, client.app.ctx.events.close)
+    res = client.get(path, headers=headers)
+    assert res.status == 200 and res.headers["content-type"].startswith("text/event-stream")
+    return parse_events(res.body)
+
+
+def test_replay_from_last_event_id(make_client):
+    client = make_client(EVENTS_POLL_INTERVAL=0.01)
+    hub = client.app.ctx.events
+    start = hub.seq
+    for i in range(3):
+        assert client.post("/msg", body=b"content=m%d" % i, headers=FORM).status == 302
+    events = stream(client, {"Last-Event-ID": str(start + 1)})
+    assert events[0] == (start + 1, "hello", {"seq": start + 1})
+    # 断线期间错过的事件按序补发，每个只出现一次
+    assert [(seq, type_) for seq, type_, _ in events[1:]] == [(start + 2, "msg.created"), (start + 3, "msg.created")]
+    assert [data["content"] for _, _, data in events[1:]] == ["m1", "m2"]
+
+
+def test_reset_when_last_event_id_too_old(make_client):
+    client = make_client(EVENTS_POLL_INTERVAL=0.01)
+    hub = client.app.ctx.events
+    for i in range(EventLog.SLOTS + 1):
+        hub.publish("msg.deleted", {"id": str(i)})
+    client.settle()
+    events = stream(client, {"Last-Event-ID": "0"})
+    assert events[0][1] == "hello"
+    assert events[1][1:] == (RESET, None)
+
+
+def test_future_last_event_id_starts_from_now(make_client):
+    """服务重启后序号从 0 开始，浏览器带来的旧序号比当前大，从当前位置开始"""
+    client = make_client(EVENTS_POLL_INTERVAL=0.01)
+    events = stream(client, {"Last-Event-ID": "999999"})
+    assert events == [(client.app.ctx.events.seq, "hello", {"seq": client.app.ctx.events.seq})]
+
+
+class Model:
+    records = {}
+
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    async def get(cls, id_):
+        return cls(cls.records[id_]) if id_ in cls.records else None
+
+    def json(self):
+        return self.data
+
+
+def test_partial_event_completed_from_db():
+    """放不下的事件只带 id，读出时查库补全，记录已经删除的丢弃"""
+    hub = EventHub(EventLog(*EventLog.create()), {"file": Model})
+    Model.records = {"a": {"id": "a", "filename": "x" * 4000}}
+    hub.publish("file.created", {"id": "a", "filename": "x" * 4000})
+    hub.publish("file.created", {"id": "gone", "filename": "y" * 4000})
+    hub.publish("file.deleted", {"id": "b"})
+    seq, events = asyncio.run(hub.replay(0))
+    assert seq == 3
+    assert events == [(1, "file.created", Model.records["a"]), (3, "file.deleted", {"id": "b"})]
+
+
+def test_slow_subscriber_gets_reset():
+    hub = EventHub(EventLog(*EventLog.create()), {})
+
+    async def main():
+        queue = hub.subscribe()
+        for i in range(QUEUE_SIZE + 1):
+            hub.deliver(queue, (i + 1, "msg.created", {}))
+        # 队列满时丢掉积压，只留一个 reset
+        assert queue.qsize() == 1 and queue.get_nowait() == (QUEUE_SIZE + 1, RESET, None)
+
+    asyncio.run(main())
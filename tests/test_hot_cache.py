@@ -0,0 +1,65 @@
+import asyncio
+import os
+import time
+
+from sserver import maintenance
+from sserver.cache import CachedFile, HotFileCache
+
+
+def cached_file(path, **kwargs) -> CachedFile:
+    st = os.stat(path)
+    return CachedFile("a", str(path), st.st_size, st.st_mtime_ns, b"data", "text/plain", **kwargs)
+
+
+def test_hot_cache_fresh(tmp_path):
+    path = tmp_path / "a"
+    path.write_bytes(b"data")
+    cache = HotFileCache(1024, 1024)
+    cache.put_file("k", cached_file(path))
+    assert asyncio.run(cache.get("k")).body == b"data"
+    assert asyncio.run(cache.get("missing")) is None
+
+    # 源文件改变后不再命中，并从缓存中移除
+    path.write_bytes(b"changed")
+    assert asyncio.run(cache.get("k")) is None
+    assert len(cache) == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_hot_cache_expired(tmp_path):
+    path = tmp_path / "a"
+    path.write_bytes(b"data")
+    cache = HotFileCache(1024, 1024)
+    cache.put_file("k", cached_file(path, expires_at=time.time() - 1))
+    assert asyncio.run(cache.get("k")) is None
+
+
+def test_hot_cache_limits(tmp_path):
+    path = tmp_path / "a"
+    path.write_bytes(b"data")
+    cache = HotFileCache(10, 6)
+    cache.put_file("a", cached_file(path))
+    cache.put_file("b", cached_file(path))
+    cache.put_file("c", cached_file(path))
+    assert list(cache.data) == ["b", "c"] and cache.bytes == 8
+    cache.invalidate("a")
+    assert len(cache) == 0
+
+
+def test_record_access(tmp_path, monkeypatch):
+    path = tmp_path / "a"
+    path.write_bytes(b"data")
+    os.utime(path, (1000, 1000))
+    monkeypatch.setattr(maintenance, "_accessed", {})
+
+    async def access():
+        maintenance.record_access(str(path))
+        # 不等待线程池里的 utime
+        await asyncio.sleep(0.1)
+
+    asyncio.run(access())
+    assert os.stat(path).st_atime > 1000 and os.stat(path).st_mtime == 1000
+    # 同一文件在 ACCESS_RESOLUTION 内不再刷新
+    os.utime(path, (1000, 1000))
+    asyncio.run(access())
+    assert os.stat(path).st_atime == 1000
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from sserver import layout, migrate
+from sserver.layout import file_path, iter_files, locate, setup_layout, shard_path
+from sserver.model import FileRecord
+
+
+@pytest.fixture
+def sharded(monkeypatch):
+    monkeypatch.setattr(layout, "levels", 2)
+    monkeypatch.setattr(layout, "width", 2)
+
+
+def write(path, data=b"x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_setup_layout(monkeypatch):
+    monkeypatch.setattr(layout, "levels", 0)
+    monkeypatch.setattr(layout, "width", 2)
+    for levels, width in ((4, 2), (-1, 2), (1, 0), (1, 5)):
+        with pytest.raises(ValueError):
+            setup_layout(levels, width)
+    setup_layout(3, 1)
+    assert (layout.levels, layout.width) == (3, 1)
+
+
+def test_shard_path(tmp_path, sharded):
+    path = shard_path(str(tmp_path), "01ABC")
+    parts = os.path.relpath(path, tmp_path).split(os.sep)
+    assert len(parts) == 3 and parts[2] == "01ABC"
+    assert all(len(it) == 2 and int(it, 16) >= 0 for it in parts[:2])
+    assert shard_path(str(tmp_path), "01ABC") == path
+
+
+def test_file_path_falls_back_to_flat(tmp_path, sharded):
+    upload_dir = str(tmp_path)
+    flat, sharded_path = os.path.join(upload_dir, "a"), shard_path(upload_dir, "a")
+    # 都不存在时是新文件应该写入的位置
+    assert file_path(upload_dir, "a") == sharded_path
+    write(flat)
+    assert file_path(upload_dir, "a") == flat
+    # 迁移建好链接之后优先新位置
+    os.makedirs(os.path.dirname(sharded_path))
+    os.link(flat, sharded_path)
+    assert file_path(upload_dir, "a") == sharded_path
+    os.remove(flat)
+    assert locate(upload_dir, "a")[0] == sharded_path
+    with pytest.raises(FileNotFoundError):
+        locate(upload_dir, "b")
+
+
+def test_file_path_flat_layout(tmp_path, monkeypatch):
+    monkeypatch.setattr(layout, "levels", 0)
+    assert file_path(str(tmp_path), "a") == os.path.join(str(tmp_path), "a")
+
+
+def test_iter_files(tmp_path, sharded):
+    upload_dir = str(tmp_path)
+    write(os.path.join(upload_dir, "flat"))
+    write(shard_path(upload_dir, "deep"))
+    write(os.path.join(upload_dir, ".blobs", "ab", "cd", "blob"))
+    write(os.path.join(upload_dir, "notshard", "x"))
+    assert sorted(it.name for it in iter_files(upload_dir)) == ["deep", "flat"]
+
+
+def test_migrate_is_resumable(tmp_path, sharded, run_with_db, monkeypatch):
+    """迁移中断后重新执行，从剩下的平铺文件继续，已经建好链接的文件也能完成"""
+    upload_dir = tmp_path / "upload"
+    ids = [f"id{i}" for i in range(6)]
+    for id_ in ids + ["unknown"]:
+        write(os.path.join(upload_dir, id_), id_.encode())
+    # 上次在建链接之后中断
+    os.makedirs(os.path.dirname(shard_path(str(upload_dir), "id0")))
+    os.link(upload_dir / "id0", shard_path(str(upload_dir), "id0"))
+    # 目标位置已经有另一个文件
+    write(shard_path(str(upload_dir), "id5"), b"other")
+    monkeypatch.setattr("builtins.print", lambda *args, **kwargs: None)
+
+    move = migrate.move
+    calls = []
+
+    def interrupted(upload_dir, id_):
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        calls.append(id_)
+        return move(upload_dir, id_)
+
+    async def main():
+        await FileRecord.save_many([FileRecord(it, id=it) for it in ids])
+        monkeypatch.setattr(migrate, "move", interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            await migrate.migrate(str(upload_dir), batch=2, pause=0)
+        monkeypatch.setattr(migrate, "move", move)
+        assert (await migrate.migrate(str(upload_dir), batch=2, pause=0, dry_run=True))["moved"] == 4
+        stats = await migrate.migrate(str(upload_dir), batch=2, pause=0)
+        assert (stats["moved"], stats["conflict"], stats["unknown"]) == (3, 1, 1)
+        # 再执行一次没有可移动的文件
+        stats = await migrate.migrate(str(upload_dir), batch=2, pause=0)
+        assert (stats["moved"], stats["conflict"], stats["passes"]) == (0, 1, 1)
+
+    run_with_db(main)
+    for id_ in ids[:5]:
+        assert file_path(str(upload_dir), id_) == shard_path(str(upload_dir), id_)
+        assert open(file_path(str(upload_dir), id_), "rb").read() == id_.encode()
+    assert sorted(it.name for it in upload_dir.iterdir() if it.is_file()) == ["id5", "unknown"]
+    assert file_path(str(upload_dir), "id5") == shard_path(str(upload_dir), "id5")
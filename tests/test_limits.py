@@ -0,0 +1,123 @@
+import asyncio
+import os
+
+import pytest
+
+from sserver import limits as limits_module
+from sserver.limits import Limits, Overloaded, parse_rate
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_limits(**kwargs) -> Limits:
+    return Limits(*Limits.create(), **kwargs)
+
+
+def test_parse_rate():
+    assert parse_rate("10M") == 10 * 1024**2
+    assert parse_rate("512k") == 512 * 1024
+    assert parse_rate("1.5MiB") == int(1.5 * 1024**2)
+    assert parse_rate(None) == 0 and parse_rate("2048") == 2048
+
+
+def test_token_bucket_refill(monkeypatch):
+    """桶容量为一秒的量，取空后按速率补充，超取的部分记为欠账"""
+    clock = Clock()
+    monkeypatch.setattr(limits_module.time, "monotonic", clock)
+    limits = make_limits(rate=1000)
+    # 初始的桶是空的，上次补充时间为 0，第一次取时按经过的时间补满
+    assert limits.reserve(0, 600, 1000) == 0
+    assert limits.reserve(0, 400, 1000) == 0
+    assert limits.reserve(0, 500, 1000) == pytest.approx(0.5)
+    # 过了 0.5 秒还清欠账，桶又是空的
+    clock.now += 0.5
+    assert limits.reserve(0, 100, 1000) == pytest.approx(0.1)
+    # 空闲再久也只补满一秒的量
+    clock.now += 10
+    assert limits.reserve(0, 1000, 1000) == 0
+    assert limits.reserve(0, 1, 1000) == pytest.approx(0.001)
+    assert limits.reserve(0, 10**9, 0) == 0
+
+
+def test_ip_bucket_is_separate(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(limits_module.time, "monotonic", clock)
+    limits = make_limits(rate=10**6, ip_rate=100)
+    a, b = limits.ip_slot("10.0.0.1"), limits.ip_slot("10.0.0.2")
+    assert a != b
+    slept = []
+
+    async def sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(limits_module.asyncio, "sleep", sleep)
+    asyncio.run(limits.take(a, 100))
+    asyncio.run(limits.take(a, 50))
+    asyncio.run(limits.take(b, 100))
+    assert slept == [pytest.approx(0.5)]
+
+
+def test_concurrency_limits():
+    limits = make_limits(max_streams=3, ip_max_streams=2, queue_timeout=0)
+
+    async def main():
+        first = await limits.admit("10.0.0.1")
+        second = await limits.admit("10.0.0.1")
+        with pytest.raises(Overloaded) as e:
+            await limits.admit("10.0.0.1")
+        assert e.value.retry_after == 5 and e.value.headers["Retry-After"] == "5"
+        third = await limits.admit("10.0.0.2")
+        with pytest.raises(Overloaded):
+            await limits.admit("10.0.0.3")
+        index = first.index
+        first.release()
+        first.release()
+        assert (await limits.admit("10.0.0.3")).index == index
+        third.release()
+        second.release()
+
+    asyncio.run(main())
+
+
+def test_queue_until_released():
+    limits = make_limits(max_streams=1, queue_timeout=2)
+
+    async def main():
+        lease = await limits.admit("a")
+        asyncio.get_running_loop().call_later(0.05, lease.release)
+        assert (await limits.admit("b")).index == 0
+
+    asyncio.run(main())
+
+
+def test_reclaim_dead_worker_lease():
+    limits = make_limits(max_streams=1, queue_timeout=0)
+    pid = os.fork()
+    if not pid:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    # 退出的 worker 没有释放的租约
+    assert limits.try_acquire(1, pid) == 0
+    assert limits.try_acquire(2, os.getpid()) == 0
+    assert limits.try_acquire(3, os.getpid()) is None
+
+
+def test_overloaded_response(make_client):
+    client = make_client(MAX_STREAMS=1, QUEUE_TIMEOUT=0, RETRY_AFTER=7)
+    limits = client.app.ctx.limits
+    lease = client.run(limits.admit("other"))
+    body = b"--b\r\nContent-Disposition: form-data; name=file; filename=a.txt\r\n\r\nhello\r\n--b--\r\n"
+    headers = {"content-type": "multipart/form-data; boundary=b"}
+
+    res = client.post("/upload", body=body, headers=headers)
+    assert res.status == 503 and res.headers["retry-after"] == "7"
+    assert res.json()["code"] == -503
+
+    lease.release()
+    assert client.post("/upload", body=body, headers=headers).status == 200
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import time
+
+from dserver import listing as listing_module
+from dserver.listing import Entry, Listing, ListingCache, scan
+
+
+def age(path, seconds):
+    os.utime(path, (time.time() - seconds, time.time() - seconds))
+
+
+def make_tree(root):
+    for name, size in (("b.txt", 30), ("A.txt", 10), ("c.txt", 10)):
+        (root / name).write_bytes(b"x" * size)
+    (root / "sub").mkdir()
+    for i, name in enumerate(("b.txt", "A.txt", "c.txt", "sub")):
+        age(root / name, 100 - i)
+    age(root, 100)
+
+
+def test_scan_skips_dangling_links(tmp_path):
+    make_tree(tmp_path)
+    os.symlink(tmp_path / "missing", tmp_path / "dangling")
+    entries = {it.name: it for it in scan(str(tmp_path))}
+    assert sorted(entries) == ["A.txt", "b.txt", "c.txt", "sub"]
+    assert entries["sub"] == Entry("sub", True, 0, entries["sub"].mtime)
+    assert entries["b.txt"].size == 30 and not entries["b.txt"].is_dir
+
+
+def test_sorted_views_and_pages(tmp_path):
+    make_tree(tmp_path)
+    listing = Listing(str(tmp_path), 0, scan(str(tmp_path)))
+    names = lambda entries: [it.name for it in entries]
+    assert names(listing.sorted()) == ["A.txt", "b.txt", "c.txt", "sub"]
+    assert names(listing.sorted("name", True)) == ["sub", "c.txt", "b.txt", "A.txt"]
+    # 同样大小的按名字排
+    assert names(listing.sorted("size")) == ["sub", "A.txt", "c.txt", "b.txt"]
+    assert names(listing.sorted("mtime", True)) == ["sub", "c.txt", "A.txt", "b.txt"]
+    assert listing.sorted("size") is listing.sorted("size")
+    assert names(listing.page("name", False, 2, 3)) == ["sub"]
+    assert names(listing.page("name", False, 3, 3)) == []
+    assert len(listing.page(size=0)) == len(listing) == 4
+
+
+def test_listing_cache(tmp_path, monkeypatch):
+    """mtime 不变且未超过 ttl 时复用，目录有增删或超过 ttl 时重新扫描"""
+    make_tree(tmp_path)
+    scans = []
+
+    def counted(path):
+        scans.append(path)
+        return scan(path)
+
+    monkeypatch.setattr(listing_module, "scan", counted)
+    cache = ListingCache(ttl=60)
+    first = asyncio.run(cache.listing(str(tmp_path)))
+    assert asyncio.run(cache.listing(str(tmp_path))) is first and len(scans) == 1
+
+    (tmp_path / "d.txt").write_bytes(b"x")
+    age(tmp_path, 50)
+    second = asyncio.run(cache.listing(str(tmp_path)))
+    assert len(second) == 5 and len(scans) == 2
+
+    now = time.monotonic()
+    monkeypatch.setattr(listing_module.time, "monotonic", lambda: now + 61)
+    assert asyncio.run(cache.listing(str(tmp_path))) is not second and len(scans) == 3
+
+
+def test_recently_modified_dir_not_cached(tmp_path):
+    make_tree(tmp_path)
+    (tmp_path / "new.txt").write_bytes(b"x")
+    cache = ListingCache()
+    first = asyncio.run(cache.listing(str(tmp_path)))
+    assert asyncio.run(cache.listing(str(tmp_path))) is not first
+    assert cache.get(str(tmp_path)) is None
+
+
+def test_list_route(make_dserver, tmp_path):
+    make_tree(tmp_path / "root")
+    client = make_dserver()
+    data = client.get("/?format=json&sort=size&order=desc&size=2&page=1").json()["data"]
+    assert (data["path"], data["total"], data["page"], data["size"]) == ("/", 4, 1, 2)
+    assert [it["name"] for it in data["entries"]] == ["b.txt", "A.txt"]
+    assert client.get("/sub/?format=json").json()["data"] == {
+        "path": "/sub",
+        "total": 0,
+        "page": 1,
+        "size": 1000,
+        "entries": [],
+    }
+    res = client.get("/?size=2&page=2&sort=mtime")
+    assert res.status == 200 and "&laquo; 1" in res.body.decode()
+    assert client.get("/?page=x").status == 400
@@ -0,0 +1,151 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from sserver.cluster import PeerCache
+from sserver.compress import PrecompressedCache
+from sserver.maintenance import Maintenance, disk_usage, parse_ttl
+from sserver.model import FileRecord
+
+NOW = time.time()
+
+
+@pytest.fixture
+def upload_dir(tmp_path):
+    path = tmp_path / "upload"
+    path.mkdir()
+    return path
+
+
+def add_file(upload_dir, name, size, age=0, record=True, **fields):
+    """写入一个文件并把 atime / mtime 设为 age 秒前，返回对应的记录"""
+    path = os.path.join(upload_dir, name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (NOW - age, NOW - age))
+    return FileRecord(name, id=name, size=size, **fields) if record else None
+
+
+def maintenance(upload_dir, **kwargs):
+    return Maintenance(str(upload_dir), pause=0, **kwargs)
+
+
+async def ids():
+    return sorted(it.id for it in await FileRecord.scan())
+
+
+def test_parse_ttl():
+    assert parse_ttl(None) is None and parse_ttl("", 0) is None
+    assert parse_ttl("60") > datetime.now() + timedelta(seconds=50)
+    assert parse_ttl(None, 60) is not None
+    with pytest.raises(ValueError):
+        parse_ttl("-1")
+
+
+@pytest.mark.parametrize("policy, expected", [("lru", ["a", "d", "old", "p"]), ("oldest", ["c", "d", "old", "p"])])
+def test_quota_eviction_order(upload_dir, run_with_db, policy, expected):
+    """超过配额按 atime（lru）或 mtime（oldest）从旧到新淘汰，跳过 protected 和没有记录的文件"""
+    records = [
+        add_file(upload_dir, "p", 100, age=5000, protected=True),
+        add_file(upload_dir, "a", 100, age=4000),
+        add_file(upload_dir, "b", 100, age=3000),
+        add_file(upload_dir, "c", 100, age=2000),
+        add_file(upload_dir, "d", 100, age=1000),
+    ]
+    add_file(upload_dir, "old", 100, age=9000, record=False)
+    # a 最近被下载过
+    os.utime(upload_dir / "a", (NOW, NOW - 4000))
+
+    async def main():
+        await FileRecord.save_many(records)
+        deleted = []
+        gc = maintenance(upload_dir, quota=450, low_watermark=0.9, policy=policy, on_delete=deleted.append)
+        assert await gc.enforce_quota() == (2, 200)
+        assert len(deleted) == 2
+        assert await ids() == [it for it in expected if it != "old"]
+        # 降到 quota 以下之后不再淘汰
+        assert await gc.enforce_quota() == (0, 0)
+
+    run_with_db(main)
+    assert sorted(os.listdir(upload_dir)) == expected
+
+
+def test_purge_records(upload_dir, run_with_db):
+    old = datetime.now() - timedelta(hours=1)
+    records = [
+        add_file(upload_dir, "live", 10),
+        add_file(upload_dir, "expired", 10, expires_at=datetime.now() - timedelta(seconds=1)),
+        add_file(upload_dir, "kept", 10, protected=True, expires_at=datetime.now() - timedelta(seconds=1)),
+        FileRecord("dangling", id="dangling", created_at=old, node="n1"),
+        # 刚创建的记录文件可能还没落盘
+        FileRecord("fresh", id="fresh", node="n1"),
+        # 其他节点的文件本地本来就没有
+        FileRecord("remote", id="remote", created_at=old, node="n2"),
+    ]
+
+    async def main():
+        await FileRecord.save_many(records)
+        stats = await maintenance(upload_dir, node="n1").purge_records()
+        assert stats == {"expired": (1, 10), "dangling": (1, 0)}
+        assert await ids() == ["fresh", "kept", "live", "remote"]
+
+    run_with_db(main)
+    assert not (upload_dir / "expired").exists() and (upload_dir / "kept").exists()
+
+
+def make_caches(upload_dir):
+    compressed = PrecompressedCache(str(upload_dir / ".compressed"))
+    peer_cache = PeerCache(str(upload_dir / ".peer-cache"), 10**9)
+    os.makedirs(os.path.join(compressed.cache_dir, "gzip"))
+    os.makedirs(peer_cache.cache_dir)
+    # 每个缓存里一个很久没访问的文件、一个刚访问过的文件和一个遗留的临时文件，各 100 字节
+    for directory, names in (
+        (os.path.join(compressed.cache_dir, "gzip"), ["v1", "v2", ".v3.tmp"]),
+        (peer_cache.cache_dir, ["p1", "p2", ".tmp-1"]),
+    ):
+        for name, age in zip(names, [10 * 86400, 60, 10 * 86400]):
+            add_file(directory, name, 100, age=age, record=False)
+    return compressed, peer_cache
+
+
+def test_sweep_caches(upload_dir, run_with_db):
+    """压缩版本和读穿缓存中长时间没有访问的文件、遗留的临时文件由每轮维护清理"""
+    caches = make_caches(upload_dir)
+
+    async def main():
+        stats = await maintenance(upload_dir, caches=caches, cache_age=86400).collect()
+        assert stats["cache"] == (4, 400)
+
+    run_with_db(main)
+    assert os.listdir(upload_dir / ".compressed" / "gzip") == ["v2"]
+    assert os.listdir(upload_dir / ".peer-cache") == ["p2"]
+
+
+def test_quota_counts_caches(upload_dir, run_with_db):
+    """缓存计入配额，超出时先缩减缓存再淘汰文件"""
+    records = [add_file(upload_dir, "a", 100, age=100)]
+    caches = make_caches(upload_dir)
+
+    async def main():
+        await FileRecord.save_many(records)
+        assert (await maintenance(upload_dir, quota=1000).enforce_quota()) == (0, 0)
+        # 共 700 字节，需要释放 300：压缩版本全部删除，读穿缓存删掉最久没有访问的一个，还在写入的临时文件不动
+        gc = maintenance(upload_dir, quota=400, low_watermark=1, caches=caches, cache_age=30 * 86400)
+        assert await gc.enforce_quota() == (3, 300)
+        assert await ids() == ["a"]
+
+    run_with_db(main)
+    assert (upload_dir / "a").exists()
+    assert os.listdir(upload_dir / ".compressed" / "gzip") == [".v3.tmp"]
+    assert sorted(os.listdir(upload_dir / ".peer-cache")) == [".tmp-1", "p2"]
+
+
+def test_disk_usage_counts_shared_blob_once(upload_dir):
+    add_file(upload_dir, "a", 100, age=10)
+    os.link(upload_dir / "a", upload_dir / "b")
+    add_file(upload_dir, ".hidden", 7, record=False)
+    total, files = disk_usage(str(upload_dir), "oldest")
+    assert total == 107
+    assert [name for _, name, _ in files] == ["a", "b"]
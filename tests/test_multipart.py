@@ -0,0 +1,74 @@
+import pytest
+
+from sserver.stream import DATA, END, PART, MultipartError, MultipartParser
+
+BOUNDARY = "----sserver-boundary"
+
+
+def build(parts, boundary=BOUNDARY):
+    body = b"preamble\r\n"
+    for name, filename, data in parts:
+        body += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode() + data + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode()
+
+
+def parse(body: bytes, step: int, boundary=BOUNDARY):
+    """按 step 字节切片喂给解析器，返回 [(headers, 数据)]"""
+    parser = MultipartParser(boundary)
+    parts, current = [], None
+    for i in range(0, len(body), step):
+        for event, value in parser.feed(body[i : i + step]):
+            if event == PART:
+                current = [value, b""]
+            elif event == DATA:
+                current[1] += value
+            elif event == END:
+                parts.append(tuple(current))
+                current = None
+    parser.close()
+    return parts
+
+
+PARTS = [
+    ("file", "a.txt", b"hello world"),
+    ("file", "empty.bin", b""),
+    # 数据里出现分隔符的前缀和 CRLF，不能被误认为边界
+    ("file", "tricky.bin", b"\r\n--" + BOUNDARY[:-1].encode() + b"\r\n-- x" * 100),
+    ("file", "big.bin", bytes(range(256)) * 1000),
+]
+
+
+@pytest.mark.parametrize("step", [1, 7, 64, 4096, 1 << 20])
+def test_round_trip(step):
+    parts = parse(build(PARTS), step)
+    assert [data for _, data in parts] == [data for _, _, data in PARTS]
+    headers = parts[0][0]
+    assert headers["content-disposition"] == 'form-data; name="file"; filename="a.txt"'
+    assert headers["content-type"] == "application/octet-stream"
+
+
+def test_from_content_type():
+    parser = MultipartParser.from_content_type(f'multipart/form-data; boundary="{BOUNDARY}"')
+    assert parser.delimiter == b"\r\n--" + BOUNDARY.encode()
+    with pytest.raises(MultipartError):
+        MultipartParser.from_content_type("application/json")
+    with pytest.raises(MultipartError):
+        MultipartParser.from_content_type("multipart/form-data")
+
+
+@pytest.mark.parametrize("cut", [5, 60, 150, -10, -3])
+def test_truncated(cut):
+    body = build(PARTS[:1])
+    with pytest.raises(MultipartError):
+        parse(body[:cut], 16)
+
+
+def test_headers_too_large():
+    body = f"--{BOUNDARY}\r\nX-Long: ".encode() + b"a" * 20000
+    parser = MultipartParser(BOUNDARY)
+    with pytest.raises(MultipartError):
+        list(parser.feed(body))
@@ -0,0 +1,50 @@
+import pytest
+
+from sserver.download import MAX_RANGES, RangeNotSatisfiable, parse_range
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", [(0, 99)]),
+        ("bytes=100-", [(100, 999)]),
+        ("bytes=-100", [(900, 999)]),
+        ("bytes=-5000", [(0, 999)]),
+        ("bytes=900-5000", [(900, 999)]),
+        ("BYTES= 0-0 , 999-", [(0, 0), (999, 999)]),
+        # 重叠和相邻的区间合并，结果按起点排序
+        ("bytes=500-599,0-9,10-19,550-700", [(0, 19), (500, 700)]),
+        # 超出文件的区间丢弃，其余照常返回
+        ("bytes=0-9,2000-3000", [(0, 9)]),
+    ],
+)
+def test_ranges(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize(
+    "header",
+    [None, "", "items=0-1", "bytes=", "bytes=abc", "bytes=5", "bytes=-", "bytes=5-1", "bytes=a-5", "bytes=1-b"],
+)
+def test_ignored(header):
+    assert parse_range(header, 1000) is None
+
+
+def test_too_many_ranges():
+    header = "bytes=" + ",".join(f"{i * 10}-{i * 10}" for i in range(MAX_RANGES + 1))
+    assert parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize(
+    "header, size",
+    [("bytes=1000-", 1000), ("bytes=-0", 1000), ("bytes=0-", 0), ("bytes=-10", 0), ("bytes=5-9,-0", 5)],
+)
+def test_not_satisfiable(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, size)
+
+
+def test_round_trip():
+    data = bytes(range(256)) * 4
+    ranges = parse_range("bytes=-10,0-3,100-199", len(data))
+    assert b"".join(data[first : last + 1] for first, last in ranges) == data[:4] + data[100:200] + data[-10:]
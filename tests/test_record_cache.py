@@ -0,0 +1,138 @@
+import asyncio
+import multiprocessing
+
+from sserver import cache, model
+from sserver.cache import MISSING, InvalidationLog, RecordCache
+from sserver.model import FileRecord
+from sserver.store import SQLiteStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_and_negative_cache(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    records = RecordCache(100, ttl=60, negative_ttl=5)
+
+    assert records.lookup("a") is MISSING
+    records.store("a", {"id": "a"})
+    records.store("missing", None)
+    assert records.lookup("a") == {"id": "a"}
+    # 负缓存命中返回 None，和未命中的 MISSING 区分开
+    assert records.lookup("missing") is None
+    assert records.negative_hits == 1
+
+    # 不存在的记录过期得更快
+    clock.now += 10
+    assert records.lookup("missing") is MISSING
+    assert records.lookup("a") == {"id": "a"}
+    clock.now += 60
+    assert records.lookup("a") is MISSING
+    assert records.stats()["expired"] == 2 and records.stats()["hits"] == 3
+
+
+def test_invalidation_across_workers():
+    """一个 worker 的失效通过共享内存传给其他 worker"""
+    log = InvalidationLog.create()
+    first, second = RecordCache(100, 60, 5, InvalidationLog(*log)), RecordCache(100, 60, 5, InvalidationLog(*log))
+    for records in (first, second):
+        records.store("a", "A")
+        records.store("b", "B")
+
+    first.invalidate("a")
+    assert first.lookup("a") is MISSING
+    assert second.lookup("a") is MISSING
+    assert second.lookup("b") == "B"
+
+
+def publish_from_child(log, key):
+    InvalidationLog(*log).publish(key)
+
+
+def test_invalidation_from_other_process():
+    log = InvalidationLog.create()
+    records = RecordCache(100, 60, 5, InvalidationLog(*log))
+    records.store("a", "A")
+    records.store("b", "B")
+
+    proc = multiprocessing.get_context("fork").Process(target=publish_from_child, args=(log, "b"))
+    proc.start()
+    proc.join()
+    assert proc.exitcode == 0
+    assert records.lookup("b") is MISSING
+    assert records.lookup("a") == "A"
+
+
+def test_lost_events_clear_cache():
+    log = InvalidationLog(*InvalidationLog.create())
+    records = RecordCache(100, 60, 5, log)
+    records.store("a", "A")
+    # 落后超过一圈时无法知道丢了哪些 key，只能整体清空
+    for i in range(InvalidationLog.SLOTS + 1):
+        log.publish(f"other{i}")
+    assert records.lookup("a") is MISSING
+    assert records.seen == log.seq.value
+
+    # 被截断的 key 无法精确失效
+    records.store("a", "A")
+    log.publish("x" * InvalidationLog.WIDTH)
+    assert records.lookup("a") is MISSING
+
+
+def test_store_skips_key_invalidated_during_query():
+    log = InvalidationLog(*InvalidationLog.create())
+    records = RecordCache(100, 60, 5, log)
+    version = records.version
+    # 查库期间别的 worker 改了这条记录，查到的旧值不能写进缓存
+    log.publish("a")
+    records.store("a", "old", version)
+    assert records.lookup("a") is MISSING
+
+    version = records.version
+    log.publish("b")
+    records.store("a", "new", version)
+    assert records.lookup("a") == "new"
+
+
+def test_file_record_get_uses_cache(tmp_path, monkeypatch):
+    async def run():
+        store = SQLiteStore(str(tmp_path / "meta.db"))
+        store.register(FileRecord.table, FileRecord)
+        await store.connect()
+        calls = []
+        get = store.get
+
+        async def counted(table, id_):
+            calls.append(id_)
+            return await get(table, id_)
+
+        monkeypatch.setattr(store, "get", counted)
+        monkeypatch.setattr(model, "db", store)
+        monkeypatch.setattr(model, "record_cache", None)
+        model.setup_record_cache(100, 60, 5)
+        try:
+            record = FileRecord(filename="a.txt", size=3)
+            await record.save()
+            assert (await FileRecord.get(record.id)).filename == "a.txt"
+            # 返回的是副本，调用方修改不影响缓存
+            (await FileRecord.get(record.id)).filename = "changed"
+            assert (await FileRecord.get(record.id)).filename == "a.txt"
+            assert await FileRecord.get("nope") is None
+            assert await FileRecord.get("nope") is None
+            assert calls == [record.id, "nope"]
+
+            await record.update(filename="b.txt")
+            assert (await FileRecord.get(record.id)).filename == "b.txt"
+            await record.delete()
+            assert await FileRecord.get(record.id) is None
+            assert calls == [record.id, "nope", record.id, record.id]
+        finally:
+            await store.close()
+
+    asyncio.run(run())
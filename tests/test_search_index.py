@@ -0,0 +1,126 @@
+import os
+
+import pytest
+
+from dserver import search as search_module
+from dserver.search import TreeIndex
+
+FILES = [
+    "docs/Report_2024.pdf",
+    "docs/annual-report.txt",
+    "docs/old/reportage.doc",
+    "photos/my photo.png",
+    "photos/ab.jpg",
+    "readme.md",
+]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "root"
+    for it in FILES:
+        path = root / it
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x")
+    return root
+
+
+def build(root, **kwargs) -> TreeIndex:
+    index = TreeIndex(str(root), **kwargs)
+    index.refresh()
+    return index
+
+
+def paths(index, query, mode="substring", offset=0, limit=100):
+    found, _ = index.search(query, mode, offset, limit)
+    return sorted(path for path, _ in found)
+
+
+def test_search_modes(tree):
+    index = build(tree)
+    assert index.ready and len(index) == len(FILES) + 3
+    assert paths(index, "report") == ["docs/Report_2024.pdf", "docs/annual-report.txt", "docs/old/reportage.doc"]
+    assert paths(index, "rep", "prefix") == ["docs/Report_2024.pdf", "docs/old/reportage.doc"]
+    assert paths(index, "2024 rep", "token") == ["docs/Report_2024.pdf"]
+    assert paths(index, "port", "token") == []
+    assert paths(index, "OLD") == ["docs/old"]
+    # 不足三个字符：前缀走 heads，子串和词扫描全表
+    assert paths(index, "ph", "prefix") == ["photos"]
+    assert paths(index, "ab") == ["photos/ab.jpg"]
+    assert paths(index, "a", "token") == ["docs/annual-report.txt", "photos/ab.jpg"]
+    found, has_next = index.search("o", limit=3)
+    assert len(found) == 3 and has_next
+    assert dict(index.search("docs", "prefix")[0]) == {"docs": True}
+
+
+def test_short_query_scans_in_batches(tree, monkeypatch):
+    """分段扫描与一次扫完的结果和分页一致，中途重新编号时从头再来"""
+    index = build(tree)
+    expected = [index.search("o", offset=i, limit=1)[0] for i in range(20)]
+    monkeypatch.setattr(search_module, "SCAN_BATCH", 2)
+    assert [index.search("o", offset=i, limit=1)[0] for i in range(20)] == expected
+    assert index.search("o", limit=100) == index.search("o", limit=100)
+
+    index.remove(next(it for it in index.dirs[0][1] if index.names[it] == "readme.md"))
+    match, calls = index.match, []
+
+    def compacting(*args):
+        ret = match(*args)
+        if not calls:
+            index.compact()
+        calls.append(args)
+        return ret
+
+    monkeypatch.setattr(index, "match", compacting)
+    found, has_next = index.search("e", limit=100)
+    assert index.generation == 1 and not has_next
+    assert sorted(path for path, _ in found) == [
+        "docs/Report_2024.pdf",
+        "docs/annual-report.txt",
+        "docs/old/reportage.doc",
+    ]
+
+
+def test_incremental_refresh(tree):
+    index = build(tree)
+    (tree / "docs" / "old" / "reportage.doc").unlink()
+    (tree / "photos" / "report-cover.png").write_bytes(b"x")
+    # 目录 mtime 刚变化，下次刷新一定重新读取
+    assert index.refresh() >= 2
+    assert paths(index, "report") == ["docs/Report_2024.pdf", "docs/annual-report.txt", "photos/report-cover.png"]
+    assert index.dead == 1
+    index.compact()
+    assert index.dead == 0 and paths(index, "cover") == ["photos/report-cover.png"]
+
+
+def test_refresh_path(tree):
+    index = build(tree)
+    (tree / "docs" / "old" / "new-report.txt").write_bytes(b"x")
+    assert index.refresh_path(str(tree / "docs" / "old" / "new-report.txt"))
+    assert "docs/old/new-report.txt" in paths(index, "new-rep")
+    assert not index.refresh_path(str(tree / "missing" / "a.txt"))
+
+
+def test_save_and_load(tree, tmp_path, monkeypatch):
+    index = build(tree, index_path=str(tmp_path / "index.idx"))
+    dumps = search_module.pickle.dumps
+
+    def unlocked_dumps(*args, **kwargs):
+        # 序列化在锁外进行，不阻塞查询和刷新
+        assert not index.lock.locked()
+        return dumps(*args, **kwargs)
+
+    monkeypatch.setattr(search_module.pickle, "dumps", unlocked_dumps)
+    index.save()
+    loaded = TreeIndex(str(tree), str(tmp_path / "index.idx"))
+    assert loaded.load() and loaded.ready and loaded.generation == 1
+    assert paths(loaded, "report") == paths(index, "report")
+    assert paths(loaded, "a", "token") == paths(index, "a", "token")
+    # 加载后的索引继续增量刷新
+    (tree / "readme.md").unlink()
+    loaded.refresh()
+    assert paths(loaded, "readme") == []
+    # 其他目录的索引不加载
+    assert not TreeIndex(str(tree / "docs"), str(tmp_path / "index.idx")).load()
+    os.remove(tmp_path / "index.idx")
+    assert not loaded.load()
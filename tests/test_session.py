@@ -0,0 +1,206 @@
+import asyncio
+import errno
+import os
+
+import pytest
+
+from sserver import session as session_module
+from sserver.session import InsufficientStorage, SessionError, SessionGone, UploadSession
+
+DATA = bytes(range(256)) * 40 + b"tail"
+
+
+async def chunks(data: bytes, step: int = 1000):
+    for i in range(0, len(data), step):
+        yield data[i : i + step]
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def new_session(upload_dir, size=len(DATA), chunk_size=4096, **kwargs):
+    return await UploadSession.create(str(upload_dir), "a.bin", size, chunk_size, **kwargs)
+
+
+async def upload(s: UploadSession, order):
+    for i in order:
+        offset, length = s.chunk_range(i)
+        assert await s.write_chunk(i, chunks(DATA[offset : offset + length])) == length
+
+
+def test_create_and_load(tmp_path):
+    async def main():
+        s = await new_session(tmp_path, node="n1")
+        assert s.id.endswith(".n1") and s.file_id == s.id.partition(".")[0]
+        assert s.chunks == 3
+        # 目标文件按总大小预分配
+        assert os.path.getsize(s.part_path) == len(DATA)
+        loaded = await UploadSession.load(str(tmp_path), s.id)
+        assert loaded.json(await loaded.missing()) == s.json([0, 1, 2])
+        assert await UploadSession.load(str(tmp_path), "../etc/passwd") is None
+        assert await UploadSession.load(str(tmp_path), "0" * 26) is None
+
+    run(main())
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{"size": -1}, {"chunk_size": -1}, {"chunk_size": session_module.MAX_CHUNK_SIZE + 1}, {"ttl": -1}],
+)
+def test_create_invalid(tmp_path, kwargs):
+    with pytest.raises(SessionError):
+        run(new_session(tmp_path, **kwargs))
+
+
+def test_create_too_large(tmp_path):
+    with pytest.raises(SessionError):
+        run(new_session(tmp_path, max_size=len(DATA) - 1))
+    assert not (tmp_path / session_module.SESSION_DIR).exists()
+
+
+def test_preallocate_enospc(tmp_path, monkeypatch):
+    def fallocate(fd, offset, size):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(os, "posix_fallocate", fallocate)
+    with pytest.raises(InsufficientStorage):
+        run(new_session(tmp_path))
+    # 预分配失败时不留下文件
+    assert os.listdir(tmp_path / session_module.SESSION_DIR) == []
+
+
+def test_preallocate_unsupported(tmp_path, monkeypatch):
+    def fallocate(fd, offset, size):
+        raise OSError(errno.EOPNOTSUPP, "Operation not supported")
+
+    monkeypatch.setattr(os, "posix_fallocate", fallocate)
+    s = run(new_session(tmp_path))
+    assert os.path.getsize(s.part_path) == len(DATA)
+
+
+@pytest.mark.parametrize("order", [[0, 1, 2], [2, 0, 1], [1, 1, 2, 2, 0]])
+def test_out_of_order_and_duplicate(tmp_path, order):
+    async def main():
+        s = await new_session(tmp_path)
+        await upload(s, order[:-1])
+        assert await s.missing() == sorted({0, 1, 2} - set(order[:-1]))
+        with pytest.raises(SessionError):
+            await s.finalize()
+        await upload(s, order[-1:])
+        assert await s.missing() == []
+        path = await s.finalize()
+        assert open(path, "rb").read() == DATA
+        assert os.path.basename(path) == s.file_id
+        # 会话文件全部清理
+        assert os.listdir(s.session_dir) == []
+
+    run(main())
+
+
+def test_parallel_chunks(tmp_path):
+    async def main():
+        s = await new_session(tmp_path, chunk_size=1024)
+        await asyncio.gather(*[upload(s, [i]) for i in reversed(range(s.chunks))])
+        assert open(await s.finalize(), "rb").read() == DATA
+
+    run(main())
+
+
+def test_bad_chunk(tmp_path):
+    async def main():
+        s = await new_session(tmp_path)
+        with pytest.raises(SessionError):
+            await s.write_chunk(3, chunks(b""))
+        with pytest.raises(SessionError):
+            await s.write_chunk(0, chunks(DATA[:4097]))
+        # 不完整的分块不标记
+        with pytest.raises(SessionError):
+            await s.write_chunk(0, chunks(DATA[:100]))
+        # 最后一个分块只有剩余的长度
+        with pytest.raises(SessionError):
+            await s.write_chunk(2, chunks(DATA[:4096]))
+        assert await s.missing() == [0, 1, 2]
+
+    run(main())
+
+
+def test_empty_file(tmp_path):
+    async def main():
+        s = await new_session(tmp_path, size=0)
+        assert s.chunks == 0 and await s.missing() == []
+        assert open(await s.finalize(), "rb").read() == b""
+
+    run(main())
+
+
+def test_concurrent_finalize(tmp_path):
+    async def main():
+        s = await new_session(tmp_path)
+        await upload(s, [0, 1, 2])
+        other = await UploadSession.load(str(tmp_path), s.id)
+        results = await asyncio.gather(s.finalize(), other.finalize(), return_exceptions=True)
+        assert sum(isinstance(it, str) for it in results) == 1
+        assert sum(isinstance(it, SessionGone) for it in results) == 1
+        with pytest.raises(SessionGone):
+            await s.missing()
+        with pytest.raises(SessionGone):
+            await s.write_chunk(0, chunks(DATA[:4096]))
+        assert await UploadSession.load(str(tmp_path), s.id) is None
+
+    run(main())
+
+
+def test_abort(tmp_path):
+    async def main():
+        s = await new_session(tmp_path)
+        await upload(s, [1])
+        await s.abort()
+        assert os.listdir(s.session_dir) == []
+        assert await UploadSession.load(str(tmp_path), s.id) is None
+        with pytest.raises(SessionGone):
+            await s.finalize()
+        # 重复取消没有副作用
+        await s.abort()
+
+    run(main())
+
+
+def test_session_routes(make_client, monkeypatch):
+    client = make_client(REQUEST_MAX_SIZE=100000)
+    r = client.post("/upload/session", json={"filename": "a.bin", "size": len(DATA), "chunk_size": 4096})
+    assert r.status == 200
+    sid = r.json()["data"]["id"]
+    assert client.post("/upload/session", json={"filename": "a.bin", "size": 100001}).status == 400
+
+    assert client.request("PUT", f"/upload/session/{sid}/1", chunks=[DATA[4096:8192]]).status == 200
+    assert client.request("PUT", f"/upload/session/{sid}/0", chunks=[DATA[:5000]]).status == 400
+    assert client.get(f"/upload/session/{sid}").json()["data"]["missing"] == [0, 2]
+    r = client.post(f"/upload/session/{sid}/finalize")
+    assert r.status == 409 and r.json()["data"] == [0, 2]
+
+    assert client.request("PUT", f"/upload/session/{sid}/0", chunks=[DATA[:4096]]).status == 200
+    assert client.request("PUT", f"/upload/session/{sid}/2", chunks=[DATA[8192:]]).status == 200
+    r = client.post(f"/upload/session/{sid}/finalize")
+    assert r.status == 200
+    file_id = r.body.decode()
+    assert client.get(f"/{file_id}").body == DATA
+
+    # 会话已经完成
+    assert client.post(f"/upload/session/{sid}/finalize").status == 404
+    assert client.get(f"/upload/session/{sid}").status == 404
+    assert client.request("PUT", f"/upload/session/{sid}/0", chunks=[DATA[:4096]]).status == 404
+
+    def fallocate(fd, offset, size):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(os, "posix_fallocate", fallocate)
+    assert client.post("/upload/session", json={"filename": "b", "size": 10}).status == 507
+
+
+def test_session_route_abort(make_client):
+    client = make_client()
+    sid = client.post("/upload/session", json={"filename": "a.bin", "size": 10}).json()["data"]["id"]
+    assert client.request("DELETE", f"/upload/session/{sid}").status == 200
+    assert client.get(f"/upload/session/{sid}").status == 404
+    assert client.post(f"/upload/session/{sid}/finalize").status == 404
@@ -0,0 +1,144 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+
+from sserver.model import FileRecord, MsgRecord
+from sserver.store import MongoStore, SQLiteStore, query_tokens, search_keys
+
+T0 = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def open_store(path):
+    store = SQLiteStore(str(path))
+    for cls in (FileRecord, MsgRecord):
+        store.register(cls.table, cls)
+    return store
+
+
+def run_with_store(path, func):
+    async def run():
+        store = open_store(path)
+        await store.connect()
+        try:
+            return await func(store)
+        finally:
+            await store.close()
+
+    return asyncio.run(run())
+
+
+def file_doc(id_, filename, created_at=T0):
+    return FileRecord(filename=filename, id=id_, created_at=created_at, size=1).__dict__
+
+
+def test_cursor_ordering(tmp_path):
+    """同一时间写入的记录按 id 排序，游标翻页既不漏也不重"""
+    docs = [file_doc(f"id{i:02d}", f"f{i}", T0 + timedelta(seconds=i // 4)) for i in range(20)]
+
+    async def check(store):
+        await store.insert_many("files", docs)
+        first = await store.list("files", size=100)
+        assert [it["id"] for it in first] == [f"id{i:02d}" for i in reversed(range(20))]
+        assert first[0]["created_at"] == T0 + timedelta(seconds=4)
+
+        seen, cursor = [], None
+        while page := await store.list("files", size=3, cursor=cursor):
+            seen += [it["id"] for it in page]
+            cursor = (page[-1]["created_at"], page[-1]["id"])
+        assert seen == [it["id"] for it in first]
+        assert [it["id"] for it in await store.list("files", page=2, size=5)] == seen[5:10]
+
+    run_with_store(tmp_path / "meta.db", check)
+
+
+def test_search_modes(tmp_path):
+    names = ["Report_2024.pdf", "annual-report.txt", "my photo.png", "reportage.doc", "ab.txt"]
+    docs = [file_doc(f"id{i}", name, T0 + timedelta(seconds=i)) for i, name in enumerate(names)]
+
+    async def check(store):
+        await store.insert_many("files", docs)
+
+        async def search(query, mode):
+            return [it["filename"] for it in await store.search("files", query, mode)]
+
+        # 子串走 trigram 索引，不区分大小写，结果按写入顺序倒序
+        assert await search("report", "substring") == ["reportage.doc", "annual-report.txt", "Report_2024.pdf"]
+        assert await search("port_2", "substring") == ["Report_2024.pdf"]
+        assert await search("report", "prefix") == ["reportage.doc", "Report_2024.pdf"]
+        # 按词前缀：下划线和标点是分隔符，每个查询词都要匹配
+        assert await search("2024 rep", "token") == ["Report_2024.pdf"]
+        assert await search("ann rep", "token") == ["annual-report.txt"]
+        assert await search("port", "token") == []
+        assert await search("_-", "token") == []
+        # LIKE 的通配符按字面匹配
+        assert await search("t_2", "substring") == ["Report_2024.pdf"]
+        assert await search("%", "substring") == []
+        # 不足三个字符时扫描主表
+        assert await search("ab", "prefix") == ["ab.txt"]
+        assert len(await search("o", "substring")) == 4
+        assert (await search("o", "substring"))[:2] == ["reportage.doc", "my photo.png"]
+        assert len(await store.search("files", "o", page=2, size=3)) == 1
+
+        # 更新和删除由触发器同步到两个索引
+        await store.update("files", "id1", {"filename": "summary.txt"})
+        await store.delete("files", "id3")
+        assert await search("report", "substring") == ["Report_2024.pdf"]
+        assert await search("summ", "token") == ["summary.txt"]
+
+    run_with_store(tmp_path / "meta.db", check)
+
+
+def test_fts_rebuild_when_stale(tmp_path):
+    """索引和主表对不上时，下次打开会重建"""
+    path = tmp_path / "meta.db"
+
+    async def fill(store):
+        await store.insert_many("files", [file_doc(f"id{i}", f"document{i}.txt") for i in range(5)])
+
+    run_with_store(path, fill)
+
+    conn = sqlite3.connect(str(path))
+    with conn:
+        conn.execute("DELETE FROM files_fts_docsize WHERE id > 2")
+        conn.execute("DELETE FROM files_words_docsize")
+    conn.close()
+
+    async def check(store):
+        assert await store.fts_stale("files", "files_fts") is False
+        assert await store.fts_stale("files", "files_words") is False
+        assert len(await store.search("files", "document", "substring")) == 5
+        assert len(await store.search("files", "document", "token")) == 5
+
+    run_with_store(path, check)
+
+
+def test_reopen_adds_columns(tmp_path):
+    """记录类新增字段后，已有的表自动补列，旧记录的新字段为空"""
+    path = tmp_path / "meta.db"
+    conn = sqlite3.connect(str(path))
+    with conn:
+        conn.execute("CREATE TABLE files (filename TEXT, id TEXT PRIMARY KEY, protected INTEGER, created_at TEXT)")
+        conn.execute("INSERT INTO files VALUES ('old.txt', 'old', 0, ?)", (T0.isoformat(sep=" "),))
+    conn.close()
+
+    async def check(store):
+        doc = await store.get("files", "old")
+        assert doc["filename"] == "old.txt" and doc["protected"] is False and doc["created_at"] == T0
+        assert doc["size"] is None and doc["expires_at"] is None
+        assert await store.find("files", {"size": None}) == [doc]
+        assert [it["id"] for it in await store.search("files", "old", "prefix")] == ["old"]
+
+    run_with_store(path, check)
+
+
+def test_mongo_search_keys():
+    assert query_tokens("My_Photo-2024.PNG") == ["my", "photo", "2024", "png"]
+    keys = search_keys("Ab_cd")
+    assert keys == {"_text": "ab_cd", "_words": ["ab", "cd"], "_grams": ["_cd", "ab_", "b_c"]}
+    assert search_keys(None) == {"_text": "", "_words": [], "_grams": []}
+
+    store = MongoStore("mongodb://localhost")
+    store.register(FileRecord.table, FileRecord)
+    # 只有带 text_field 的更新才重算搜索字段
+    assert store.with_search_keys("files", {"filename": "A b"})["_words"] == ["a", "b"]
+    assert store.with_search_keys("files", {"size": 3}) == {"size": 3}
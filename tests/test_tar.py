@@ -0,0 +1,135 @@
+import io
+import tarfile
+
+import pytest
+
+from sserver.stream import DATA, END, MAX_TAR_META_SIZE, PART, TarError, TarParser
+
+
+def build(entries, fmt=tarfile.PAX_FORMAT) -> bytes:
+    """entries 为 (TarInfo 参数, 数据)，数据为 None 的条目不带内容"""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=fmt) as tf:
+        for attrs, data in entries:
+            info = tarfile.TarInfo(attrs.pop("name"))
+            for k, v in attrs.items():
+                setattr(info, k, v)
+            if data is not None:
+                info.size = len(data)
+            tf.addfile(info, io.BytesIO(data) if data is not None else None)
+    return buf.getvalue()
+
+
+def parse(data: bytes, step: int = 512, parser=None):
+    parser = parser or TarParser()
+    files, current = [], None
+    for i in range(0, len(data), step):
+        for event, value in parser.feed(data[i : i + step]):
+            if event == PART:
+                current = [value["name"], value["size"], b""]
+            elif event == DATA:
+                current[2] += value
+            elif event == END:
+                files.append(tuple(current))
+    parser.close()
+    return files
+
+
+def header(name: str, type_: bytes, size: int, prefix: bytes = b"") -> bytes:
+    block = bytearray(512)
+    block[0 : len(name)] = name.encode()
+    block[124:136] = f"{size:011o}\0".encode()
+    block[156:157] = type_
+    block[257:263] = b"ustar\0"
+    block[263:265] = b"00"
+    block[148:156] = b" " * 8
+    block[148:156] = f"{sum(block):06o}\0 ".encode()
+    return bytes(block)
+
+
+def pax(records: bytes, size: int, name="a.txt") -> bytes:
+    """pax 扩展头加一个普通文件头，ustar 头里的大小为 size"""
+    meta = header("PaxHeader", b"x", len(records)) + records + b"\0" * (-len(records) % 512)
+    return meta + header(name, b"0", size)
+
+
+FILES = [
+    ("a.txt", b"hello world"),
+    ("empty.bin", b""),
+    ("sub/aligned.bin", bytes(range(256)) * 2),
+    ("sub/big.bin", bytes(range(251)) * 100),
+    ("sub/" + "x" * 150 + "/file.txt", b"long path"),
+    ("中文/名字.txt", "你好".encode()),
+]
+
+
+@pytest.mark.parametrize("fmt", [tarfile.USTAR_FORMAT, tarfile.GNU_FORMAT, tarfile.PAX_FORMAT])
+@pytest.mark.parametrize("step", [1, 100, 512, 65536])
+def test_round_trip(fmt, step):
+    files = FILES if fmt != tarfile.USTAR_FORMAT else [it for it in FILES if len(it[0]) < 100]
+    data = build([({"name": name}, content) for name, content in files], fmt)
+    assert parse(data, step) == [(name, len(content), content) for name, content in files]
+
+
+def test_long_names():
+    name = "d/" * 200 + "file.txt"
+    for fmt in (tarfile.GNU_FORMAT, tarfile.PAX_FORMAT):
+        assert parse(build([({"name": name}, b"x")], fmt)) == [(name, 1, b"x")]
+
+
+def test_skip_non_files():
+    data = build(
+        [
+            ({"name": "dir", "type": tarfile.DIRTYPE}, None),
+            ({"name": "link", "type": tarfile.SYMTYPE, "linkname": "a.txt"}, None),
+            ({"name": "d/" * 60 + "link", "type": tarfile.SYMTYPE, "linkname": "a.txt"}, None),
+            ({"name": "a.txt"}, b"data"),
+        ]
+    )
+    parser = TarParser()
+    assert parse(data, parser=parser) == [("a.txt", 4, b"data")]
+    assert parser.skipped == ["link", "d/" * 60 + "link"]
+
+
+def test_pax_size_overrides_header():
+    data = pax(b"10 size=5\n", 0) + b"hello" + b"\0" * 507 + b"\0" * 1024
+    assert parse(data) == [("a.txt", 5, b"hello")]
+
+
+def test_pax_path():
+    data = pax(b"16 path=b/c.txt\n", 3) + b"abc" + b"\0" * 509
+    assert parse(data) == [("b/c.txt", 3, b"abc")]
+
+
+@pytest.mark.parametrize(
+    "records", [b"0 a=b\n", b"1 a=b\n", b"99 a=b\n", b"x a=b\n", b"12 size=-1\n", b"12 size=zz\n"]
+)
+def test_invalid_pax(records):
+    with pytest.raises(TarError):
+        parse(pax(records, 0))
+
+
+@pytest.mark.parametrize("type_", [b"L", b"x"])
+def test_meta_too_large(type_):
+    with pytest.raises(TarError):
+        parse(header("././@LongLink", type_, MAX_TAR_META_SIZE + 1))
+
+
+def test_bad_checksum():
+    block = bytearray(header("a.txt", b"0", 0))
+    block[0] = ord("b")
+    with pytest.raises(TarError):
+        parse(bytes(block))
+
+
+@pytest.mark.parametrize("cut", [100, 512 + 5, 512 + 1024 - 1])
+def test_truncated(cut):
+    data = build([({"name": "a.txt"}, b"x" * 1000)], tarfile.USTAR_FORMAT)
+    with pytest.raises(TarError):
+        parse(data[:cut])
+
+
+def test_missing_end_blocks():
+    """省略结尾全零块的流，停在条目边界上也算完整"""
+    data = build([({"name": "a.txt"}, b"abc")], tarfile.USTAR_FORMAT)
+    assert parse(data[:1024]) == [("a.txt", 3, b"abc")]